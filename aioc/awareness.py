@@ -14,14 +14,16 @@ class Awareness:
         self._score = 0
 
     def apply_delta(self, delta: int) -> None:
-        self._score += delta
+        score = self._score + delta
 
-        if self._score < 0:
-            self._score = 0
-        elif self._score > (self._max - 1):
-            self._score = self._max - 1
+        if score < 0:
+            score = 0
+        elif score > (self._max - 1):
+            score = self._max - 1
 
-        log.info(f'mlist health: {self._score}')
+        if score != self._score:
+            log.info(f'mlist health: {score}')
+        self._score = score
 
     @property
     def health_score(self) -> int:
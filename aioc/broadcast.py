@@ -0,0 +1,189 @@
+"""Application broadcasts over gossip layer. Messages share probe, ack and
+gossip packets with membership updates, see ``Config.user_packet_ratio``,
+so fanning small messages, like cache invalidations, out to all members
+costs no extra connections.
+"""
+import asyncio
+import contextlib
+import random
+from collections import OrderedDict, deque
+from typing import Optional
+
+from .dissemination_queue import DisseminationQueue
+from .metrics import NULL_METRICS
+from .state import (UserMsg, encode_message, LENGTH_SIZE,
+                    MESSAGE_TYPE_SIZE)
+
+
+__all__ = ('Inbox', 'UserBroadcasts')
+
+
+def _msg_key(message):
+    return (message.sender, message.msg_id)
+
+
+class Inbox:
+    """Bounded buffer of received broadcasts of one reader, iterated as
+    async iterator of ``UserMsg``. When reader lags behind by more than
+    ``buffer_size`` messages, the oldest ones are dropped.
+    """
+
+    def __init__(self, broadcasts: 'UserBroadcasts',
+                 buffer_size: int) -> None:
+        self._broadcasts = broadcasts
+        self._loop = broadcasts._loop
+        self._messages = deque()
+        self._buffer_size = buffer_size
+        self._waiter = None
+        self._closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _put(self, message: UserMsg) -> None:
+        if len(self._messages) >= self._buffer_size:
+            self._messages.popleft()
+            self.dropped += 1
+            self._broadcasts._dropped.inc()
+        self._messages.append(message)
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self) -> Optional[UserMsg]:
+        """Waits for next message, returns None once inbox is closed."""
+        while not self._messages:
+            if self._closed:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._messages.popleft()
+
+    def close(self) -> None:
+        self._closed = True
+        self._messages.clear()
+        self._broadcasts._unsubscribe(self)
+        self._wakeup()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> UserMsg:
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class UserBroadcasts:
+    """Disseminates application messages to all members.
+
+    Messages have their own dissemination queue, bounded by
+    ``user_queue_size`` messages and ``user_queue_bytes`` bytes, and are
+    retransmitted ``user_retransmit_mult * log10(N + 1)`` times like
+    membership updates. Every node delivers new message to its inboxes
+    and queues it for retransmission, message ids seen recently are
+    remembered so duplicates are neither delivered nor retransmitted.
+
+        async for message in cluster.messages():
+            invalidate(message.payload)
+    """
+
+    def __init__(self, mlist, loop=None, metrics=None) -> None:
+        config = mlist.config
+        self._mlist = mlist
+        self._loop = loop or asyncio.get_event_loop()
+        self._queue = DisseminationQueue(
+            mlist, config.user_retransmit_mult,
+            max_size=config.user_queue_size,
+            max_bytes=config.user_queue_bytes,
+            key=_msg_key)
+        # broadcast has to fit into single gossip packet with compound
+        # message headers
+        self._max_size = (config.udp_packet_size - 2 * LENGTH_SIZE -
+                          MESSAGE_TYPE_SIZE)
+        self._codec = config.codec
+        self._seen = OrderedDict()
+        self._max_seen = config.user_dedup_size
+        self._buffer_size = config.user_buffer_size
+        self._inboxes = []
+        # ids are random, so ids from restarted node do not collide with
+        # ones other members still remember
+        self._random = random.SystemRandom()
+
+        metrics = metrics or NULL_METRICS
+        metrics.gauge('user.queue_depth', lambda: len(self._queue))
+        metrics.gauge('user.queue_dropped', lambda: self._queue.dropped)
+        self._sent = metrics.counter('user.sent')
+        self._received = metrics.counter('user.received')
+        self._duplicates = metrics.counter('user.duplicates')
+        self._dropped = metrics.counter('user.dropped')
+
+    @property
+    def queue(self):
+        return self._queue
+
+    def broadcast(self, payload: bytes) -> asyncio.Future:
+        """Queues ``payload`` for dissemination. Returned future is
+        resolved with True once message was retransmitted enough times
+        and with False if it was dropped from full queue.
+        """
+        message = UserMsg(self._mlist.local_node,
+                          self._random.getrandbits(64), bytes(payload))
+        size = len(encode_message(message, self._codec))
+        if size > self._max_size:
+            raise ValueError(
+                'Encoded broadcast size {} exceeds packet capacity {}'.format(
+                    size, self._max_size))
+        self._remember(_msg_key(message))
+        self._sent.inc()
+        waiter = self._loop.create_future()
+        self._queue.put(message, waiter)
+        return waiter
+
+    def receive(self, message: UserMsg) -> bool:
+        """Handles broadcast received from peer, returns False for
+        duplicates.
+        """
+        key = _msg_key(message)
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            self._duplicates.inc()
+            return False
+        self._remember(key)
+        self._received.inc()
+        self._queue.put(message)
+        for inbox in self._inboxes:
+            inbox._put(message)
+        return True
+
+    def _remember(self, key):
+        self._seen[key] = None
+        if len(self._seen) > self._max_seen:
+            self._seen.popitem(last=False)
+
+    def subscribe(self, buffer_size: int = None) -> Inbox:
+        """Returns inbox receiving broadcasts of other members from now
+        on.
+        """
+        inbox = Inbox(self, buffer_size or self._buffer_size)
+        self._inboxes.append(inbox)
+        return inbox
+
+    def _unsubscribe(self, inbox):
+        with contextlib.suppress(ValueError):
+            self._inboxes.remove(inbox)
+
+    def close(self) -> None:
+        for inbox in list(self._inboxes):
+            inbox.close()
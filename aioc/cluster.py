@@ -1,9 +1,14 @@
 import asyncio
-import contextlib
+import logging
 from functools import partial
 
+from .awareness import Awareness
+from .broadcast import UserBroadcasts
+from .events import EventListener
 from .failure_detector import FailureDetector
 from .gossiper import Gossiper
+from .metadata import MetaFetcher
+from .metrics import Metrics, NULL_METRICS
 from .mlist import MList
 from .net import create_server
 from .pusher import Pusher
@@ -15,13 +20,32 @@ from . import state
 
 __all__ = ('Cluster',)
 
+log = logging.getLogger(__name__)
+
 
 class Cluster:
 
-    def __init__(self, config, loop=None):
+    def __init__(self, config, loop=None, transport=None,
+                 meta_decoder=None):
+        # host is advertised to other members as our address
+        state.validate_host(config.host)
         self.config = config
-        self._mlist = MList(config)
-        self._listener = EventListener(loop)
+        # sockets are created by transport, so nodes can run on top of
+        # in-memory network, see aioc.sim
+        self._transport = transport
+        # meta_decoder parses node metadata into tags for queries,
+        # default expects b'key=value;key=value'
+        self._mlist = MList(config, meta_decoder=meta_decoder)
+        self._awareness = Awareness(config.awareness_max_multiplier)
+        self._metrics = Metrics() if config.metrics_enabled else NULL_METRICS
+        self._listener = EventListener(
+            loop, self._metrics,
+            snapshot=lambda: list(self._mlist._members.values()),
+            buffer_size=config.event_buffer_size,
+            overflow=config.event_overflow,
+            max_batch=config.event_batch_size)
+        self._broadcasts = UserBroadcasts(
+            self._mlist, loop, metrics=self._metrics)
 
         self._udp_server = None
         self._tcp_server = None
@@ -29,6 +53,7 @@ class Cluster:
 
         self._fd_ticker = None
         self._gossip_ticker = None
+        self._metrics_ticker = None
 
         self._closing = False
         self._started = False
@@ -39,71 +64,103 @@ class Cluster:
         h, p = self.config.host, self.config.port
         loop = self._loop
 
+        metrics = self._metrics
         udp_server = await create_server(
-            host=h, port=p, mlist=self._mlist, loop=loop)
+            host=h, port=p, mlist=self._mlist, loop=loop, metrics=metrics,
+            transport=self._transport)
 
-        self._gossiper = Gossiper(self._mlist, self._listener, self._lclock)
+        self._gossiper = Gossiper(
+            self._mlist, self._listener, self._lclock, self._awareness,
+            loop=loop, metrics=metrics)
 
         self._fd = FailureDetector(
-            self._mlist, udp_server, self._gossiper, self._lclock, loop)
+            self._mlist, udp_server, self._gossiper, self._lclock, loop,
+            awareness=self._awareness, metrics=metrics)
 
         udp_server.set_handler(self.handle)
+        # probes and acks carry pending broadcasts, see Gossiper.piggyback
+        udp_server.set_piggyback(self._gossiper.piggyback)
 
+        self._gossiper.set_user_queue(self._broadcasts.queue)
         self._udp_server = udp_server
 
-        tcp_server = await create_tcp_server(host=h, port=p, loop=loop)
+        tcp_server = await create_tcp_server(
+            host=h, port=p, config=self.config, loop=loop, metrics=metrics,
+            transport=self._transport)
         tcp_server.set_handler(self.handle_tcp_message)
         self._tcp_server = tcp_server
 
-        self._pusher = Pusher(self._mlist, self._gossiper, tcp_server, loop)
+        # fetches metadata gossiped as hash, see Config.meta_digest
+        self._meta_fetcher = MetaFetcher(
+            tcp_server, self._gossiper.meta_cache, self._mlist,
+            self._gossiper.apply_meta, loop=loop, metrics=metrics)
+        self._gossiper.set_meta_fetcher(self._meta_fetcher)
+
+        self._pusher = Pusher(
+            self._mlist, self._gossiper, tcp_server, loop, metrics=metrics)
 
         self._gossip_ticker = Ticker(
             partial(self._gossiper.gossip, self._udp_server),
-            self.config.gossip_interval,
+            self._gossiper.gossip_interval,
             loop=loop)
         self._gossip_ticker.start()
 
         self._fd_ticker = Ticker(
-            self._fd.probe, self.config.probe_interval,
+            self._fd.probe, self._fd.probe_interval,
             loop=loop)
         self._fd_ticker.start()
         self._pusher_ticker = Ticker(
-            self._pusher.push_pull, self.config.push_pull_interval,
+            self._pusher.push_pull, self._pusher.push_pull_interval,
             loop=loop)
         self._pusher_ticker.start()
+
+        if self._metrics.enabled:
+            metrics.gauge('members', lambda: self._mlist.num_nodes)
+            metrics.gauge('health_score', self.get_health_score)
+            self._metrics_ticker = Ticker(
+                self._metrics.flush, self.config.metrics_interval,
+                loop=loop)
+            self._metrics_ticker.start()
         self._started = True
 
-    async def join(self, *hosts) -> int:
-        success = await self._pusher.join(*hosts)
+    async def join(self, *hosts, first_success=False) -> int:
+        success = await self._pusher.join(*hosts, first_success=first_success)
         return success
 
     async def leave(self):
         incarnation = self._lclock.next_incarnation()
         node = self._mlist.local_node
         msg = Dead(node, incarnation, node, node)
-        import ipdb
-        ipdb.set_trace()
-
         self._gossiper.dead(msg)
 
         self._closing = True
         await self._fd_ticker.stop()
+        await self._fd.close()
+        self._gossiper.close()
         await self._gossip_ticker.stop()
         await self._listener.stop()
+        self._broadcasts.close()
         await self._pusher_ticker.stop()
+        self._pusher.close()
+        await self._meta_fetcher.close()
+        if self._metrics_ticker is not None:
+            await self._metrics_ticker.stop()
 
         await self._udp_server.close()
         await self._tcp_server.close()
 
     async def update_node(self, metadata):
-        assert len(metadata) < 500
+        if len(metadata) > self.config.max_meta_size:
+            raise ValueError(
+                'Metadata size {} exceeds max_meta_size {}'.format(
+                    len(metadata), self.config.max_meta_size))
         incarnation = self._lclock.next_incarnation()
         n = (self._mlist.local_node_meta
              ._replace(meta=metadata, incarnation=incarnation))
         self._mlist.update_node(n)
         a = Alive(n.node, n.node, n.incarnation, n.meta)
         waiter = self._loop.create_future()
-        self._gossiper.queue.put(a, waiter)
+        self._gossiper.broadcast_alive(a, waiter)
         await waiter
 
     @property
@@ -119,16 +176,58 @@ class Cluster:
     def listener(self):
         return self._listener
 
+    def subscribe(self, **kw):
+        """Returns async iterator of membership event batches, see
+        ``EventListener.subscribe`` for options.
+        """
+        return self._listener.subscribe(**kw)
+
     @property
     def members(self):
         return self._mlist.nodes
 
+    def query(self, status=None, tags=None, has=()):
+        """Returns immutable snapshot of members matching ``status``,
+        metadata ``tags`` and keys in ``has``, see ``MemberIndex.query``.
+        Snapshot is shared between callers until membership changes.
+
+            cluster.query(NodeStatus.ALIVE, {'role': 'web', 'zone': 'a'})
+        """
+        return self._mlist.index.query(status, tags, has)
+
+    def broadcast(self, payload):
+        """Sends ``payload`` to all members over gossip. Returns future
+        resolved with True once message was retransmitted enough times to
+        reach the cluster, False if it was dropped from full queue.
+        Payload has to fit into one UDP packet, otherwise ValueError is
+        raised.
+        """
+        return self._broadcasts.broadcast(payload)
+
+    def messages(self, buffer_size=None):
+        """Returns async iterator of ``UserMsg`` broadcast by other
+        members, see ``UserBroadcasts``.
+        """
+        return self._broadcasts.subscribe(buffer_size)
+
     @property
     def num_meber(self):
         return len(self._mlist._members)
 
     def get_health_score(self) -> int:
-        return 1
+        return self._awareness.health_score
+
+    def metrics(self):
+        """Returns snapshot of all metrics, empty if metrics are
+        disabled with ``metrics_enabled`` config option.
+        """
+        return self._metrics.snapshot()
+
+    def add_metrics_sink(self, sink):
+        """Registers sink that receives metrics snapshot every
+        ``metrics_interval`` seconds.
+        """
+        self._metrics.add_sink(sink)
 
     async def handle_tcp_message(self, message, conn):
         if isinstance(message, state.Ping):
@@ -137,6 +236,18 @@ class Cluster:
         elif isinstance(message, state.PushPull):
             await self.handle_push_pull(message, conn)
 
+        elif isinstance(message, state.PushPullChunk):
+            await self.handle_push_pull_chunk(message, conn)
+
+        elif isinstance(message, state.PushPullDigest):
+            await self.handle_push_pull_digest(message, conn)
+
+        elif isinstance(message, state.PushPullDelta):
+            await self.handle_push_pull_delta(message, conn)
+
+        elif isinstance(message, state.MetaReq):
+            await self.handle_meta_req(message, conn)
+
         elif isinstance(message, state.UserMsg):
             await self.handle_user(message, conn)
         else:
@@ -146,35 +257,46 @@ class Cluster:
         sequence_num = message.sequence_num
         # TODO: handle ack payload correctly
         ack = state.AckResp(sequence_num, b'ping')
-        raw = state.add_msg_size(state.encode_message(ack))
-        conn.writer.write(raw)
+        self._tcp_server.send_response(conn, ack)
 
     async def handle_user(self, message, conn):
-        print(message, conn)
+        self._broadcasts.receive(message)
 
     async def handle_push_pull(self, message, conn):
         metas = list(self._mlist._members.values())
         resp = PushPull(self._mlist.local_node, metas, False)
         self._gossiper.merge(message)
-        raw = state.add_msg_size(state.encode_message(resp))
-        conn.writer.write(raw)
+        self._tcp_server.send_response(conn, resp)
+
+    async def handle_push_pull_chunk(self, message, conn):
+        chunks = await self._pusher.handle_chunk(message)
+        if chunks is not None:
+            await self._tcp_server.send_stream_response(conn, chunks)
+
+    async def handle_push_pull_digest(self, message, conn):
+        resp = self._pusher.handle_digest(message)
+        await self._tcp_server.send_stream_response(conn, resp)
+
+    async def handle_push_pull_delta(self, message, conn):
+        resp = self._pusher.handle_delta(message)
+        self._tcp_server.send_response(conn, resp)
+
+    async def handle_meta_req(self, message, conn):
+        resp = self._meta_fetcher.handle_request(message)
+        self._tcp_server.send_response(conn, resp)
 
     async def handle_unknown(self, message, conn):
         print(message, conn)
 
     def handle(self, raw_message, addr, protocol):
-        if raw_message[0] == state.COMPOUND_MSG:
-            messages = state.decode_messages(raw_message)
-        else:
-            messages = [state.decode_message(raw_message)]
+        max_size = (max(len(raw_message), self.config.udp_packet_size) *
+                    state.UDP_MAX_EXPANSION)
+        messages = state.decode_messages(raw_message, max_size)
         for m in messages:
             try:
                 self.handle_udp_message(m, protocol)
-            except Exception as e:
-                import pdb
-                pdb.set_trace()
-                print(raw_message, addr, protocol)
-                raise e
+            except Exception:
+                log.exception('failed to handle %s from %s', m, addr)
 
     def handle_udp_message(self, message, udp_cm):
         if isinstance(message, state.Ping):
@@ -192,12 +314,18 @@ class Cluster:
         elif isinstance(message, state.Alive):
             self.handle_alive(message, udp_cm)
 
+        elif isinstance(message, state.AliveDigest):
+            self.handle_alive_digest(message, udp_cm)
+
         elif isinstance(message, state.Dead):
             self.handle_dead(message, udp_cm)
 
         elif isinstance(message, state.Suspect):
             self.handle_suspect(message, udp_cm)
 
+        elif isinstance(message, state.UserMsg):
+            self.handle_user_broadcast(message, udp_cm)
+
         else:
             raise RuntimeError("Can not handle message", message)
 
@@ -210,7 +338,6 @@ class Cluster:
 
     def handle_ack(self, message, udp_cm):
         self._fd.on_ack(message)
-        print("ACK", message, udp_cm)
 
     def handle_nack(self, message, udp_cm):
         self._fd.on_nack(message)
@@ -219,12 +346,18 @@ class Cluster:
     def handle_alive(self, message, udp_cm):
         self._gossiper.alive(message)
 
+    def handle_alive_digest(self, message, udp_cm):
+        self._gossiper.alive_digest(message)
+
     def handle_suspect(self, message, udp_cm):
         self._gossiper.suspect(message)
 
     def handle_dead(self, message, udp_cm):
         self._gossiper.dead(message)
 
+    def handle_user_broadcast(self, message, udp_cm):
+        self._broadcasts.receive(message)
+
     def __str__(self):
         c = self.config
         return "<Cluster: {}:{}>".format(c.host, c.port)
@@ -232,42 +365,3 @@ class Cluster:
     def __repr__(self):
         c = self.config
         return "<Cluster: {}:{}>".format(c.host, c.port)
-
-
-class EventListener:
-
-    def __init__(self, loop):
-        self._loop = loop
-        self._hander = None
-        self._queue = asyncio.Queue(loop=loop)
-        self._mover_task = asyncio.ensure_future(
-            self._mover(), loop=loop)
-
-    def notify(self, event_type, node):
-        if self._hander is None:
-            return
-        self._queue.put_nowait((event_type, node))
-
-    def add_handler(self, handler):
-        self._hander = handler
-
-    async def _mover(self):
-        event_type, node = await self._queue.get()
-        if self._hander is not None:
-            try:
-                await self._hander(event_type, node)
-            except Exception as e:
-                import pdb
-                pdb.set_trace()
-                print(e)
-                raise e
-
-    async def stop(self):
-        self._closing = True
-        if self._mover_task is None:
-            return
-
-        with contextlib.suppress(asyncio.CancelledError):
-            self._mover_task.cancel()
-            await self._mover_task
-            self._mover_task = None
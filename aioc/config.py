@@ -5,6 +5,7 @@ class _Config(NamedTuple):
     host: str
     port: int
     join_timeout: float = 10
+    join_concurrency: int = 4
     push_pull_interval: float = 3
     gossip_interval: float = 1
     gossip_nodes: int = 1
@@ -12,8 +13,48 @@ class _Config(NamedTuple):
     retransmit_mult: int = 2
     gossip_to_dead: int = 3600
     probe_timeout: float = 1
+    indirect_checks: int = 3
+    awareness_max_multiplier: int = 8
     suspicion_mult: float = 1
     suspicion_max_timeout_mult: float = 1
+    suspicion_tick: float = 0.1
+    max_queue_size: int = 4096
+    queue_overflow: str = 'drop_oldest'
+    udp_packet_size: int = 508
+    gossip_max_packets: int = 1
+    codec: str = 'cbor'
+    push_pull_buckets: int = 256
+    push_pull_chunk_size: int = 256
+    compression: str = 'zlib'
+    compression_level: int = 1
+    compression_threshold: int = 1024
+    tcp_compression: bool = False
+    gossip_compression: bool = False
+    tcp_connect_timeout: float = 5
+    tcp_read_timeout: float = 10
+    tcp_idle_timeout: float = 30
+    tcp_max_idle_connections: int = 2
+    metrics_enabled: bool = False
+    metrics_interval: float = 10
+    adaptive_gossip: bool = False
+    gossip_nodes_max: int = 4
+    gossip_interval_min: float = 0.1
+    gossip_backlog_high: int = 64
+    push_pull_scale_threshold: int = 32
+    push_pull_interval_max: float = 120
+    event_buffer_size: int = 1024
+    event_overflow: str = 'resync'
+    event_batch_size: int = 256
+    max_meta_size: int = 500
+    meta_digest: bool = False
+    meta_digest_threshold: int = 64
+    meta_cache_bytes: int = 4 * 1024 * 1024
+    user_queue_size: int = 1024
+    user_queue_bytes: int = 1024 * 1024
+    user_retransmit_mult: int = 4
+    user_packet_ratio: float = 0.5
+    user_dedup_size: int = 65536
+    user_buffer_size: int = 1024
 
 
 class Config(_Config):
@@ -26,6 +67,7 @@ LAN = Config(
     host='localhost',
     port=50001,
     join_timeout=10,
+    join_concurrency=4,
     push_pull_interval=15,
     gossip_interval=0.25,
     gossip_nodes=1,
@@ -33,6 +75,46 @@ LAN = Config(
     retransmit_mult=2,
     gossip_to_dead=3600,
     probe_timeout=1,
+    indirect_checks=3,
+    awareness_max_multiplier=8,
     suspicion_mult=1,
-    suspicion_max_timeout_mult=1
+    suspicion_max_timeout_mult=1,
+    suspicion_tick=0.1,
+    max_queue_size=4096,
+    queue_overflow='drop_oldest',
+    udp_packet_size=1400,
+    gossip_max_packets=4,
+    codec='cbor',
+    push_pull_buckets=256,
+    push_pull_chunk_size=256,
+    compression='zlib',
+    compression_level=1,
+    compression_threshold=1024,
+    tcp_compression=False,
+    gossip_compression=False,
+    tcp_connect_timeout=5,
+    tcp_read_timeout=10,
+    tcp_idle_timeout=30,
+    tcp_max_idle_connections=2,
+    metrics_enabled=False,
+    metrics_interval=10,
+    adaptive_gossip=False,
+    gossip_nodes_max=4,
+    gossip_interval_min=0.05,
+    gossip_backlog_high=64,
+    push_pull_scale_threshold=32,
+    push_pull_interval_max=120,
+    event_buffer_size=1024,
+    event_overflow='resync',
+    event_batch_size=256,
+    max_meta_size=500,
+    meta_digest=False,
+    meta_digest_threshold=64,
+    meta_cache_bytes=4 * 1024 * 1024,
+    user_queue_size=1024,
+    user_queue_bytes=1024 * 1024,
+    user_retransmit_mult=4,
+    user_packet_ratio=0.5,
+    user_dedup_size=65536,
+    user_buffer_size=1024
 )
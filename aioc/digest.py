@@ -0,0 +1,81 @@
+import zlib
+from typing import List, Set
+
+from .state import Node, NodeMeta, NodeStatus
+
+
+# higher precedence wins when two entries have same incarnation
+_STATUS_PRECEDENCE = {
+    NodeStatus.ALIVE: 0,
+    NodeStatus.SUSPECT: 1,
+    NodeStatus.DEAD: 2,
+}
+
+
+class MemberDigest:
+    """Compact summary of member table for anti-entropy.
+
+    Nodes are spread over ``num_buckets`` buckets by address hash, bucket
+    digest is XOR of hashes of ``(node, incarnation, status)`` of its
+    members, so it is updated incrementally in O(1) on every member
+    change. Two peers exchange digests and then only transfer members of
+    buckets that differ, so sync cost depends on divergence, not on
+    cluster size.
+    """
+
+    def __init__(self, num_buckets: int) -> None:
+        assert num_buckets > 0, 'digest needs at least one bucket'
+        self._num_buckets = num_buckets
+        self._buckets = [0] * num_buckets
+        self._members: List[Set[Node]] = [set() for _ in range(num_buckets)]
+
+    @property
+    def num_buckets(self) -> int:
+        return self._num_buckets
+
+    @property
+    def buckets(self) -> List[int]:
+        return list(self._buckets)
+
+    def bucket_of(self, node: Node) -> int:
+        key = '{}:{}'.format(node.host, node.port).encode()
+        return zlib.crc32(key) % self._num_buckets
+
+    def update(self, old: NodeMeta, new: NodeMeta) -> None:
+        """Replaces ``old`` entry of a node with ``new`` one, ``old`` is
+        None for nodes that were not known before.
+        """
+        i = self.bucket_of(new.node)
+        if old is not None:
+            self._buckets[i] ^= entry_hash(old)
+        self._buckets[i] ^= entry_hash(new)
+        self._members[i].add(new.node)
+
+    def nodes(self, buckets: List[int]) -> List[Node]:
+        nodes = []
+        for i in buckets:
+            nodes.extend(self._members[i])
+        return nodes
+
+    def diff(self, remote_buckets: List[int]) -> List[int]:
+        """Returns indexes of buckets that differ from remote digest."""
+        return [i for i, (a, b) in enumerate(zip(self._buckets,
+                                                 remote_buckets))
+                if a != b]
+
+
+def entry_hash(node_meta: NodeMeta) -> int:
+    node = node_meta.node
+    key = '{}:{}:{}:{}'.format(
+        node.host, node.port, node_meta.incarnation, int(node_meta.status))
+    return zlib.crc32(key.encode())
+
+
+def is_newer(a: NodeMeta, b: NodeMeta) -> bool:
+    """True if entry ``a`` supersedes entry ``b`` about the same node."""
+    if b is None:
+        return True
+    if a.incarnation != b.incarnation:
+        return a.incarnation > b.incarnation
+    return (_STATUS_PRECEDENCE[NodeStatus(a.status)] >
+            _STATUS_PRECEDENCE[NodeStatus(b.status)])
@@ -1,51 +1,242 @@
+import heapq
 import math
+from collections import OrderedDict
+from operator import attrgetter
+from enum import Enum
+from itertools import count
 
-from .state import encode_message, LENGTH_SIZE
+from .state import encode_message, LENGTH_SIZE, MESSAGE_TYPE_SIZE
+
+
+# get_update_up_to and get_update_packets give up after skipping this many
+# broadcasts too large for remaining space, so topping up nearly full probe
+# packet or packing queue of oversized broadcasts does not walk whole deep
+# queue
+MAX_SKIPPED = 8
+
+
+class OverflowPolicy(str, Enum):
+    # evict the oldest queued broadcast to make room for the new one
+    DROP_OLDEST = 'drop_oldest'
+    # keep the queue as is and reject the new broadcast
+    DROP_NEWEST = 'drop_newest'
+
+
+class _Entry:
+
+    __slots__ = ('key', 'message', 'raw_payload', 'waiter', 'valid')
+
+    def __init__(self, key, message, raw_payload, waiter):
+        self.key = key
+        self.message = message
+        self.raw_payload = raw_payload
+        self.waiter = waiter
+        self.valid = True
 
 
 class DisseminationQueue:
+    """Queue of pending broadcasts, ordered by number of transmits.
 
-    def __init__(self, mlist, retransmit_mult):
+    Entries are indexed by ``key``, node by default, so a newer broadcast
+    about the same node invalidates the older one in O(1); invalidated
+    entries are dropped lazily from the heap. Queue size is bounded by
+    ``max_size`` broadcasts and ``max_bytes`` of encoded broadcasts, when
+    the queue is full ``overflow`` policy decides which broadcast is
+    dropped.
+    """
+
+    def __init__(self, mlist, retransmit_mult, max_size=0,
+                 overflow=OverflowPolicy.DROP_OLDEST, *, max_bytes=0,
+                 key=attrgetter('node')):
         self._mlist = mlist
-        self._queue = []
+        self._codec = mlist.config.codec
         self._factor = retransmit_mult
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._overflow = OverflowPolicy(overflow)
+        self._key = key
+        self._bytes = 0
+        # heap of (attempts, seq, entry), seq keeps FIFO order between
+        # entries with same number of attempts
+        self._heap = []
+        self._index = OrderedDict()
+        self._seq = count()
+        self._stale = 0
+        self._dropped = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def size_bytes(self):
+        """Total size of encoded broadcasts in the queue."""
+        return self._bytes
 
     def put(self, message, waiter=None):
-        for i, (attempts, existing_msg, fut) in enumerate(self._queue):
-            if self._invalidates(message, existing_msg):
-                if (fut is not None) and (not fut.cancelled()):
-                    fut.set_result(True)
-                self._queue[i] = None
-        self._queue = [q for q in self._queue if q is not None]
+        key = self._key(message)
+        existing = self._index.pop(key, None)
+        if existing is not None:
+            self._invalidate(existing)
+            set_waiter(existing.waiter, True)
+
+        # messages are immutable, so encode once here instead of on
+        # every gossip tick for every target node
+        raw_payload = encode_message(message, self._codec)
+        size = len(raw_payload)
+        while self._is_full(size):
+            self._dropped += 1
+            if (self._overflow == OverflowPolicy.DROP_NEWEST or
+                    not self._index):
+                set_waiter(waiter, False)
+                return
+            _, oldest = self._index.popitem(last=False)
+            self._invalidate(oldest)
+            set_waiter(oldest.waiter, False)
+
+        entry = _Entry(key, message, raw_payload, waiter)
+        self._index[key] = entry
+        self._bytes += size
         attempts = 0
-        self._queue.append((attempts, message, waiter))
+        heapq.heappush(self._heap, (attempts, next(self._seq), entry))
+
+    def _is_full(self, size):
+        if self._max_size and len(self._index) >= self._max_size:
+            return True
+        return bool(self._max_bytes) and self._bytes + size > self._max_bytes
 
-    def _invalidates(self, a, b):
-        return a.node == b.node
+    def _invalidate(self, entry):
+        entry.valid = False
+        self._bytes -= len(entry.raw_payload)
+        self._stale += 1
+        if self._stale > len(self._index) + 64:
+            self._heap = [i for i in self._heap if i[2].valid]
+            heapq.heapify(self._heap)
+            self._stale = 0
 
     def get_update_up_to(self, bytes_available):
+        limit = self._retransmit_limit()
         buffers = []
-        factor = self._mlist.config.retransmit_mult
+        retained = []
+        heap = self._heap
+        skipped = 0
+        while heap and bytes_available > LENGTH_SIZE:
+            attempts, seq, entry = heapq.heappop(heap)
+            if not entry.valid:
+                self._stale -= 1
+                continue
 
-        num_nodes = self._mlist.num_nodes
-        limit = retransmit_limit(factor, num_nodes)
-        for i, (attempts, msg, fut) in enumerate(self._queue):
-            raw_payload = encode_message(msg)
-            if (len(raw_payload) + LENGTH_SIZE) <= bytes_available:
-                buffers.append(raw_payload)
-                bytes_available -= (len(raw_payload) + LENGTH_SIZE)
-
-                if limit <= attempts:
-                    self._queue[i] = None
-                    if (fut is not None) and (not fut.cancelled()):
-                        fut.set_result(True)
-                else:
-                    self._queue[i] = (attempts + 1, msg, fut)
-
-        self._queue = sorted([q for q in self._queue if q is not None],
-                             key=lambda i: i[0])
+            size = len(entry.raw_payload) + LENGTH_SIZE
+            if size > bytes_available:
+                retained.append((attempts, seq, entry))
+                skipped += 1
+                if skipped >= MAX_SKIPPED:
+                    break
+                continue
+
+            buffers.append(entry.raw_payload)
+            bytes_available -= size
+            self._transmitted(attempts, seq, entry, limit, retained)
+
+        for item in retained:
+            heapq.heappush(heap, item)
         return buffers
 
+    def get_update_packets(self, packet_size, max_packets):
+        """Packs pending broadcasts into at most ``max_packets`` compound
+        packets of ``packet_size`` bytes each. Returns list of packets,
+        every packet is a list of raw payloads.
+        """
+        capacity = packet_size - LENGTH_SIZE - MESSAGE_TYPE_SIZE
+        budget = capacity * max_packets
+        limit = self._retransmit_limit()
+
+        # take broadcasts in priority order until they could fill
+        # all packets, then bin-pack only those
+        candidates = []
+        retained = []
+        heap = self._heap
+        total = 0
+        skipped = 0
+        while heap and total < budget:
+            attempts, seq, entry = heapq.heappop(heap)
+            if not entry.valid:
+                self._stale -= 1
+                continue
+
+            size = len(entry.raw_payload) + LENGTH_SIZE
+            if size > capacity:
+                # entry does not fit into any packet of this size, move it
+                # behind broadcasts with same attempts, so few oversized
+                # entries do not block the queue once scan is bounded
+                retained.append((attempts, next(self._seq), entry))
+                skipped += 1
+                if skipped >= MAX_SKIPPED:
+                    break
+                continue
+            candidates.append((size, attempts, seq, entry))
+            total += size
+
+        bins, unplaced = pack(candidates, capacity, max_packets)
+        packets = []
+        for b in bins:
+            packet = []
+            for _, attempts, seq, entry in b:
+                packet.append(entry.raw_payload)
+                self._transmitted(attempts, seq, entry, limit, retained)
+            packets.append(packet)
+
+        for _, attempts, seq, entry in unplaced:
+            retained.append((attempts, seq, entry))
+        for item in retained:
+            heapq.heappush(heap, item)
+        return packets
+
+    def _retransmit_limit(self):
+        num_nodes = self._mlist.num_nodes
+        return retransmit_limit(self._factor, num_nodes)
+
+    def _transmitted(self, attempts, seq, entry, limit, retained):
+        if limit <= attempts:
+            entry.valid = False
+            self._bytes -= len(entry.raw_payload)
+            del self._index[entry.key]
+            set_waiter(entry.waiter, True)
+        else:
+            retained.append((attempts + 1, seq, entry))
+
+
+def pack(items, capacity, max_bins):
+    """First-fit decreasing bin packing of ``(size, ...)`` tuples into at
+    most ``max_bins`` bins of ``capacity`` bytes. Returns tuple of bins and
+    items that did not fit.
+    """
+    bins = []
+    free = []
+    unplaced = []
+    for item in sorted(items, key=lambda i: i[0], reverse=True):
+        size = item[0]
+        for i, room in enumerate(free):
+            if size <= room:
+                bins[i].append(item)
+                free[i] -= size
+                break
+        else:
+            if len(bins) < max_bins:
+                bins.append([item])
+                free.append(capacity - size)
+            else:
+                unplaced.append(item)
+    return bins, unplaced
+
+
+def set_waiter(fut, result):
+    if (fut is not None) and (not fut.done()):
+        fut.set_result(result)
+
 
 def retransmit_limit(retransmit_mult: int, num_nodes: int) -> int:
     node_scale = math.ceil(math.log10(num_nodes + 1))
@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict
+from enum import Enum
+from typing import Callable, List, NamedTuple, Optional
+
+from .metrics import NULL_METRICS
+from .state import EventType, Node, NodeMeta
+
+
+__all__ = ('Event', 'EventBatch', 'EventListener', 'EventOverflow',
+           'Subscription')
+
+log = logging.getLogger(__name__)
+
+
+class Event(NamedTuple):
+    type: EventType
+    node: Node
+    # member record for UPDATE events and for JOIN events coalesced with
+    # following update, None otherwise
+    meta: Optional[NodeMeta]
+
+
+class EventBatch(NamedTuple):
+    events: List[Event]
+    # batch is snapshot of all members as UPDATE events, subscriber lost
+    # events and should replace its view instead of applying them
+    resync: bool
+
+
+class EventOverflow(str, Enum):
+    # evict event of the node that changed least recently
+    DROP_OLDEST = 'drop_oldest'
+    # drop whole buffer, next batch is snapshot of member list
+    RESYNC = 'resync'
+
+
+class Subscription:
+    """Bounded buffer of pending events of one subscriber, iterated as
+    async iterator of ``EventBatch``.
+
+    While subscriber lags, events of the same node are coalesced into the
+    latest one, so buffer holds at most one event per node: update of
+    joined node keeps JOIN type with new member record, any other event
+    replaces pending one. When buffer of ``buffer_size`` nodes is full,
+    ``overflow`` policy applies: DROP_OLDEST evicts event of the node that
+    changed least recently, RESYNC drops all pending events and next batch
+    is snapshot of the member list with ``resync`` flag set.
+    """
+
+    def __init__(self, listener: 'EventListener', buffer_size: int,
+                 overflow: EventOverflow, max_batch: int,
+                 batch_delay: float) -> None:
+        self._listener = listener
+        self._loop = listener._loop
+        self._buffer_size = buffer_size
+        self._overflow = EventOverflow(overflow)
+        self._max_batch = max_batch
+        self._batch_delay = batch_delay
+        # node -> (event, notified at), ordered by last change
+        self._pending = OrderedDict()
+        self._resync = False
+        self._waiter = None
+        self._closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _put(self, event: Event, now: float) -> None:
+        pending = self._pending
+        existing = pending.pop(event.node, None)
+        if existing is not None:
+            old = existing[0]
+            if (event.type == EventType.UPDATE and
+                    old.type == EventType.JOIN):
+                event = old._replace(meta=event.meta)
+            # keep time of first notification for lag metric
+            now = existing[1]
+        elif len(pending) >= self._buffer_size:
+            self.dropped += 1
+            self._listener._dropped.inc()
+            if self._overflow == EventOverflow.RESYNC:
+                pending.clear()
+                self._resync = True
+                self._wakeup()
+                return
+            pending.popitem(last=False)
+        if self._resync:
+            # snapshot taken on delivery includes this change
+            return
+        pending[event.node] = (event, now)
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self) -> Optional[EventBatch]:
+        """Waits for pending events and returns them as batch of at most
+        ``max_batch`` events, None once subscription is closed.
+        """
+        while not (self._pending or self._resync):
+            if self._closed:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        if self._batch_delay and not self._resync:
+            # let burst of changes accumulate into one batch
+            await asyncio.sleep(self._batch_delay)
+            if self._closed:
+                return None
+
+        if self._resync:
+            self._resync = False
+            self._pending.clear()
+            self._listener._resyncs.inc()
+            events = [Event(EventType.UPDATE, m.node, m)
+                      for m in self._listener._snapshot()]
+            return EventBatch(events, True)
+
+        events = []
+        pending = self._pending
+        lag = self._loop.time() - next(iter(pending.values()))[1]
+        self._listener._lag.observe(lag)
+        while pending and len(events) < self._max_batch:
+            _, (event, _) = pending.popitem(last=False)
+            events.append(event)
+        return EventBatch(events, False)
+
+    def close(self) -> None:
+        self._closed = True
+        self._pending.clear()
+        self._resync = False
+        self._listener._unsubscribe(self)
+        self._wakeup()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> EventBatch:
+        batch = await self.get()
+        if batch is None:
+            raise StopAsyncIteration
+        return batch
+
+
+class EventListener:
+    """Fans out membership changes to subscribers. Notification only
+    appends event to buffers of current subscribers, so gossip hot path
+    does not wait on slow consumers.
+
+        async for batch in cluster.subscribe():
+            for event in batch.events:
+                ...
+    """
+
+    def __init__(self, loop=None, metrics=None,
+                 snapshot: Optional[Callable[[], List[NodeMeta]]] = None, *,
+                 buffer_size: int = 1024,
+                 overflow: EventOverflow = EventOverflow.RESYNC,
+                 max_batch: int = 256) -> None:
+        self._loop = loop or asyncio.get_event_loop()
+        self._snapshot = snapshot or list
+        self._buffer_size = buffer_size
+        self._overflow = EventOverflow(overflow)
+        self._max_batch = max_batch
+        self._subscriptions = []
+        self._handler_tasks = set()
+        metrics = metrics or NULL_METRICS
+        # time from notification to delivery of batch containing it
+        self._lag = metrics.histogram('events.lag')
+        self._dropped = metrics.counter('events.dropped')
+        self._resyncs = metrics.counter('events.resyncs')
+
+    def notify(self, event_type, node):
+        if not self._subscriptions:
+            return
+        if isinstance(node, NodeMeta):
+            event = Event(event_type, node.node, node)
+        else:
+            event = Event(event_type, node, None)
+        now = self._loop.time()
+        for subscription in self._subscriptions:
+            subscription._put(event, now)
+
+    def subscribe(self, *, buffer_size: int = None,
+                  overflow: EventOverflow = None, max_batch: int = None,
+                  batch_delay: float = 0) -> Subscription:
+        """Returns new subscription receiving events notified from now on,
+        defaults come from listener settings. With ``batch_delay`` batch
+        is delivered that many seconds after first pending event, so
+        bursts arrive in fewer larger batches.
+        """
+        subscription = Subscription(
+            self,
+            buffer_size or self._buffer_size,
+            overflow or self._overflow,
+            max_batch or self._max_batch,
+            batch_delay)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with contextlib.suppress(ValueError):
+            self._subscriptions.remove(subscription)
+
+    def add_handler(self, handler):
+        """Calls ``handler(event_type, node)`` coroutine for every event,
+        ``node`` is member record for UPDATE events and node address
+        otherwise.
+        """
+        subscription = self.subscribe()
+        task = asyncio.ensure_future(
+            self._dispatch(subscription, handler), loop=self._loop)
+        self._handler_tasks.add(task)
+        task.add_done_callback(self._handler_tasks.discard)
+
+    async def _dispatch(self, subscription, handler):
+        async for batch in subscription:
+            for event in batch.events:
+                node = event.node
+                if event.type == EventType.UPDATE:
+                    node = event.meta
+                try:
+                    await handler(event.type, node)
+                except Exception:
+                    log.exception('event handler failed')
+
+    async def stop(self):
+        for subscription in list(self._subscriptions):
+            subscription.close()
+        tasks = list(self._handler_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,35 +1,85 @@
 import asyncio  # noqa
 
-from .state import Ping, Suspect, NodeStatus, AckResp
-from .utils import LClock
+from .awareness import Awareness
+from .metrics import NULL_METRICS
+from .state import (Ping, Suspect, NodeStatus, AckResp, IndirectPingReq,
+                    NackResp)
 
 
 class FailureDetector:
 
-    def __init__(self, mlist, udp_server, gossiper, lclock, loop):
+    def __init__(self, mlist, udp_server, gossiper, lclock, loop,
+                 awareness=None, metrics=None):
         self._mlist = mlist
         self._udp_server = udp_server
         self._gossiper = gossiper
         self._probes = {}
+        self._nacks = {}
+        self._tasks = set()
         self._loop = loop
         self._node_timers = {}
         self._lclock = lclock
+        # local health, scales probe timeout and interval when this node
+        # is slow to process acks, see Lifeguard paper
+        self._awareness = awareness or Awareness(
+            mlist.config.awareness_max_multiplier)
+        metrics = metrics or NULL_METRICS
+        self._probes_sent = metrics.counter('fd.probes')
+        self._probe_rtt = metrics.histogram('fd.probe_rtt')
+        self._probe_timeouts = metrics.counter('fd.probe_timeouts')
+        self._probe_failures = metrics.counter('fd.probe_failures')
+
+        # nodes are probed round-robin in random order, so every live node
+        # is probed once per round, in about n * probe_interval
+        self._probe_nodes = []
+        self._probe_index = 0
+        self._mlist.add_join_handler(self._on_join)
+
+    @property
+    def awareness(self):
+        return self._awareness
+
+    def probe_interval(self) -> float:
+        interval = self._mlist.config.probe_interval
+        return self._awareness.scale_timeout(interval)
 
     async def probe(self) -> None:
+        node_meta = self._next_probe_node()
+        if node_meta is not None:
+            await self.ping_node(node_meta)
+
+    def _next_probe_node(self):
+        for _ in range(2):
+            while self._probe_index < len(self._probe_nodes):
+                node = self._probe_nodes[self._probe_index]
+                self._probe_index += 1
+                node_meta = self._mlist.node_meta(node)
+                if node_meta is None:
+                    continue
+                if node_meta.status in (NodeStatus.ALIVE,
+                                        NodeStatus.SUSPECT):
+                    return node_meta
+            self._reset_probe_round()
+        return None
 
-        def filter_func(node_meta):
-            if node_meta.node == self._mlist.local_node:
-                return False
-            # if node.status != ALIVE:
-            #    return False
-            return True
+    def _reset_probe_round(self):
+        nodes = self._mlist.live_nodes
+        self._mlist.random.shuffle(nodes)
+        self._probe_nodes = nodes
+        self._probe_index = 0
 
-        nodes = self._mlist.kselect(1, filter_func)
-        print("PROBE", nodes)
-        for node in nodes:
-            await self.ping_node(node)
+    def _on_join(self, node):
+        # new node is put at random position of current round, it is not
+        # probed before other nodes that waited for whole round already
+        i = self._mlist.random.randint(0, len(self._probe_nodes))
+        self._probe_nodes.insert(i, node)
+        if i < self._probe_index:
+            self._probe_index += 1
 
     async def ping_node(self, node_meta) -> None:
+        config = self._mlist.config
+        probe_timeout = self._awareness.scale_timeout(config.probe_timeout)
+        start = self._loop.time()
         sequence_num = self._lclock.next_sequence_num()
         msg = Ping(self._mlist.local_node, sequence_num, node_meta.node)
 
@@ -38,18 +88,56 @@ class FailureDetector:
             s = Suspect(self._mlist.local_node, node_meta.node, 1)
             msgs.append(s)
         waiter = self._loop.create_future()
-        self._probes[(node_meta.node, sequence_num)] = waiter
+        self._probes[sequence_num] = waiter
         self._udp_server.send_message(node_meta.node, *msgs)
+        self._probes_sent.inc()
         try:
-            ack = await asyncio.wait_for(
-                waiter, self._mlist.config.probe_timeout)
-            assert(ack)
-        except asyncio.TimeoutError as e:
-            print('ping_node', 'TimeoutError', e)
-            msg = Suspect(self._mlist.local_node,
-                          node_meta.node,
-                          node_meta.incarnation)
-            self._gossiper.suspect(msg)
+            if await self._wait_ack(waiter, probe_timeout):
+                self._probe_rtt.observe(self._loop.time() - start)
+                self._awareness.apply_delta(-1)
+                return
+            self._probe_timeouts.inc()
+
+            # direct probe failed, ask other nodes to probe target for us
+            # in case the problem is only with the link between us and it
+            helpers = self._indirect_ping(node_meta, sequence_num)
+            deadline = start + self.probe_interval()
+            timeout = max(deadline - self._loop.time(), probe_timeout)
+            if helpers and await self._wait_ack(waiter, timeout):
+                return
+            nacks = self._nacks.get(sequence_num, 0)
+        finally:
+            self._probes.pop(sequence_num, None)
+            self._nacks.pop(sequence_num, None)
+
+        self._probe_failures.inc()
+        # helpers that did not even nack point to problem on our side
+        if helpers:
+            self._awareness.apply_delta(len(helpers) - nacks)
+        else:
+            self._awareness.apply_delta(1)
+
+        msg = Suspect(self._mlist.local_node,
+                      node_meta.node,
+                      node_meta.incarnation)
+        self._gossiper.suspect(msg)
+
+    def _indirect_ping(self, node_meta, sequence_num):
+        k = self._mlist.config.indirect_checks
+        candidates = self._mlist.select(k + 1, suspect=False)
+        helpers = [h for h in candidates if h.node != node_meta.node][:k]
+        req = IndirectPingReq(
+            self._mlist.local_node, sequence_num, node_meta.node, True)
+        self._nacks[sequence_num] = 0
+        for helper in helpers:
+            self._udp_server.send_message(helper.node, req)
+        return helpers
+
+    async def _wait_ack(self, waiter, timeout) -> bool:
+        # asyncio.wait does not cancel waiter on timeout, so same waiter
+        # is reused for direct and indirect acks
+        await asyncio.wait((waiter, ), timeout=timeout)
+        return waiter.done()
 
     def on_ping(self, message: Ping) -> None:
         sequence_num = message.sequence_num
@@ -57,15 +145,46 @@ class FailureDetector:
         ack = AckResp(self._mlist.local_node, sequence_num, b'ping')
         self._udp_server.send_message(sender, ack)
 
-    def on_ping_request(self, message, addr):
-        pass
+    def on_indirect_ping(self, message: IndirectPingReq) -> None:
+        task = asyncio.ensure_future(
+            self._relay_ping(message), loop=self._loop)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    def on_ack(self, message):
-        node = message.sender
+    async def _relay_ping(self, req: IndirectPingReq) -> None:
+        sequence_num = self._lclock.next_sequence_num()
+        waiter = self._loop.create_future()
+        self._probes[sequence_num] = waiter
+        ping = Ping(self._mlist.local_node, sequence_num, req.target)
+        self._udp_server.send_message(req.target, ping)
+        try:
+            probe_timeout = self._mlist.config.probe_timeout
+            acked = await self._wait_ack(
+                waiter, self._awareness.scale_timeout(probe_timeout))
+        finally:
+            self._probes.pop(sequence_num, None)
+
+        local_node = self._mlist.local_node
+        if acked:
+            ack = AckResp(local_node, req.sequence_num, b'')
+            self._udp_server.send_message(req.sender, ack)
+        elif req.nack:
+            nack = NackResp(local_node, req.sequence_num)
+            self._udp_server.send_message(req.sender, nack)
 
-        waiter = self._probes.pop((node, message.sequence_num), None)
-        if waiter is not None and not waiter.cancelled():
+    def on_ack(self, message: AckResp) -> None:
+        # acks are matched by sequence number only, since ack for indirect
+        # probe is relayed by helper node and not sent by target itself
+        waiter = self._probes.pop(message.sequence_num, None)
+        if waiter is not None and not waiter.done():
             waiter.set_result(message)
 
-    def on_nack(self, message, addr):
-        pass
+    def on_nack(self, message: NackResp) -> None:
+        if message.sequence_num in self._nacks:
+            self._nacks[message.sequence_num] += 1
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
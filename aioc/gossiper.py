@@ -1,45 +1,181 @@
+import asyncio
+import math
 import time
+from functools import partial
 
 from .state import (
+    make_packet,
     make_compaund,
-    Alive, Suspect,
-    add_msg_size, NodeMeta,
+    add_msg_size,
+    maybe_compress,
+    LENGTH_SIZE,
+    MESSAGE_TYPE_SIZE,
+    Alive, AliveDigest, Suspect, Dead,
+    NodeMeta,
     EventType,
     NodeStatus)
+from .awareness import Awareness
 from .dissemination_queue import DisseminationQueue
+from .metadata import MetaCache, meta_hash
+from .metrics import NULL_METRICS
+from .suspicion import Suspicion, suspicion_timeout
+from .timer_wheel import TimerWheel
 
 
 __all__ = ('Gossiper',)
 
 
-MAX_UDP_PACKET_SIZE = 508
-
-
 class Gossiper:
 
-    def __init__(self, mlist, listener, lclock):
+    def __init__(self, mlist, listener, lclock, awareness=None, *,
+                 loop=None, metrics=None):
         self._mlist = mlist
-        retransmit_mult = self._mlist.config.retransmit_mult
-        self._queue = DisseminationQueue(self._mlist, retransmit_mult)
+        self._loop = loop or asyncio.get_event_loop()
+        config = self._mlist.config
+        self._awareness = awareness or Awareness(
+            config.awareness_max_multiplier)
+        self._queue = DisseminationQueue(
+            self._mlist, config.retransmit_mult,
+            max_size=config.max_queue_size,
+            overflow=config.queue_overflow)
         self._listener = listener
         self._suspicions = {}
+        # all suspicion timers share one wheel, so mass failure does not
+        # create thousands of event loop timers
+        self._timer_wheel = TimerWheel(config.suspicion_tick, loop=self._loop)
         self._lclock = lclock
+        # metadata blobs by hash, Alive broadcasts carry only hash of
+        # large metadata when meta_digest is enabled
+        self._meta_cache = MetaCache(config.meta_cache_bytes)
+        self._meta_fetcher = None
+        # application broadcasts, see aioc.broadcast
+        self._user_queue = None
+
+        metrics = metrics or NULL_METRICS
+        metrics.gauge('gossip.queue_depth', lambda: len(self._queue))
+        metrics.gauge('gossip.queue_dropped', lambda: self._queue.dropped)
+        metrics.gauge('suspicion.active', lambda: len(self._suspicions))
+        self._suspicions_started = metrics.counter('suspicion.started')
+        self._suspicions_refuted = metrics.counter('suspicion.refuted')
+        self._suspicions_expired = metrics.counter('suspicion.expired')
+        metrics.gauge('gossip.fanout', self.gossip_fanout)
+        metrics.gauge('gossip.interval', self.gossip_interval)
 
     @property
     def queue(self):
         return self._queue
 
+    @property
+    def meta_cache(self):
+        return self._meta_cache
+
+    def set_meta_fetcher(self, fetcher):
+        self._meta_fetcher = fetcher
+
+    def set_user_queue(self, queue):
+        """Sets queue of application broadcasts sharing gossip, probe and
+        ack packets with membership updates.
+        """
+        self._user_queue = queue
+
+    def _user_share(self, bytes_available):
+        # user broadcasts get at most user_packet_ratio of space while
+        # there are membership updates to send, whole space otherwise
+        if not self._queue:
+            return bytes_available
+        ratio = self._mlist.config.user_packet_ratio
+        return int(bytes_available * ratio)
+
+    def _backlog_pressure(self) -> float:
+        # 0 for empty queue, 1 once backlog reaches gossip_backlog_high
+        high = self._mlist.config.gossip_backlog_high
+        return min(len(self._queue) / high, 1.0)
+
+    def gossip_fanout(self) -> int:
+        """Number of nodes to gossip to per tick. In adaptive mode it
+        grows from ``gossip_nodes`` up to ``gossip_nodes_max`` with
+        dissemination queue backlog.
+        """
+        config = self._mlist.config
+        if not config.adaptive_gossip:
+            return config.gossip_nodes
+        extra = max(config.gossip_nodes_max - config.gossip_nodes, 0)
+        return config.gossip_nodes + math.ceil(
+            self._backlog_pressure() * extra)
+
+    def gossip_interval(self) -> float:
+        """Time between gossip ticks. In adaptive mode it shrinks from
+        ``gossip_interval`` down to ``gossip_interval_min`` with
+        dissemination queue backlog and goes back once queue drains.
+        """
+        config = self._mlist.config
+        if not config.adaptive_gossip:
+            return config.gossip_interval
+        span = max(config.gossip_interval - config.gossip_interval_min, 0)
+        return config.gossip_interval - self._backlog_pressure() * span
+
     async def gossip(self, udp_server):
-        for node_meta in self._mlist.select_gossip_nodes():
-            raw_payloads = self.queue.get_update_up_to(MAX_UDP_PACKET_SIZE)
-            if not raw_payloads:
+        config = self._mlist.config
+        fanout = self.gossip_fanout()
+        for node_meta in self._mlist.select_gossip_nodes(fanout):
+            if not self.queue and not self._user_queue:
                 return
-            raw = add_msg_size(make_compaund(*raw_payloads))
+            packets = self._update_packets(
+                config.udp_packet_size, config.gossip_max_packets)
             host, port = node_meta.node
             addr = (host, int(port))
-            udp_server.send_raw_message(addr, raw)
+            for raw_payloads in packets:
+                if config.gossip_compression:
+                    raw = self._compress_packet(raw_payloads)
+                else:
+                    raw = make_packet(*raw_payloads)
+                udp_server.send_raw_message(addr, raw)
 
-    def alive(self, message, waiter=None):
+    def _update_packets(self, packet_size, max_packets):
+        user_queue = self._user_queue
+        if not user_queue:
+            return self._queue.get_update_packets(packet_size, max_packets)
+        capacity = packet_size - LENGTH_SIZE - MESSAGE_TYPE_SIZE
+        share = self._user_share(capacity)
+        user_packets = user_queue.get_update_packets(
+            packet_size - capacity + share, max_packets)
+        if share == capacity:
+            return user_packets
+        packets = self._queue.get_update_packets(
+            packet_size - share, max_packets)
+        # membership and user packets are sized to share one packet
+        for i, user_packet in enumerate(user_packets):
+            if i < len(packets):
+                packets[i].extend(user_packet)
+            else:
+                packets.append(user_packet)
+        return packets
+
+    def piggyback(self, bytes_available):
+        """Returns pending broadcasts that fit into ``bytes_available``
+        bytes, used to fill probe and ack packets, so they spread gossip
+        without extra packets.
+        """
+        buffers = []
+        user_queue = self._user_queue
+        if user_queue:
+            buffers = user_queue.get_update_up_to(
+                self._user_share(bytes_available))
+            bytes_available -= sum(len(b) + LENGTH_SIZE for b in buffers)
+        if self._queue:
+            buffers.extend(self._queue.get_update_up_to(bytes_available))
+        return buffers
+
+    def _compress_packet(self, raw_payloads):
+        # packets are bounded by udp_packet_size, so threshold does not
+        # apply here, packet is compressed only if it gets smaller
+        config = self._mlist.config
+        compaund = make_compaund(*raw_payloads)
+        payload = maybe_compress(
+            compaund, config.compression, config.compression_level)
+        return add_msg_size(payload)
+
+    def alive(self, message, waiter=None, broadcast=None, meta_hash=None):
         a = message
         node = a.node
         node_meta = self._mlist.node_meta(a.node)
@@ -50,7 +186,8 @@ class Gossiper:
                 a.meta,
                 NodeStatus.ALIVE,
                 time.time(),
-                False)
+                False,
+                meta_hash)
 
             self._mlist.update_node(new_node_meta)
             self._listener.notify(EventType.JOIN, node)
@@ -61,14 +198,73 @@ class Gossiper:
             new_node_meta = node_meta._replace(
                 incarnation=a.incarnation,
                 meta=a.meta, status=NodeStatus.ALIVE,
-                state_change=time.time())
+                state_change=time.time(), meta_hash=meta_hash)
 
             self._mlist.update_node(new_node_meta)
-            self._suspicions.pop(a.node, None)
+            if self._stop_suspicion(a.node):
+                self._suspicions_refuted.inc()
 
-        self.queue.put(message, waiter=waiter)
+        if broadcast is None:
+            broadcast = self._alive_broadcast(message)
+        self.queue.put(broadcast, waiter=waiter)
         self._listener.notify(EventType.UPDATE, new_node_meta)
 
+    def alive_digest(self, message, waiter=None):
+        node_meta = self._mlist.node_meta(message.node)
+        if (node_meta is not None and
+                message.incarnation <= node_meta.incarnation):
+            # previous fetch of this incarnation metadata may have failed
+            if (message.incarnation == node_meta.incarnation and
+                    node_meta.meta_hash == message.meta_hash):
+                self._fetch_meta(message)
+            return
+        meta = self._meta_cache.get(message.meta_hash)
+        pending = None
+        if meta is None:
+            # status can not wait for metadata, refutation would come too
+            # late, metadata is updated once blob is fetched, until then
+            # entry keeps gossiped hash, so old metadata is not spread
+            meta = node_meta.meta if node_meta is not None else b''
+            pending = message.meta_hash
+        a = Alive(message.sender, message.node, message.incarnation, meta)
+        self.alive(a, waiter, broadcast=message, meta_hash=pending)
+        if pending is not None:
+            self._fetch_meta(message)
+
+    def _fetch_meta(self, message):
+        meta = self._meta_cache.get(message.meta_hash)
+        if meta is not None:
+            self.apply_meta(message.node, message.incarnation, meta)
+        elif self._meta_fetcher is not None:
+            self._meta_fetcher.fetch(
+                message.meta_hash, message.node, message.incarnation,
+                [message.node, message.sender])
+
+    def apply_meta(self, node, incarnation, meta):
+        """Sets fetched metadata of node, unless node has changed
+        since its hash was gossiped.
+        """
+        node_meta = self._mlist.node_meta(node)
+        if (node_meta is None or node_meta.incarnation != incarnation or
+                node_meta.meta_hash is None or
+                meta_hash(meta) != node_meta.meta_hash):
+            return
+        node_meta = node_meta._replace(meta=meta, meta_hash=None)
+        self._mlist.update_node(node_meta)
+        self._listener.notify(EventType.UPDATE, node_meta)
+
+    def broadcast_alive(self, message, waiter=None):
+        self.queue.put(self._alive_broadcast(message), waiter=waiter)
+
+    def _alive_broadcast(self, message):
+        config = self._mlist.config
+        if (not config.meta_digest or
+                len(message.meta) <= config.meta_digest_threshold):
+            return message
+        key = self._meta_cache.put(message.meta)
+        return AliveDigest(
+            message.sender, message.node, message.incarnation, key)
+
     def dead(self, message, waiter=None):
         node = message.node
         node_meta = self._mlist.node_meta(node)
@@ -76,11 +272,18 @@ class Gossiper:
             set_waiter(waiter)
             return
 
-        if message.incarnation <= node_meta.incarnation:
+        if message.incarnation < node_meta.incarnation:
             set_waiter(waiter)
             return
 
         is_local = message.node == self._mlist.local_node
+        if is_local and message.sender != self._mlist.local_node:
+            # only our own leave marks local node dead, peer accusations
+            # are refuted
+            self.refute(message)
+            set_waiter(waiter)
+            return
+
         if node_meta.status == NodeStatus.DEAD and not is_local:
             set_waiter(waiter)
             return
@@ -91,39 +294,103 @@ class Gossiper:
             state_change=time.time())
 
         self._mlist.update_node(node_meta)
+        self._stop_suspicion(node)
         self.queue.put(message, waiter=waiter)
         self._listener.notify(EventType.LEAVE, node_meta.node)
 
     def suspect(self, message: Suspect, waiter=None):
         s = message
-        node = self._mlist.node_meta(s.node)
-        if node is None:
+        node_meta = self._mlist.node_meta(s.node)
+        if node_meta is None:
             set_waiter(waiter)
             return
 
-        if s.incarnation < node.incarnation:
+        if s.incarnation < node_meta.incarnation:
             set_waiter(waiter)
             return
 
-        if s.node in self._suspicions:
-            suspicion = self._suspicions[s.node]
-            suspicion.confirm(s.sender)
+        suspicion = self._suspicions.get(s.node)
+        if suspicion is not None:
+            if not suspicion.confirm(s.sender):
+                set_waiter(waiter)
+                return
+            if s.node not in self._suspicions:
+                # confirmation fired overdue timer and node was declared
+                # dead, Dead broadcast must not be replaced by Suspect
+                set_waiter(waiter)
+                return
+            # only new confirmations are re-broadcast
             self.queue.put(message, waiter=waiter)
+            if suspicion.confirmations >= suspicion.k:
+                self._suspicion_timeout(s.node)
             return
 
         if s.node == self._mlist.local_node:
             self.refute(s)
+            set_waiter(waiter)
             return
 
-        suspicion = Suspicion(message.sender, )
+        if node_meta.status == NodeStatus.DEAD:
+            set_waiter(waiter)
+            return
 
-        self._mlist.update_node(node)
+        config = self._mlist.config
+        n = self._mlist.num_nodes
+        # confirmations from k other nodes drive timer to its minimum,
+        # there are no such nodes in small clusters
+        k = max(0, int(config.suspicion_mult - 2))
+        if n - 2 < k:
+            k = 0
+        min_time = suspicion_timeout(
+            config.suspicion_mult, n, config.probe_interval)
+        max_time = config.suspicion_max_timeout_mult * min_time
+        self._suspicions[s.node] = Suspicion(
+            s.sender, k, min_time, max_time,
+            partial(self._suspicion_timeout, s.node),
+            loop=self._loop, wheel=self._timer_wheel)
+        self._suspicions_started.inc()
+
+        node_meta = node_meta._replace(
+            status=NodeStatus.SUSPECT,
+            incarnation=s.incarnation,
+            state_change=time.time())
+        self._mlist.update_node(node_meta)
         self.queue.put(message, waiter=waiter)
-        self._listener.notify(EventType.UPDATE, node)
+        self._listener.notify(EventType.UPDATE, node_meta)
+
+    def _suspicion_timeout(self, node):
+        suspicion = self._suspicions.pop(node, None)
+        if suspicion is None:
+            return
+        suspicion.stop()
+        node_meta = self._mlist.node_meta(node)
+        if node_meta is None or node_meta.status != NodeStatus.SUSPECT:
+            return
+        self._suspicions_expired.inc()
+        local_node = self._mlist.local_node
+        d = Dead(local_node, node_meta.incarnation, node, local_node)
+        self.dead(d)
+
+    def _stop_suspicion(self, node):
+        suspicion = self._suspicions.pop(node, None)
+        if suspicion is not None:
+            suspicion.stop()
+        return suspicion is not None
+
+    def close(self):
+        for suspicion in self._suspicions.values():
+            suspicion.stop()
+        self._suspicions.clear()
+        self._timer_wheel.close()
 
     def merge(self, message):
         for n in message.nodes:
-            if n.status == NodeStatus.ALIVE:
+            if n.status == NodeStatus.ALIVE and n.meta_hash is not None:
+                # sender has not fetched metadata yet, pass on its hash
+                d = AliveDigest(
+                    message.sender, n.node, n.incarnation, n.meta_hash)
+                self.alive_digest(d)
+            elif n.status == NodeStatus.ALIVE:
                 a = Alive(message.sender, n.node, n.incarnation, n.meta)
                 self.alive(a)
             elif n.status in (NodeStatus.DEAD, NodeStatus.SUSPECT):
@@ -132,12 +399,15 @@ class Gossiper:
                 self.suspect(s)
 
     def refute(self, msg):
+        # being accused means others could not reach us in time, we may
+        # be the unhealthy one
+        self._awareness.apply_delta(1)
         incarnation = self._lclock.next_incarnation()
         if msg.incarnation >= incarnation:
            incarnation = self._lclock.skip_incarnation(msg.incarnation)
         node_meta = self._mlist.local_node_meta
         a = Alive(node_meta.node, node_meta.node, incarnation, node_meta.meta)
-        self.queue.put(a, waiter=None)
+        self.broadcast_alive(a)
 
 
 def set_waiter(fut):
@@ -0,0 +1,156 @@
+"""Large node metadata support: ``Alive`` broadcasts carry only hash of
+metadata, receivers fetch the blob by hash over TCP from the node itself
+or from the node that gossiped the hash to them. Blobs are cached by hash
+and concurrent fetches of the same hash are merged.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from .metrics import NULL_METRICS
+from .state import MetaReq, MetaResp, Node
+
+
+__all__ = ('MetaCache', 'MetaFetcher', 'meta_hash')
+
+log = logging.getLogger(__name__)
+
+
+META_HASH_SIZE = 16
+
+
+def meta_hash(meta: bytes) -> bytes:
+    return hashlib.blake2b(meta, digest_size=META_HASH_SIZE).digest()
+
+
+class MetaCache:
+    """LRU of metadata blobs by hash, bounded by total size of blobs."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._blobs: Dict[bytes, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        meta = self._blobs.get(key)
+        if meta is not None:
+            self._blobs.move_to_end(key)
+        return meta
+
+    def put(self, meta: bytes) -> bytes:
+        """Stores blob and returns its hash."""
+        meta = bytes(meta)
+        key = meta_hash(meta)
+        if key in self._blobs:
+            self._blobs.move_to_end(key)
+            return key
+        self._blobs[key] = meta
+        self._size += len(meta)
+        # most recent blob is kept even if it is larger than the limit
+        while self._size > self._max_bytes and len(self._blobs) > 1:
+            _, evicted = self._blobs.popitem(last=False)
+            self._size -= len(evicted)
+        return key
+
+
+class MetaFetcher:
+    """Fetches metadata blobs by hash over TCP. Requests for a hash that
+    is already being fetched only add node waiting for it, so a blob
+    shared by many nodes, like common role and zone tags, is fetched
+    once. Fetched blob is verified against hash, cached and passed to
+    ``on_fetched(node, incarnation, meta)`` for every waiting node.
+    """
+
+    def __init__(self, tcp, cache: MetaCache, mlist,
+                 on_fetched: Callable, loop=None, metrics=None) -> None:
+        self._tcp = tcp
+        self._cache = cache
+        self._mlist = mlist
+        self._local_node = mlist.local_node
+        self._on_fetched = on_fetched
+        self._loop = loop or asyncio.get_event_loop()
+        # hash -> (waiting node -> incarnation, sources to try)
+        self._pending = {}
+        self._tasks = set()
+        metrics = metrics or NULL_METRICS
+        self._fetched = metrics.counter('meta.fetched')
+        self._failures = metrics.counter('meta.fetch_failures')
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def fetch(self, key: bytes, node: Node, incarnation: int,
+              sources: List[Node]) -> None:
+        pending = self._pending.get(key)
+        if pending is not None:
+            waiting, known = pending
+            waiting[node] = max(incarnation, waiting.get(node, 0))
+            known.extend(s for s in sources if s not in known)
+            return
+
+        sources = [s for s in dict.fromkeys(sources)
+                   if s != self._local_node]
+        self._pending[key] = ({node: incarnation}, sources)
+        task = asyncio.ensure_future(self._fetch(key), loop=self._loop)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, key: bytes) -> None:
+        try:
+            meta = await self._request(key)
+        finally:
+            waiting, _ = self._pending.pop(key)
+        if meta is None:
+            self._failures.inc()
+            log.info('failed to fetch metadata %s', key.hex())
+            return
+        self._fetched.inc()
+        self._cache.put(meta)
+        for node, incarnation in waiting.items():
+            self._on_fetched(node, incarnation, meta)
+
+    async def _request(self, key: bytes) -> Optional[bytes]:
+        _, sources = self._pending[key]
+        msg = MetaReq(self._local_node, key)
+        # sources list may grow while we are waiting for response
+        i = 0
+        while i < len(sources):
+            source = sources[i]
+            i += 1
+            try:
+                resp = await self._tcp.send_message(source, msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # unreachable peer or garbled response, other sources
+                # may still have the blob
+                log.debug('metadata fetch from %s failed: %r', source, e)
+                continue
+            if (isinstance(resp, MetaResp) and resp.meta and
+                    meta_hash(resp.meta) == key):
+                return resp.meta
+        return None
+
+    def handle_request(self, message: MetaReq) -> MetaResp:
+        key = message.meta_hash
+        meta = self._cache.get(key)
+        if meta is None:
+            # own blob may be evicted from cache by blobs of others
+            local_meta = self._mlist.local_node_meta.meta
+            meta = local_meta if meta_hash(local_meta) == key else b''
+        return MetaResp(self._local_node, key, meta)
+
+    async def close(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,217 @@
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+log = logging.getLogger(__name__)
+
+
+# latency buckets in seconds, from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+class Counter:
+
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+
+    __slots__ = ('value', '_func')
+
+    def __init__(self, func: Optional[Callable] = None) -> None:
+        self.value = 0
+        # gauge backed by callable is evaluated on snapshot only, so
+        # sizes of queues and tables cost nothing on hot path
+        self._func = func
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def snapshot(self):
+        if self._func is not None:
+            return self._func()
+        return self.value
+
+
+class Histogram:
+
+    __slots__ = ('_bounds', '_counts', 'count', 'sum')
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self._bounds = tuple(buckets)
+        # last bucket counts values above upper bound
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        bounds = [str(b) for b in self._bounds] + ['inf']
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip(bounds, self._counts)),
+        }
+
+
+class MetricFamily:
+    """Metrics of same kind split by label, for example counter of
+    packets per message type.
+    """
+
+    __slots__ = ('_factory', '_metrics')
+
+    def __init__(self, factory: Callable) -> None:
+        self._factory = factory
+        self._metrics: Dict[str, object] = {}
+
+    def labels(self, label: str):
+        metric = self._metrics.get(label)
+        if metric is None:
+            metric = self._metrics[label] = self._factory()
+        return metric
+
+    def snapshot(self):
+        return {k: m.snapshot() for k, m in self._metrics.items()}
+
+
+class MetricsSink:
+    """Receives periodic metrics snapshots, subclass it to ship metrics
+    to monitoring system.
+    """
+
+    def emit(self, snapshot: Dict[str, object]) -> None:
+        raise NotImplementedError
+
+
+class LoggingSink(MetricsSink):
+
+    def __init__(self, logger: logging.Logger = log,
+                 level: int = logging.INFO) -> None:
+        self._logger = logger
+        self._level = level
+
+    def emit(self, snapshot: Dict[str, object]) -> None:
+        self._logger.log(self._level, 'metrics: %s', snapshot)
+
+
+class Metrics:
+    """Registry of named metrics. Components fetch their metrics once
+    at construction and update them directly, lookups by name do not
+    happen on hot paths.
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+        self._sinks: List[MetricsSink] = []
+
+    def _get(self, name: str, factory: Callable):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = factory()
+        return metric
+
+    def counter(self, name: str) -> Counter:
+        return self._get(name, Counter)
+
+    def gauge(self, name: str, func: Optional[Callable] = None) -> Gauge:
+        return self._get(name, lambda: Gauge(func))
+
+    def histogram(self, name: str,
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(name, lambda: Histogram(buckets))
+
+    def counter_family(self, name: str) -> MetricFamily:
+        return self._get(name, lambda: MetricFamily(Counter))
+
+    def snapshot(self) -> Dict[str, object]:
+        return {name: m.snapshot()
+                for name, m in sorted(self._metrics.items())}
+
+    def add_sink(self, sink: MetricsSink) -> None:
+        self._sinks.append(sink)
+
+    async def flush(self) -> None:
+        if not self._sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self._sinks:
+            sink.emit(snapshot)
+
+
+class _NullMetric:
+
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def labels(self, label):
+        return self
+
+
+_NULL_METRIC = _NullMetric()
+
+
+class NullMetrics:
+    """Registry used when metrics are disabled, every metric is shared
+    no-op object, so instrumented code costs one method call.
+    """
+
+    enabled = False
+
+    def counter(self, name):
+        return _NULL_METRIC
+
+    def gauge(self, name, func=None):
+        return _NULL_METRIC
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS):
+        return _NULL_METRIC
+
+    def counter_family(self, name):
+        return _NULL_METRIC
+
+    def snapshot(self):
+        return {}
+
+    def add_sink(self, sink):
+        pass
+
+    async def flush(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
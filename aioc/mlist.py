@@ -1,17 +1,20 @@
 import time
+from bisect import bisect_left, insort
 from random import Random
 
-from .state import Node, NodeStatus, NodeMeta
+from .digest import MemberDigest
+from .query import MemberIndex
+from .state import NodeStatus, NodeMeta, intern_node
 
 
 class MList:
 
-    def __init__(self, config, seed=None):
+    def __init__(self, config, seed=None, meta_decoder=None):
         self._config = config
         host, port = self._config.host, self._config.port
         self._address = (host, port)
 
-        node = Node(host, port)
+        node = intern_node(host, port)
         meta = NodeMeta(
             node=node,
             incarnation=1,
@@ -21,13 +24,33 @@ class MList:
             is_local=True)
 
         self._members = {node: meta}
-        self._nodes = [node]
 
-        self._dead = {}
-        self._suspected = {}
+        # bucketed digest of member table used by push/pull anti-entropy,
+        # disabled when push_pull_buckets is zero
+        self._digest = None
+        if config.push_pull_buckets:
+            self._digest = MemberDigest(config.push_pull_buckets)
+            self._digest.update(None, meta)
+
+        # secondary indexes by status and metadata tags for queries
+        self._index = MemberIndex(meta_decoder)
+        self._index.update(None, meta)
+
+        # remote members are partitioned by status, alive and suspect
+        # nodes live in arrays with swap-remove, so sampling and removal
+        # do not depend on cluster size; _positions maps node to its index
+        # in the partition. Dead nodes are kept sorted by state_change to
+        # find nodes that are still worth gossiping to with bisect.
+        self._partitions = {
+            NodeStatus.ALIVE: [],
+            NodeStatus.SUSPECT: [],
+        }
+        self._positions = {}
+        self._dead = []
 
         self._local_node = node
         self._random = Random(seed)
+        self._join_handlers = []
 
     @property
     def config(self):
@@ -47,7 +70,36 @@ class MList:
 
     @property
     def nodes(self):
-        return self._nodes
+        return list(self._members)
+
+    @property
+    def live_nodes(self):
+        """Remote nodes that are alive or suspected."""
+        return (self._partitions[NodeStatus.ALIVE] +
+                self._partitions[NodeStatus.SUSPECT])
+
+    @property
+    def random(self):
+        return self._random
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def index(self):
+        return self._index
+
+    def bucket_members(self, buckets):
+        """Returns metas of all members in given digest buckets."""
+        members = self._members
+        return [members[n] for n in self._digest.nodes(buckets)]
+
+    def add_join_handler(self, handler):
+        """Registers callable invoked with a node when it is added to the
+        member list for the first time.
+        """
+        self._join_handlers.append(handler)
 
     def kselect(self, k: int, filter_func=None):
         node_metas = list(filter(filter_func, self._members.values()))
@@ -58,24 +110,96 @@ class MList:
         selected_nodes = self._random.sample(node_metas, k)
         return selected_nodes
 
+    def select(self, k: int, suspect: bool = True,
+               dead_since: float = None):
+        """Randomly selects up to k remote alive nodes in O(k), suspect
+        nodes are included if ``suspect`` is set, dead nodes are included
+        only if they died after ``dead_since`` timestamp.
+        """
+        alive = self._partitions[NodeStatus.ALIVE]
+        suspected = self._partitions[NodeStatus.SUSPECT] if suspect else ()
+        dead = self._dead
+        dead_start = len(dead)
+        if dead_since is not None:
+            dead_start = bisect_left(dead, (dead_since,))
+
+        num_alive = len(alive)
+        num_live = num_alive + len(suspected)
+        total = num_live + len(dead) - dead_start
+        if total <= k:
+            indexes = range(total)
+        else:
+            indexes = self._random.sample(range(total), k)
+
+        members = self._members
+        selected = []
+        for i in indexes:
+            if i < num_alive:
+                node = alive[i]
+            elif i < num_live:
+                node = suspected[i - num_alive]
+            else:
+                _, node = dead[dead_start + i - num_live]
+            selected.append(members[node])
+        return selected
+
     def node_meta(self, node):
         # TODO: make immutable
         return self._members.get(node)
 
     def update_node(self, node_meta):
-        self._members[node_meta.node] = node_meta
-        self._nodes.append(node_meta.node)
-
-    def select_gossip_nodes(self):
-        def filter_func(node_meta):
-            if node_meta.is_local:
-                return False
-
-            gossip_to_dead = self.config.gossip_to_dead
-            if (node_meta.status == NodeStatus.DEAD and
-                    (time.time() - node_meta.state_change) > gossip_to_dead):
-                return False
-            return True
-
-        gossip_nodes = min(self.config.gossip_nodes, self.num_nodes - 1)
-        return self.kselect(gossip_nodes, filter_func)
+        node = node_meta.node
+        old = self._members.get(node)
+        self._members[node] = node_meta
+        if self._digest is not None:
+            self._digest.update(old, node_meta)
+        self._index.update(old, node_meta)
+        if node == self._local_node:
+            return
+
+        if old is not None:
+            if (old.status == node_meta.status and
+                    old.status != NodeStatus.DEAD):
+                return
+            self._remove_index(old)
+        self._add_index(node_meta)
+
+        if old is None:
+            for handler in self._join_handlers:
+                handler(node)
+
+    def _add_index(self, node_meta):
+        node = node_meta.node
+        if node_meta.status == NodeStatus.DEAD:
+            insort(self._dead, (node_meta.state_change, node))
+            return
+
+        partition = self._partitions[self._partition_status(node_meta)]
+        self._positions[node] = len(partition)
+        partition.append(node)
+
+    def _remove_index(self, node_meta):
+        node = node_meta.node
+        if node_meta.status == NodeStatus.DEAD:
+            i = bisect_left(self._dead, (node_meta.state_change, node))
+            del self._dead[i]
+            return
+
+        partition = self._partitions[self._partition_status(node_meta)]
+        i = self._positions.pop(node)
+        last = partition.pop()
+        if i < len(partition):
+            partition[i] = last
+            self._positions[last] = i
+
+    def _partition_status(self, node_meta):
+        if node_meta.status == NodeStatus.SUSPECT:
+            return NodeStatus.SUSPECT
+        return NodeStatus.ALIVE
+
+    def select_gossip_nodes(self, num_nodes: int = None):
+        if num_nodes is None:
+            num_nodes = self.config.gossip_nodes
+        gossip_nodes = min(num_nodes, self.num_nodes - 1)
+        dead_since = time.time() - self.config.gossip_to_dead
+        return self.select(gossip_nodes, dead_since=dead_since)
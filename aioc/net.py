@@ -1,32 +1,66 @@
 import asyncio
 from . import state
+from .metrics import NULL_METRICS
+from .transport import AsyncioTransport
 
 
 class UDPConnectionManager:
 
-    def __init__(self, protocol):
+    def __init__(self, protocol, codec=state.CBOR_CODEC, metrics=None,
+                 packet_size=508):
         self._protocol = protocol
+        self._codec = codec
+        self._packet_size = packet_size
+        # callable returning pending broadcasts that fit into given number
+        # of bytes, they fill the rest of every packet we send anyway
+        self._piggyback = None
+        metrics = metrics or NULL_METRICS
+        self._metrics_enabled = metrics.enabled
+        self._packets_sent = metrics.counter_family('udp.packets_sent')
+        self._bytes_sent = metrics.counter_family('udp.bytes_sent')
 
     def send_message(self, address, *messages):
-        raw = state.add_msg_size(state.encode_messages(*messages))
-        self._protocol.sendto(raw, address)
+        raw_payloads = [state.encode_message(m, self._codec)
+                        for m in messages]
+        if self._piggyback is not None:
+            used = state.LENGTH_SIZE + state.MESSAGE_TYPE_SIZE
+            for p in raw_payloads:
+                used += state.LENGTH_SIZE + len(p)
+            raw_payloads.extend(self._piggyback(self._packet_size - used))
+        if len(raw_payloads) == 1:
+            # nothing to piggyback, compound header would be pure overhead
+            raw = state.add_msg_size(raw_payloads[0])
+        else:
+            raw = state.make_packet(*raw_payloads)
+        self.send_raw_message(address, raw)
 
     def send_raw_message(self, address, raw):
+        if self._metrics_enabled:
+            count_packet(memoryview(raw)[state.LENGTH_SIZE:],
+                         self._packets_sent, self._bytes_sent)
         self._protocol.sendto(raw, address)
 
     def set_handler(self, handler):
         self._protocol.set_handler(handler)
 
+    def set_piggyback(self, piggyback):
+        self._piggyback = piggyback
+
     async def close(self):
         self._protocol.close()
 
 
 class UDPServerProtocol(asyncio.Protocol):
 
-    def __init__(self, loop):
+    def __init__(self, loop, metrics=None):
         self._transport = None
         self._loop = loop
         self._handler = None
+        metrics = metrics or NULL_METRICS
+        self._metrics_enabled = metrics.enabled
+        self._packets_received = metrics.counter_family(
+            'udp.packets_received')
+        self._bytes_received = metrics.counter_family('udp.bytes_received')
 
     def connection_made(self, transport):
         self._transport = transport
@@ -41,7 +75,10 @@ class UDPServerProtocol(asyncio.Protocol):
 
         size_data = state.decode_msg_size(data)
         header = state.LENGTH_SIZE
-        raw_message = data[header: header + size_data]
+        raw_message = memoryview(data)[header: header + size_data]
+        if self._metrics_enabled:
+            count_packet(raw_message, self._packets_received,
+                         self._bytes_received)
         self._handler(raw_message, addr, self)
 
     def connection_lost(self, exc):
@@ -55,9 +92,45 @@ class UDPServerProtocol(asyncio.Protocol):
         self._transport = None
 
 
-async def create_server(*, host='127.0.0.1', port=9999, mlist, loop):
+def message_sizes(raw_message):
+    """Yields ``(type name, size)`` of messages in packet, sizes include
+    length prefix. Messages of compound packet are reported separately,
+    compressed packet is reported as a whole.
+    """
+    message_type = raw_message[0]
+    if message_type != state.COMPOUND_MSG:
+        yield state.message_type_name(message_type), (
+            state.LENGTH_SIZE + len(raw_message))
+        return
+    offset = state.MESSAGE_TYPE_SIZE
+    end = len(raw_message)
+    while offset + state.LENGTH_SIZE < end:
+        size = state.decode_msg_size(raw_message, offset)
+        offset += state.LENGTH_SIZE
+        yield state.message_type_name(raw_message[offset]), (
+            state.LENGTH_SIZE + size)
+        offset += size
+
+
+def count_packet(raw_message, packets, sizes):
+    # packet is counted once under every message type it carries, so probe
+    # traffic stays visible when gossip is piggybacked on it; bytes are
+    # sizes of contained messages, compound header is not attributed
+    by_type = {}
+    for kind, size in message_sizes(raw_message):
+        by_type[kind] = by_type.get(kind, 0) + size
+    for kind, size in by_type.items():
+        packets.labels(kind).inc()
+        sizes.labels(kind).inc(size)
+
+
+async def create_server(*, host='127.0.0.1', port=9999, mlist, loop,
+                        metrics=None, transport=None):
     address = (host, port)
-    _, protocol = await loop.create_datagram_endpoint(
-        lambda: UDPServerProtocol(loop),
+    transport = transport or AsyncioTransport(loop)
+    _, protocol = await transport.create_datagram_endpoint(
+        lambda: UDPServerProtocol(loop, metrics),
         local_addr=address)
-    return UDPConnectionManager(protocol)
+    config = mlist.config
+    return UDPConnectionManager(
+        protocol, config.codec, metrics, config.udp_packet_size)
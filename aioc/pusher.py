@@ -1,29 +1,140 @@
-from .state import PushPull
-import time
+import asyncio
+import logging
+import math
+
+from .digest import is_newer
+from .metrics import NULL_METRICS
+from .state import PushPullDigest, PushPullDelta, PushPullChunk
 
 
 __all__ = ('Pusher',)
 
+log = logging.getLogger(__name__)
+
 
 class Pusher:
 
-    def __init__(self, mlist, gossiper, tcp, loop):
+    def __init__(self, mlist, gossiper, tcp, loop, metrics=None):
         self._loop = loop
         self._mlist = mlist
         self._gossiper = gossiper
         self._tcp = tcp
+        # joins that keep syncing with remaining seeds after first success
+        self._background = set()
+        # timers cancelling background joins at join deadline
+        self._deadlines = set()
+        metrics = metrics or NULL_METRICS
+        self._duration = metrics.histogram('push_pull.duration')
+        self._failures = metrics.counter('push_pull.failures')
+        self._members_received = metrics.counter('push_pull.members_received')
 
-    async def push_pull_address(self, address):
-        print('PUSHPUL', address, time.time())
-        metas = list(self._mlist._members.values())
-        msg = PushPull(self._mlist.local_node, metas, True)
+    def push_pull_interval(self) -> float:
+        """Time between push/pull rounds. In adaptive mode it grows with
+        cluster size, see ``push_pull_scale``, up to
+        ``push_pull_interval_max``.
+        """
+        config = self._mlist.config
+        if not config.adaptive_gossip:
+            return config.push_pull_interval
+        interval = push_pull_scale(
+            config.push_pull_interval, self._mlist.num_nodes,
+            config.push_pull_scale_threshold)
+        return min(interval, max(config.push_pull_interval_max,
+                                 config.push_pull_interval))
+
+    async def push_pull_address(self, address, join=False) -> bool:
+        log.debug('push/pull with %s', address)
+        start = self._loop.time()
         try:
-            # TODO: add timeout
-            resp = await self._tcp.send_message(address, msg)
-        except OSError as e:
-            print(e)
-        else:
-            self._gossiper.merge(resp)
+            if join or self._mlist.digest is None:
+                await self._push_pull_full(address, join)
+            else:
+                await self._push_pull_delta(address)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.info('push/pull with %s failed: %r', address, e)
+            self._failures.inc()
+            return False
+        self._duration.observe(self._loop.time() - start)
+        return True
+
+    async def _push_pull_full(self, address, join):
+        await self._tcp.send_stream(
+            address, self.chunks(join), self.merge_chunk)
+
+    def chunks(self, join):
+        """Splits full state into chunks of ``push_pull_chunk_size``
+        members, chunks share member records with member list, so frames
+        are encoded one at a time when streamed.
+        """
+        size = self._mlist.config.push_pull_chunk_size
+        metas = list(self._mlist._members.values())
+        local_node = self._mlist.local_node
+        return [PushPullChunk(local_node, metas[i:i + size], join,
+                              i + size >= len(metas))
+                for i in range(0, len(metas), size)]
+
+    async def merge_chunk(self, chunk):
+        self._merge(chunk)
+        # let probes and acks through between chunks of large state
+        await asyncio.sleep(0)
+        return chunk.last
+
+    async def handle_chunk(self, chunk):
+        """Merges streamed chunk, returns our full state chunks once last
+        chunk is received.
+        """
+        await self.merge_chunk(chunk)
+        if chunk.last:
+            return self.chunks(False)
+        return None
+
+    async def _push_pull_delta(self, address):
+        """Anti-entropy round that ships only divergent members: send our
+        digest, receive remote members of buckets that differ, then push
+        back our entries in those buckets that are newer than remote ones.
+        """
+        local_node = self._mlist.local_node
+        msg = PushPullDigest(local_node, self._mlist.digest.buckets)
+        resp = None
+
+        async def handler(message):
+            nonlocal resp
+            if isinstance(message, PushPullChunk):
+                # remote does not share our digest layout, it streams
+                # full state
+                return await self.merge_chunk(message)
+            resp = message
+            return True
+
+        await self._tcp.send_stream(address, [msg], handler)
+        if resp is None or not resp.buckets:
+            return
+
+        remote = {n.node: n for n in resp.nodes}
+        newer = [n for n in self._mlist.bucket_members(resp.buckets)
+                 if is_newer(n, remote.get(n.node))]
+        self._merge(resp)
+        if newer:
+            msg = PushPullDelta(local_node, newer, [])
+            await self._tcp.send_message(address, msg)
+
+    def handle_digest(self, message):
+        """Returns messages answering remote digest: our members of
+        differing buckets, or full state chunks when digest layouts
+        differ.
+        """
+        local_node = self._mlist.local_node
+        digest = self._mlist.digest
+        if digest is None or len(message.buckets) != digest.num_buckets:
+            return self.chunks(False)
+
+        buckets = digest.diff(message.buckets)
+        metas = self._mlist.bucket_members(buckets)
+        return [PushPullDelta(local_node, metas, buckets)]
+
+    def handle_delta(self, message):
+        self._merge(message)
+        return PushPullDelta(self._mlist.local_node, [], [])
 
     async def push_pull(self):
         """push_pull is invoked periodically to randomly perform a complete state
@@ -31,22 +142,95 @@ class Pusher:
         reasonably expensive as the entire state of this node is exchanged
         with the other node.
         """
-
-        def f(meta):
-            return not meta.is_local
-
-        metas = self._mlist.kselect(1, f)
+        metas = self._mlist.select(1)
         for meta in metas:
             await self.push_pull_address(meta.node)
 
-    async def join(self, *hosts) -> int:
+    async def join(self, *hosts, first_success: bool = False) -> int:
+        """Exchanges full state with seed hosts concurrently, at most
+        ``join_concurrency`` at a time, and returns number of seeds that
+        answered within ``join_timeout``. Failed seeds are skipped. With
+        ``first_success`` returns as soon as one seed answered, remaining
+        seeds are synced in background until the same deadline.
+        """
+        config = self._mlist.config
+        semaphore = asyncio.Semaphore(config.join_concurrency)
+
+        async def sync(host):
+            async with semaphore:
+                try:
+                    return await self.push_pull_address(host, join=True)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # bad or incompatible seed must not abort whole join
+                    log.exception('join via %s failed', host)
+                    self._failures.inc()
+                    return False
+
+        pending = {asyncio.ensure_future(sync(h)) for h in hosts}
+        deadline = self._loop.time() + config.join_timeout
         success = 0
-        for h in hosts:
-            try:
-                await self.push_pull_address(h)
-                success += 1
-            except OSError as e:
-                # TODO: add proper error handling in separate function
-                print(e)
-                raise e
-        assert success > 0
+        try:
+            while pending:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                return_when = (asyncio.FIRST_COMPLETED if first_success
+                               else asyncio.ALL_COMPLETED)
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=return_when)
+                success += sum(t.result() for t in done)
+                if first_success and success:
+                    self._finish_in_background(pending, deadline)
+                    pending = set()
+                    return success
+        finally:
+            cancel_tasks(pending)
+        return success
+
+    def _finish_in_background(self, tasks, deadline):
+        if not tasks:
+            return
+        remaining = set(tasks)
+        handle = self._loop.call_at(deadline, cancel_tasks, remaining)
+        self._deadlines.add(handle)
+
+        def done(task):
+            self._background.discard(task)
+            remaining.discard(task)
+            if not remaining:
+                handle.cancel()
+                self._deadlines.discard(handle)
+
+        self._background.update(tasks)
+        for task in tasks:
+            task.add_done_callback(done)
+
+    def _merge(self, message):
+        self._members_received.inc(len(message.nodes))
+        self._gossiper.merge(message)
+
+    def close(self):
+        cancel_tasks(self._background)
+        for handle in self._deadlines:
+            handle.cancel()
+        self._deadlines.clear()
+
+
+def cancel_tasks(tasks):
+    for task in list(tasks):
+        task.cancel()
+
+
+def push_pull_scale(interval: float, num_nodes: int,
+                    threshold: int = 32) -> float:
+    """Scales push/pull interval with cluster size, same as memberlist
+    pushPullScale: interval is kept up to ``threshold`` nodes and is
+    multiplied by one more every time cluster size doubles above it, so
+    total push/pull traffic grows slower than the cluster.
+    """
+    if num_nodes <= threshold:
+        return interval
+    multiplier = math.ceil(math.log2(num_nodes) - math.log2(threshold)) + 1
+    return interval * multiplier
@@ -0,0 +1,171 @@
+import logging
+from typing import (Callable, Dict, Iterable, Iterator, Mapping, Optional,
+                    Tuple)
+
+from .state import Node, NodeMeta, NodeStatus
+
+
+__all__ = ('MemberIndex', 'Snapshot', 'parse_tags')
+
+log = logging.getLogger(__name__)
+
+
+MetaDecoder = Callable[[bytes], Mapping[str, str]]
+
+# cached query results are dropped all at once when there are this many,
+# bounds memory when readers issue many distinct queries
+MAX_CACHED_QUERIES = 1024
+
+
+def parse_tags(meta: bytes) -> Dict[str, str]:
+    """Default metadata decoder, parses ``b'role=web;zone=us-east-1a'``
+    into dict of tags. Keys without value get empty string, undecodable
+    metadata has no tags.
+    """
+    if not meta:
+        return {}
+    try:
+        text = bytes(meta).decode('utf-8')
+    except UnicodeDecodeError:
+        return {}
+    tags = {}
+    for item in text.split(';'):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key:
+            tags[key] = value.strip()
+    return tags
+
+
+class Snapshot:
+    """Immutable result of member query taken at index ``version``. Same
+    snapshot object is returned to every reader until index changes, so
+    it must not be modified.
+    """
+
+    __slots__ = ('version', 'members')
+
+    def __init__(self, version: int, members: Tuple[NodeMeta, ...]) -> None:
+        self.version = version
+        self.members = members
+
+    @property
+    def nodes(self) -> Tuple[Node, ...]:
+        return tuple(m.node for m in self.members)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[NodeMeta]:
+        return iter(self.members)
+
+    def __repr__(self) -> str:
+        return '<Snapshot version={} members={}>'.format(
+            self.version, len(self.members))
+
+
+class MemberIndex:
+    """Secondary indexes of member table by status, metadata tag
+    ``(key, value)`` and metadata key, updated incrementally on every
+    member change. Query intersects index sets starting from the smallest
+    one, so its cost depends on result size, not cluster size; results
+    are cached until next change.
+    """
+
+    def __init__(self, decoder: Optional[MetaDecoder] = None) -> None:
+        self._decoder = decoder or parse_tags
+        self._version = 0
+        self._members: Dict[Node, NodeMeta] = {}
+        self._tags: Dict[Node, Mapping[str, str]] = {}
+        self._by_status: Dict[NodeStatus, set] = {s: set()
+                                                  for s in NodeStatus}
+        self._by_tag: Dict[Tuple[str, str], set] = {}
+        self._by_key: Dict[str, set] = {}
+        self._cache: Dict[tuple, Snapshot] = {}
+
+    @property
+    def version(self) -> int:
+        """Incremented on every member change."""
+        return self._version
+
+    def tags(self, node: Node) -> Mapping[str, str]:
+        return self._tags.get(node, {})
+
+    def update(self, old: Optional[NodeMeta], new: NodeMeta) -> None:
+        node = new.node
+        self._version += 1
+        if self._cache:
+            self._cache = {}
+        self._members[node] = new
+
+        if old is None or old.status != new.status:
+            if old is not None:
+                self._by_status[old.status].discard(node)
+            self._by_status[new.status].add(node)
+
+        if old is None or old.meta != new.meta:
+            old_tags = self._tags.get(node, {})
+            new_tags = self._decode(new)
+            for key, value in old_tags.items():
+                _discard(self._by_tag, (key, value), node)
+                _discard(self._by_key, key, node)
+            for key, value in new_tags.items():
+                self._by_tag.setdefault((key, value), set()).add(node)
+                self._by_key.setdefault(key, set()).add(node)
+            self._tags[node] = new_tags
+
+    def _decode(self, node_meta: NodeMeta) -> Mapping[str, str]:
+        try:
+            return self._decoder(node_meta.meta)
+        except Exception:
+            # bad metadata of one node must not break gossip handling
+            log.warning('failed to decode metadata of %s',
+                        node_meta.node, exc_info=True)
+            return {}
+
+    def query(self, status: Optional[NodeStatus] = None,
+              tags: Optional[Mapping[str, str]] = None,
+              has: Iterable[str] = ()) -> Snapshot:
+        """Returns members with given ``status`` and all ``tags`` that
+        have all metadata keys in ``has``; without arguments returns all
+        members.
+        """
+        tag_items = frozenset(tags.items()) if tags else frozenset()
+        keys = frozenset(has)
+        cache_key = (status, tag_items, keys)
+        snapshot = self._cache.get(cache_key)
+        if snapshot is not None:
+            return snapshot
+
+        if status is None and not tag_items and not keys:
+            members = tuple(self._members.values())
+        else:
+            members = self._select(status, tag_items, keys)
+        snapshot = Snapshot(self._version, members)
+        if len(self._cache) >= MAX_CACHED_QUERIES:
+            self._cache = {}
+        self._cache[cache_key] = snapshot
+        return snapshot
+
+    def _select(self, status, tag_items, keys):
+        sets = []
+        if status is not None:
+            sets.append(self._by_status[NodeStatus(status)])
+        for item in tag_items:
+            sets.append(self._by_tag.get(item, ()))
+        for key in keys:
+            sets.append(self._by_key.get(key, ()))
+        sets.sort(key=len)
+        smallest, rest = sets[0], sets[1:]
+        members = self._members
+        return tuple(members[n] for n in smallest
+                     if all(n in s for s in rest))
+
+
+def _discard(index, key, node):
+    nodes = index.get(key)
+    if nodes is None:
+        return
+    nodes.discard(node)
+    if not nodes:
+        del index[key]
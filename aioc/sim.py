@@ -0,0 +1,452 @@
+"""In-memory network and virtual clock for running many cluster nodes in
+one process.
+
+``SimLoop`` is an event loop whose clock jumps straight to the next
+scheduled callback instead of sleeping, so tickers, timeouts and
+suspicion timers run as fast as CPU allows. ``SimNetwork`` delivers UDP
+datagrams and TCP streams between nodes with configurable latency, loss
+and partitions. ``Simulation`` boots a cluster of ``Cluster`` instances on
+top of them and reports convergence time, false positives and traffic.
+"""
+import asyncio
+import selectors
+from collections import Counter, deque
+from functools import partial
+from random import Random
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .cluster import Cluster
+from .config import Config
+from .state import EventType, NodeStatus
+from .transport import Transport
+
+
+__all__ = ('SimLoop', 'SimNetwork', 'SimTransport', 'Simulation')
+
+
+Address = Tuple[str, int]
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Selector that never blocks, time it would wait for is added to
+    loop virtual clock.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.loop: Optional['SimLoop'] = None
+
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            raise RuntimeError('simulation is idle, nothing is scheduled')
+        self.loop.advance(timeout)
+        return []
+
+
+class SimLoop(asyncio.SelectorEventLoop):
+    """Event loop driven by virtual clock, starts at ``start`` seconds."""
+
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        self._now += seconds
+
+
+class SimNetwork:
+    """Delivers packets and stream data between simulated nodes after
+    ``latency`` plus random ``jitter`` seconds, datagrams are dropped with
+    ``loss`` probability. Nodes in different partitions or disconnected
+    nodes can not reach each other, their TCP data is silently dropped
+    like on a blackholed link.
+    """
+
+    def __init__(self, loop: SimLoop, *, latency: float = 0.001,
+                 jitter: float = 0.0, loss: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        self._loop = loop
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self._random = Random(seed)
+        self._endpoints: Dict[Address, '_DatagramTransport'] = {}
+        self._servers: Dict[Address, '_Server'] = {}
+        self._groups: Dict[Address, int] = {}
+        self._disconnected: Set[Address] = set()
+        self.bytes_sent: Counter = Counter()
+        self.packets_sent = 0
+        self.packets_dropped = 0
+
+    def transport(self, address: Address) -> 'SimTransport':
+        return SimTransport(self, tuple(address))
+
+    def partition(self, *groups: Iterable[Address]) -> None:
+        """Splits network, nodes of one group can reach each other only,
+        nodes not listed in any group form one more group.
+        """
+        self._groups = {}
+        for i, group in enumerate(groups, 1):
+            for address in group:
+                self._groups[tuple(address)] = i
+
+    def heal(self) -> None:
+        self._groups = {}
+
+    def disconnect(self, address: Address) -> None:
+        self._disconnected.add(tuple(address))
+
+    def reconnect(self, address: Address) -> None:
+        self._disconnected.discard(tuple(address))
+
+    def reachable(self, src: Address, dst: Address) -> bool:
+        if src in self._disconnected or dst in self._disconnected:
+            return False
+        return self._groups.get(src) == self._groups.get(dst)
+
+    def reset_stats(self) -> None:
+        self.bytes_sent.clear()
+        self.packets_sent = 0
+        self.packets_dropped = 0
+
+    def _delay(self) -> float:
+        if self.jitter:
+            return self.latency + self._random.uniform(0, self.jitter)
+        return self.latency
+
+    def _send_datagram(self, src: Address, dst: Address, data: bytes):
+        self.bytes_sent[src] += len(data)
+        self.packets_sent += 1
+        endpoint = self._endpoints.get(dst)
+        if (endpoint is None or not self.reachable(src, dst) or
+                (self.loss and self._random.random() < self.loss)):
+            self.packets_dropped += 1
+            return
+        self._loop.call_later(self._delay(), endpoint._deliver, data, src)
+
+    async def _connect(self, src: Address, dst: Address):
+        await asyncio.sleep(self._delay())
+        server = self._servers.get(dst)
+        if server is None:
+            raise ConnectionRefusedError('no server at {}'.format(dst))
+        if not self.reachable(src, dst):
+            # SYN is lost, caller gives up on connect timeout
+            await self._loop.create_future()
+
+        client_reader = asyncio.StreamReader()
+        server_reader = asyncio.StreamReader()
+        client_writer = _StreamWriter(self, src, dst, server_reader)
+        server_writer = _StreamWriter(self, dst, src, client_reader)
+        res = server.callback(server_reader, server_writer)
+        if asyncio.iscoroutine(res):
+            asyncio.ensure_future(res)
+        return client_reader, client_writer
+
+
+class SimTransport(Transport):
+    """Transport of one node attached to ``SimNetwork``."""
+
+    def __init__(self, network: SimNetwork, address: Address) -> None:
+        self._network = network
+        self._address = address
+
+    async def create_datagram_endpoint(self, protocol_factory, local_addr):
+        protocol = protocol_factory()
+        transport = _DatagramTransport(self._network, self._address,
+                                       protocol)
+        self._network._endpoints[self._address] = transport
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    async def start_server(self, client_connected_cb, host, port):
+        server = _Server(self._network, self._address, client_connected_cb)
+        self._network._servers[self._address] = server
+        return server
+
+    async def open_connection(self, host, port):
+        return await self._network._connect(self._address, (host, port))
+
+
+class _DatagramTransport(asyncio.DatagramTransport):
+
+    def __init__(self, network: SimNetwork, address: Address,
+                 protocol) -> None:
+        super().__init__()
+        self._network = network
+        self._address = address
+        self._protocol = protocol
+        self._closing = False
+
+    def get_extra_info(self, name, default=None):
+        if name == 'sockname':
+            return self._address
+        return default
+
+    def sendto(self, data, addr=None):
+        if not self._closing:
+            self._network._send_datagram(
+                self._address, tuple(addr), bytes(data))
+
+    def _deliver(self, data, addr):
+        if not self._closing:
+            self._protocol.datagram_received(data, addr)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        if self._network._endpoints.get(self._address) is self:
+            del self._network._endpoints[self._address]
+        self._network._loop.call_soon(self._protocol.connection_lost, None)
+
+
+class _Server:
+
+    def __init__(self, network: SimNetwork, address: Address,
+                 callback) -> None:
+        self._network = network
+        self._address = address
+        self.callback = callback
+        self.sockets: List = []
+
+    def close(self):
+        if self._network._servers.get(self._address) is self:
+            del self._network._servers[self._address]
+
+    async def wait_closed(self):
+        pass
+
+
+class _StreamWriter:
+    """Writer half of simulated TCP connection, data is fed to peer
+    reader in order after network delay.
+    """
+
+    def __init__(self, network: SimNetwork, local: Address, remote: Address,
+                 peer_reader: asyncio.StreamReader) -> None:
+        self._network = network
+        self._local = local
+        self._remote = remote
+        self._peer_reader = peer_reader
+        self._closing = False
+        # (delivery time, data) in write order, None data is EOF; timer
+        # heap does not keep order of equal deadlines, so stream data is
+        # delivered from this queue by one timer at a time
+        self._in_flight = deque()
+        self._timer = None
+
+    @property
+    def transport(self):
+        return self
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self._remote
+        if name == 'sockname':
+            return self._local
+        return default
+
+    def _send(self, data):
+        loop = self._network._loop
+        when = loop.time() + self._network._delay()
+        if self._in_flight:
+            when = max(when, self._in_flight[-1][0])
+        self._in_flight.append((when, data))
+        if self._timer is None:
+            self._timer = loop.call_at(when, self._deliver)
+
+    def _deliver(self):
+        self._timer = None
+        loop = self._network._loop
+        reader = self._peer_reader
+        while self._in_flight and self._in_flight[0][0] <= loop.time():
+            _, data = self._in_flight.popleft()
+            if reader.at_eof():
+                continue
+            if data is None:
+                reader.feed_eof()
+            else:
+                reader.feed_data(data)
+        if self._in_flight:
+            self._timer = loop.call_at(self._in_flight[0][0], self._deliver)
+
+    def write(self, data):
+        if self._closing:
+            return
+        self._network.bytes_sent[self._local] += len(data)
+        if self._network.reachable(self._local, self._remote):
+            self._send(bytes(data))
+
+    async def drain(self):
+        if self._closing:
+            raise ConnectionResetError('connection is closed')
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._send(None)
+
+    async def wait_closed(self):
+        pass
+
+
+class Simulation:
+    """Cluster of ``num_nodes`` nodes on simulated network. Node ``i``
+    listens on ``addresses[i]``, all nodes share ``config`` except for
+    address.
+
+        sim = Simulation(1000, loss=0.01)
+        sim.run(sim.boot())
+        sim.run(sim.join())
+        converged_in = sim.run(sim.wait_converged(timeout=120))
+    """
+
+    def __init__(self, num_nodes: int, config: Optional[Config] = None, *,
+                 latency: float = 0.001, jitter: float = 0.0,
+                 loss: float = 0.0, seed: Optional[int] = None,
+                 port: int = 7946) -> None:
+        self.loop = SimLoop()
+        asyncio.set_event_loop(self.loop)
+        self.network = SimNetwork(self.loop, latency=latency, jitter=jitter,
+                                  loss=loss, seed=seed)
+        config = config or Config(host='127.0.0.1', port=port)
+        self.addresses = [
+            ('10.{}.{}.{}'.format(i // 65536 % 256, i // 256 % 256, i % 256),
+             port) for i in range(num_nodes)]
+        self.clusters = []
+        for address in self.addresses:
+            c = config._replace(host=address[0], port=address[1])
+            cluster = Cluster(c, loop=self.loop,
+                              transport=self.network.transport(address))
+            cluster.listener.add_handler(partial(self._on_event, address))
+            self.clusters.append(cluster)
+        self._failed: Set[Address] = set()
+        self.false_suspicions = 0
+        self.false_deaths = 0
+        self._stats_since = self.loop.time()
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def time(self) -> float:
+        return self.loop.time()
+
+    @property
+    def live_clusters(self) -> List[Cluster]:
+        return [c for c, a in zip(self.clusters, self.addresses)
+                if a not in self._failed]
+
+    async def boot(self) -> None:
+        for cluster in self.clusters:
+            await cluster.boot()
+
+    async def join(self, num_seeds: int = 1) -> List[int]:
+        """Joins every node to first ``num_seeds`` nodes concurrently."""
+        seeds = self.addresses[:num_seeds]
+        joins = [c.join(*[s for s in seeds if s != a])
+                 for c, a in zip(self.clusters, self.addresses)
+                 if a not in seeds[:1]]
+        return await asyncio.gather(*joins)
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    def fail(self, i: int) -> None:
+        """Crashes node ``i``: it is cut off the network without leaving
+        the cluster.
+        """
+        address = self.addresses[i]
+        self._failed.add(address)
+        self.network.disconnect(address)
+
+    def converged(self) -> bool:
+        """True if every live node sees all other live nodes alive and
+        every failed node dead.
+        """
+        live = self.live_clusters
+        for cluster in live:
+            mlist = cluster._mlist
+            if len(mlist._partitions[NodeStatus.ALIVE]) != len(live) - 1:
+                return False
+            if mlist._partitions[NodeStatus.SUSPECT]:
+                return False
+            for address in self._failed:
+                meta = mlist.node_meta(address)
+                if meta is not None and meta.status != NodeStatus.DEAD:
+                    return False
+        return True
+
+    async def wait_converged(self, timeout: float,
+                             interval: float = 0.1) -> Optional[float]:
+        """Returns virtual seconds it took to converge, None on
+        timeout.
+        """
+        start = self.loop.time()
+        while not self.converged():
+            if self.loop.time() - start >= timeout:
+                return None
+            await asyncio.sleep(interval)
+        return self.loop.time() - start
+
+    async def _on_event(self, observer, event_type, node) -> None:
+        # failed nodes lose contact with everyone, their view does not count
+        if observer in self._failed:
+            return
+        if event_type == EventType.LEAVE:
+            if tuple(node) not in self._failed:
+                self.false_deaths += 1
+        elif event_type == EventType.UPDATE:
+            if (node.status == NodeStatus.SUSPECT and
+                    tuple(node.node) not in self._failed):
+                self.false_suspicions += 1
+
+    def reset_stats(self) -> None:
+        self.network.reset_stats()
+        self.false_suspicions = 0
+        self.false_deaths = 0
+        self._stats_since = self.loop.time()
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = self.loop.time() - self._stats_since
+        n = len(self.clusters)
+        live = len(self.live_clusters)
+        pairs = max(live * (live - 1), 1)
+        total_bytes = sum(self.network.bytes_sent.values())
+        return {
+            'nodes': n,
+            'virtual_seconds': elapsed,
+            'false_suspicions': self.false_suspicions,
+            'false_deaths': self.false_deaths,
+            # share of observer/target pairs of live nodes with false
+            # death declaration
+            'false_positive_rate': self.false_deaths / pairs,
+            'bytes_per_node_per_second': (
+                total_bytes / n / elapsed if elapsed else 0.0),
+            'packets_sent': self.network.packets_sent,
+            'packets_dropped': self.network.packets_dropped,
+        }
+
+    async def shutdown(self) -> None:
+        for cluster, address in zip(self.clusters, self.addresses):
+            self.network.disconnect(address)
+        await asyncio.gather(*[c.leave() for c in self.clusters])
+
+    def close(self) -> None:
+        self.run(self.shutdown())
+        self.loop.close()
+        asyncio.set_event_loop(None)
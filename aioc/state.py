@@ -1,9 +1,13 @@
+import lzma
+import socket
 import struct
+import zlib
 import cbor
 
 from collections import namedtuple
 from enum import Enum
-from typing import Any, Union, List
+from functools import lru_cache
+from typing import Any, Dict, Optional, Union, List
 
 
 class EventType(str, Enum):
@@ -21,13 +25,62 @@ class NodeStatus(int, Enum):
 MESSAGE_TYPE_SIZE = 1
 LENGTH_SIZE = 4
 
+_LENGTH = struct.Struct('>I')
+
 
 Node = namedtuple(
     'Node', ['host', 'port'])
 
+
+class NodeRegistry:
+    """Interns nodes, so every known member is represented by exactly one
+    ``Node`` object. Decoders return canonical nodes instead of creating
+    fresh tuples for every message, dictionaries keyed by node then mostly
+    hit identity check on lookup.
+    """
+
+    def __init__(self, max_size: int = 65536) -> None:
+        self._max_size = max_size
+        self._size = 0
+        # host -> port -> Node, nested dicts avoid building (host, port)
+        # tuple just to look node up
+        self._hosts: Dict[str, Dict[int, Node]] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def intern(self, host: str, port: int) -> Node:
+        ports = self._hosts.get(host)
+        if ports is not None:
+            node = ports.get(port)
+            if node is not None:
+                return node
+
+        if self._size >= self._max_size:
+            # interning is an optimization only, dropping the table
+            # keeps memory bounded if we get flooded with addresses
+            self.clear()
+            ports = None
+        if ports is None:
+            ports = self._hosts[host] = {}
+        node = ports[port] = Node(host, port)
+        self._size += 1
+        return node
+
+    def clear(self) -> None:
+        self._hosts.clear()
+        self._size = 0
+
+
+node_registry = NodeRegistry()
+intern_node = node_registry.intern
+
 NodeMeta = namedtuple(
     'NodeMeta', ['node', 'incarnation', 'meta', 'status', 'state_change',
-                 'is_local'])
+                 'is_local', 'meta_hash'])
+# hash of gossiped metadata that is not fetched yet, ``meta`` holds older
+# metadata until then and must not be spread as current one
+NodeMeta.__new__.__defaults__ = (None,)
 
 
 Ping = namedtuple(
@@ -51,12 +104,40 @@ Suspect = namedtuple(
 Alive = namedtuple(
     "Alive", ["sender", "node", "incarnation", "meta"])
 
+# alive with metadata replaced by its hash, receivers fetch metadata
+# blob by hash over TCP, see aioc.metadata
+AliveDigest = namedtuple(
+    "AliveDigest", ["sender", "node", "incarnation", "meta_hash"])
+
+# request of metadata blob by hash, response has empty meta if sender
+# does not know the blob
+MetaReq = namedtuple(
+    "MetaReq", ["sender", "meta_hash"])
+
+MetaResp = namedtuple(
+    "MetaResp", ["sender", "meta_hash", "meta"])
+
 PushPull = namedtuple(
     "PushPull", ["sender", "nodes", "join"])
 
+# digest of sender member table, see aioc.digest.MemberDigest
+PushPullDigest = namedtuple(
+    "PushPullDigest", ["sender", "buckets"])
+
+# members of digest buckets that differ between two peers
+PushPullDelta = namedtuple(
+    "PushPullDelta", ["sender", "nodes", "buckets"])
+
+# full state push/pull streamed as several frames, last chunk of the
+# stream has last flag set
+PushPullChunk = namedtuple(
+    "PushPullChunk", ["sender", "nodes", "join", "last"])
 
+
+# application broadcast, sender is the node that originated it, message
+# is identified by (sender, msg_id) for deduplication, see aioc.broadcast
 UserMsg = namedtuple(
-    "UserMsg", ["sender", "incarnation"])
+    "UserMsg", ["sender", "msg_id", "payload"])
 
 
 # dead is broadcast when we confirm a node is dead
@@ -64,7 +145,8 @@ UserMsg = namedtuple(
 Dead = namedtuple("Dead", ["sender", "incarnation", "node", "from_node"])
 
 Msg = Union[Ping, IndirectPingReq, AckResp, NackResp, Alive, Suspect, Dead,
-            PushPull]
+            PushPull, PushPullDigest, PushPullDelta, PushPullChunk,
+            AliveDigest, MetaReq, MetaResp, UserMsg]
 
 PING_MSG = 1
 INDIRECT_PING_MSG = 2
@@ -78,21 +160,70 @@ USER_MSG = 9
 COMPRESS_MSG = 10
 ENCRYPT_MSG = 11
 NACK_RESP_MSG = 12
-
-
-def decode_message(raw_payload: bytes) -> Msg:
+PUSH_PULL_DIGEST_MSG = 13
+PUSH_PULL_DELTA_MSG = 14
+PUSH_PULL_CHUNK_MSG = 15
+ALIVE_DIGEST_MSG = 16
+META_REQ_MSG = 17
+META_RESP_MSG = 18
+
+# names of message types, used as metrics labels
+MESSAGE_TYPE_NAMES = {
+    PING_MSG: 'ping',
+    INDIRECT_PING_MSG: 'indirect_ping',
+    ACK_RESP_MSG: 'ack',
+    SUSPECT_MSG: 'suspect',
+    ALIVE_MSG: 'alive',
+    DEAD_MSG: 'dead',
+    PUSH_PULL_MSG: 'push_pull',
+    COMPOUND_MSG: 'compound',
+    USER_MSG: 'user',
+    COMPRESS_MSG: 'compressed',
+    ENCRYPT_MSG: 'encrypted',
+    NACK_RESP_MSG: 'nack',
+    PUSH_PULL_DIGEST_MSG: 'push_pull_digest',
+    PUSH_PULL_DELTA_MSG: 'push_pull_delta',
+    PUSH_PULL_CHUNK_MSG: 'push_pull_chunk',
+    ALIVE_DIGEST_MSG: 'alive_digest',
+    META_REQ_MSG: 'meta_req',
+    META_RESP_MSG: 'meta_resp',
+}
+
+# high bit of message type byte marks messages encoded with the binary
+# codec, so nodes with different codecs can still talk to each other
+BINARY_FLAG = 0x80
+
+CBOR_CODEC = 'cbor'
+BINARY_CODEC = 'binary'
+
+NO_COMPRESSION = 'none'
+ZLIB_COMPRESSION = 'zlib'
+LZMA_COMPRESSION = 'lzma'
+
+
+def message_type_name(message_type: int) -> str:
+    return MESSAGE_TYPE_NAMES.get(message_type & ~BINARY_FLAG, 'unknown')
+
+
+def decode_message(raw_payload: bytes,
+                   max_size: Optional[int] = None) -> Msg:
     message_type = raw_payload[0]
-    raw_payload = raw_payload[1:]
+    if message_type == COMPRESS_MSG:
+        raw = decompress_payload(raw_payload, max_size)
+        return decode_message(raw, max_size)
+    if message_type & BINARY_FLAG:
+        return _decode_binary(raw_payload)
+    raw_payload = bytes(raw_payload[1:])
     d = cbor.loads(raw_payload)
-    node = Node(*d[0])
+    node = intern_node(*d[0])
     d = d[1:]
     msg: Msg
 
     if message_type == PING_MSG:
-        msg = Ping(node, d[0], Node(*d[1]))
+        msg = Ping(node, d[0], intern_node(*d[1]))
 
     elif message_type == INDIRECT_PING_MSG:
-        msg = IndirectPingReq(node, d[0], Node(*d[1]), d[2])
+        msg = IndirectPingReq(node, d[0], intern_node(*d[1]), d[2])
 
     elif message_type == NACK_RESP_MSG:
         msg = NackResp(node, *d)
@@ -101,17 +232,43 @@ def decode_message(raw_payload: bytes) -> Msg:
         msg = AckResp(node, *d)
 
     elif message_type == ALIVE_MSG:
-        msg = Alive(node, Node(*d[0]), *d[1:])
+        msg = Alive(node, intern_node(*d[0]), *d[1:])
 
     elif message_type == SUSPECT_MSG:
-        msg = Suspect(node, Node(*d[0]), d[1])
+        msg = Suspect(node, intern_node(*d[0]), d[1])
 
     elif message_type == DEAD_MSG:
-        msg = Dead(node, d[0], Node(*d[1]), Node(*d[2]))
+        msg = Dead(node, d[0], intern_node(*d[1]), intern_node(*d[2]))
 
     elif message_type == PUSH_PULL_MSG:
         msg = PushPull(
-            node, [NodeMeta(Node(*i[0]), *i[1:]) for i in d[0]], d[1])
+            node, [NodeMeta(intern_node(*i[0]), *i[1:]) for i in d[0]],
+            d[1])
+
+    elif message_type == PUSH_PULL_DIGEST_MSG:
+        msg = PushPullDigest(node, d[0])
+
+    elif message_type == PUSH_PULL_DELTA_MSG:
+        msg = PushPullDelta(
+            node, [NodeMeta(intern_node(*i[0]), *i[1:]) for i in d[0]],
+            d[1])
+
+    elif message_type == PUSH_PULL_CHUNK_MSG:
+        msg = PushPullChunk(
+            node, [NodeMeta(intern_node(*i[0]), *i[1:]) for i in d[0]],
+            d[1], d[2])
+
+    elif message_type == ALIVE_DIGEST_MSG:
+        msg = AliveDigest(node, intern_node(*d[0]), d[1], d[2])
+
+    elif message_type == META_REQ_MSG:
+        msg = MetaReq(node, d[0])
+
+    elif message_type == META_RESP_MSG:
+        msg = MetaResp(node, d[0], d[1])
+
+    elif message_type == USER_MSG:
+        msg = UserMsg(node, d[0], d[1])
     else:
         print(raw_payload, message_type)
         raise RuntimeError("no such message type")
@@ -119,16 +276,30 @@ def decode_message(raw_payload: bytes) -> Msg:
     return msg
 
 
-def decode_messages(raw_payload: bytes) -> List[Msg]:
+def decode_messages(raw_payload: bytes,
+                    max_size: Optional[int] = None) -> List[Msg]:
+    """Decodes single, compound or compressed payload, ``max_size`` bounds
+    size of decompressed data, MAX_DECOMPRESSED_SIZE by default.
+    """
     message_type = raw_payload[0]
-    if message_type == COMPOUND_MSG:
-        m = decode_compaund(raw_payload[1:])
+    if message_type == COMPRESS_MSG:
+        raw = decompress_payload(raw_payload, max_size)
+        m = decode_messages(raw, max_size)
+    elif message_type == COMPOUND_MSG:
+        m = decode_compaund(raw_payload[1:], max_size)
     else:
-        m = [decode_message(raw_payload)]
+        m = [decode_message(raw_payload, max_size)]
     return m
 
 
-def encode_message(message: Any) -> bytes:
+def encode_message(message: Any, codec: str = CBOR_CODEC) -> bytes:
+    if codec == BINARY_CODEC:
+        return _encode_binary(message)
+
+    if isinstance(message, (PushPull, PushPullDelta, PushPullChunk)):
+        # members with fetched metadata keep six field layout
+        message = message._replace(nodes=[
+            n if n.meta_hash is not None else n[:6] for n in message.nodes])
     raw_message = cbor.dumps(message)
     message_type = 0
     if isinstance(message, Ping):
@@ -156,6 +327,27 @@ def encode_message(message: Any) -> bytes:
     elif isinstance(message, PushPull):
         message_type = PUSH_PULL_MSG
 
+    elif isinstance(message, PushPullDigest):
+        message_type = PUSH_PULL_DIGEST_MSG
+
+    elif isinstance(message, PushPullDelta):
+        message_type = PUSH_PULL_DELTA_MSG
+
+    elif isinstance(message, PushPullChunk):
+        message_type = PUSH_PULL_CHUNK_MSG
+
+    elif isinstance(message, AliveDigest):
+        message_type = ALIVE_DIGEST_MSG
+
+    elif isinstance(message, MetaReq):
+        message_type = META_REQ_MSG
+
+    elif isinstance(message, MetaResp):
+        message_type = META_RESP_MSG
+
+    elif isinstance(message, UserMsg):
+        message_type = USER_MSG
+
     else:
         raise RuntimeError("Message type is unknown")
 
@@ -167,34 +359,543 @@ def encode_message(message: Any) -> bytes:
 
 def add_msg_size(raw_payload: bytes) -> bytes:
     m_size = len(raw_payload)
-    fmt = '>I{}s'.format(m_size)
-    raw_payload = struct.pack(fmt, m_size, raw_payload)
-    return raw_payload
+    buf = bytearray(LENGTH_SIZE + m_size)
+    _LENGTH.pack_into(buf, 0, m_size)
+    buf[LENGTH_SIZE:] = raw_payload
+    return buf
 
 
-def decode_msg_size(raw_payload: bytes) -> int:
-    s = raw_payload[:4]
-    m_size, *_ = struct.unpack('>I', s)
+def msg_size_header(raw_payload: bytes) -> bytes:
+    return _LENGTH.pack(len(raw_payload))
+
+
+def decode_msg_size(raw_payload: bytes, offset: int = 0) -> int:
+    m_size, = _LENGTH.unpack_from(raw_payload, offset)
     return m_size
 
 
-def encode_messages(*messages):
-    return make_compaund(*[encode_message(m) for m in messages])
+def encode_messages(*messages, codec: str = CBOR_CODEC):
+    return make_compaund(*[encode_message(m, codec) for m in messages])
 
 
-def make_compaund(*raw_payloads):
-    raw = b''.join([add_msg_size(p) for p in raw_payloads])
-    m_size = len(raw)
-    fmt = '>B{}s'.format(m_size)
-    raw_payload = struct.pack(fmt, COMPOUND_MSG, raw)
-    return raw_payload
+def encode_packet(*messages, codec: str = CBOR_CODEC):
+    return make_packet(*[encode_message(m, codec) for m in messages])
 
 
-def decode_compaund(raw):
+def make_compaund(*raw_payloads):
+    return _pack_compaund(raw_payloads, 0)
+
+
+def make_packet(*raw_payloads):
+    """Same as ``add_msg_size(make_compaund(*raw_payloads))`` but
+    assembles size prefixed compound packet in a single buffer.
+    """
+    return _pack_compaund(raw_payloads, LENGTH_SIZE)
+
+
+def _pack_compaund(raw_payloads, header_size):
+    m_size = MESSAGE_TYPE_SIZE
+    for p in raw_payloads:
+        m_size += LENGTH_SIZE + len(p)
+
+    buf = bytearray(header_size + m_size)
+    if header_size:
+        _LENGTH.pack_into(buf, 0, m_size)
+    buf[header_size] = COMPOUND_MSG
+    offset = header_size + MESSAGE_TYPE_SIZE
+    for p in raw_payloads:
+        size = len(p)
+        _LENGTH.pack_into(buf, offset, size)
+        offset += LENGTH_SIZE
+        buf[offset:offset + size] = p
+        offset += size
+    return buf
+
+
+def decode_compaund(raw, max_size: Optional[int] = None):
+    # walk offsets over memoryview, slicing it does not copy the data
+    view = memoryview(raw)
+    end = len(view)
+    offset = 0
     messages = []
-    while raw:
-        m_size = decode_msg_size(raw)
-        raw_msg = raw[4: 4 + m_size]
-        raw = raw[4 + m_size:]
-        messages.append(decode_message(raw_msg))
+    while offset < end:
+        m_size = decode_msg_size(view, offset)
+        offset += LENGTH_SIZE
+        messages.append(
+            decode_message(view[offset:offset + m_size], max_size))
+        offset += m_size
     return messages
+
+
+# Compression envelope: COMPRESS_MSG type byte, algorithm byte and
+# compressed payload, payload is single encoded message or compound
+# message. Decoders unwrap it transparently.
+
+_ALGORITHMS = {
+    ZLIB_COMPRESSION: 0,
+    LZMA_COMPRESSION: 1,
+}
+
+# upper bound of decompressed payload, protects against compression bombs
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# datagrams are small, so their content can not legitimately be much
+# larger, limit for UDP is this many times the packet size, so a single
+# forged datagram can not make receiver allocate MAX_DECOMPRESSED_SIZE
+UDP_MAX_EXPANSION = 16
+
+
+def compress_payload(raw_payload: bytes, algorithm: str = ZLIB_COMPRESSION,
+                     level: int = 6) -> bytes:
+    if algorithm == ZLIB_COMPRESSION:
+        data = zlib.compress(raw_payload, level)
+    elif algorithm == LZMA_COMPRESSION:
+        data = lzma.compress(raw_payload, preset=level)
+    else:
+        raise RuntimeError("no such compression algorithm")
+    buf = bytearray((COMPRESS_MSG, _ALGORITHMS[algorithm]))
+    buf += data
+    return bytes(buf)
+
+
+def maybe_compress(raw_payload: bytes, algorithm: str = ZLIB_COMPRESSION,
+                   level: int = 6, threshold: int = 0) -> bytes:
+    """Wraps payload into compression envelope if it is at least
+    ``threshold`` bytes long and compression actually makes it smaller,
+    otherwise returns payload as is.
+    """
+    if algorithm == NO_COMPRESSION or len(raw_payload) < threshold:
+        return raw_payload
+    compressed = compress_payload(raw_payload, algorithm, level)
+    if len(compressed) < len(raw_payload):
+        return compressed
+    return raw_payload
+
+
+def decompress_payload(raw_payload: bytes,
+                       max_size: Optional[int] = None) -> bytes:
+    max_size = max_size or MAX_DECOMPRESSED_SIZE
+    algorithm = raw_payload[1]
+    data = bytes(raw_payload[2:])
+    if algorithm == _ALGORITHMS[ZLIB_COMPRESSION]:
+        d = zlib.decompressobj()
+        raw = d.decompress(data, max_size)
+        truncated = bool(d.unconsumed_tail) or not d.eof
+    elif algorithm == _ALGORITHMS[LZMA_COMPRESSION]:
+        d = lzma.LZMADecompressor()
+        raw = d.decompress(data, max_size)
+        truncated = not d.eof
+    else:
+        raise RuntimeError("no such compression algorithm")
+    if truncated:
+        raise RuntimeError("compressed message is too large or truncated")
+    return raw
+
+
+# Binary codec: probe messages use fixed struct layouts, gossip and
+# push/pull messages use varints for incarnations and lengths. Node is
+# encoded as host followed by two bytes port, host is either zero byte
+# and four bytes of IPv4 address or one byte length and host name.
+
+_SEQ = struct.Struct('>I')
+_PORT = struct.Struct('>H')
+_STATE_CHANGE = struct.Struct('>d')
+_IPV4_SIZE = 4
+
+
+@lru_cache(maxsize=4096)
+def _host_to_wire(host: str) -> bytes:
+    try:
+        packed = socket.inet_aton(host)
+    except OSError:
+        packed = None
+    if packed is not None and socket.inet_ntoa(packed) == host:
+        return b'\x00' + packed
+    validate_host(host)
+    raw = host.encode()
+    return bytes((len(raw),)) + raw
+
+
+# host name length is encoded in one byte, zero marks IPv4 address
+MAX_HOST_SIZE = 255
+
+
+def validate_host(host: str) -> None:
+    """Raises ValueError if ``host`` can not be used as member address."""
+    size = len(host.encode())
+    if not 0 < size <= MAX_HOST_SIZE:
+        raise ValueError(
+            'Host must be 1 to {} bytes long, got {!r}'.format(
+                MAX_HOST_SIZE, host))
+
+
+def _probe_format(sender: bytes, target: bytes, tail: str = '') -> str:
+    return '>B{}sHI{}sH{}'.format(len(sender), len(target), tail)
+
+
+def _encode_ping(m: Ping) -> bytes:
+    s, t = _host_to_wire(m.sender.host), _host_to_wire(m.target.host)
+    return struct.pack(
+        _probe_format(s, t), PING_MSG | BINARY_FLAG,
+        s, m.sender.port, m.sequence_num, t, m.target.port)
+
+
+def _encode_indirect_ping(m: IndirectPingReq) -> bytes:
+    s, t = _host_to_wire(m.sender.host), _host_to_wire(m.target.host)
+    return struct.pack(
+        _probe_format(s, t, '?'), INDIRECT_PING_MSG | BINARY_FLAG,
+        s, m.sender.port, m.sequence_num, t, m.target.port, m.nack)
+
+
+def _encode_nack(m: NackResp) -> bytes:
+    s = _host_to_wire(m.sender.host)
+    fmt = '>B{}sHI'.format(len(s))
+    return struct.pack(fmt, NACK_RESP_MSG | BINARY_FLAG,
+                       s, m.sender.port, m.sequence_num)
+
+
+def _encode_ack(m: AckResp) -> bytes:
+    s = _host_to_wire(m.sender.host)
+    fmt = '>B{}sHI'.format(len(s))
+    buf = bytearray(struct.pack(fmt, ACK_RESP_MSG | BINARY_FLAG,
+                                s, m.sender.port, m.sequence_num))
+    _put_bytes(buf, m.payload)
+    return bytes(buf)
+
+
+def _encode_suspect(m: Suspect) -> bytes:
+    buf = bytearray((SUSPECT_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_node(buf, m.node)
+    _put_uvarint(buf, m.incarnation)
+    return bytes(buf)
+
+
+def _encode_alive(m: Alive) -> bytes:
+    buf = bytearray((ALIVE_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_node(buf, m.node)
+    _put_uvarint(buf, m.incarnation)
+    _put_bytes(buf, m.meta)
+    return bytes(buf)
+
+
+def _encode_alive_digest(m: AliveDigest) -> bytes:
+    buf = bytearray((ALIVE_DIGEST_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_node(buf, m.node)
+    _put_uvarint(buf, m.incarnation)
+    _put_bytes(buf, m.meta_hash)
+    return bytes(buf)
+
+
+def _encode_meta_req(m: MetaReq) -> bytes:
+    buf = bytearray((META_REQ_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_bytes(buf, m.meta_hash)
+    return bytes(buf)
+
+
+def _encode_meta_resp(m: MetaResp) -> bytes:
+    buf = bytearray((META_RESP_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_bytes(buf, m.meta_hash)
+    _put_bytes(buf, m.meta)
+    return bytes(buf)
+
+
+def _encode_user(m: UserMsg) -> bytes:
+    buf = bytearray((USER_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_uvarint(buf, m.msg_id)
+    _put_bytes(buf, m.payload)
+    return bytes(buf)
+
+
+def _encode_dead(m: Dead) -> bytes:
+    buf = bytearray((DEAD_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_uvarint(buf, m.incarnation)
+    _put_node(buf, m.node)
+    _put_node(buf, m.from_node)
+    return bytes(buf)
+
+
+def _encode_push_pull(m: PushPull) -> bytes:
+    buf = bytearray((PUSH_PULL_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    buf.append(bool(m.join))
+    _put_node_metas(buf, m.nodes)
+    return bytes(buf)
+
+
+def _encode_push_pull_digest(m: PushPullDigest) -> bytes:
+    buf = bytearray((PUSH_PULL_DIGEST_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_uvarint(buf, len(m.buckets))
+    buf += struct.pack('>{}I'.format(len(m.buckets)), *m.buckets)
+    return bytes(buf)
+
+
+def _encode_push_pull_chunk(m: PushPullChunk) -> bytes:
+    buf = bytearray((PUSH_PULL_CHUNK_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    buf.append(bool(m.join) | bool(m.last) << 1)
+    _put_node_metas(buf, m.nodes)
+    return bytes(buf)
+
+
+def _encode_push_pull_delta(m: PushPullDelta) -> bytes:
+    buf = bytearray((PUSH_PULL_DELTA_MSG | BINARY_FLAG,))
+    _put_node(buf, m.sender)
+    _put_node_metas(buf, m.nodes)
+    _put_uvarint(buf, len(m.buckets))
+    for i in m.buckets:
+        _put_uvarint(buf, i)
+    return bytes(buf)
+
+
+def _decode_probe(raw, offset):
+    sender, offset = _get_node(raw, offset)
+    sequence_num, = _SEQ.unpack_from(raw, offset)
+    return sender, sequence_num, offset + _SEQ.size
+
+
+def _decode_ping(raw) -> Ping:
+    sender, sequence_num, offset = _decode_probe(raw, 1)
+    target, _ = _get_node(raw, offset)
+    return Ping(sender, sequence_num, target)
+
+
+def _decode_indirect_ping(raw) -> IndirectPingReq:
+    sender, sequence_num, offset = _decode_probe(raw, 1)
+    target, offset = _get_node(raw, offset)
+    return IndirectPingReq(sender, sequence_num, target, bool(raw[offset]))
+
+
+def _decode_nack(raw) -> NackResp:
+    sender, sequence_num, _ = _decode_probe(raw, 1)
+    return NackResp(sender, sequence_num)
+
+
+def _decode_ack(raw) -> AckResp:
+    sender, sequence_num, offset = _decode_probe(raw, 1)
+    payload, _ = _get_bytes(raw, offset)
+    return AckResp(sender, sequence_num, payload)
+
+
+def _decode_suspect(raw) -> Suspect:
+    sender, offset = _get_node(raw, 1)
+    node, offset = _get_node(raw, offset)
+    incarnation, _ = _get_uvarint(raw, offset)
+    return Suspect(sender, node, incarnation)
+
+
+def _decode_alive(raw) -> Alive:
+    sender, offset = _get_node(raw, 1)
+    node, offset = _get_node(raw, offset)
+    incarnation, offset = _get_uvarint(raw, offset)
+    meta, _ = _get_bytes(raw, offset)
+    return Alive(sender, node, incarnation, meta)
+
+
+def _decode_alive_digest(raw) -> AliveDigest:
+    sender, offset = _get_node(raw, 1)
+    node, offset = _get_node(raw, offset)
+    incarnation, offset = _get_uvarint(raw, offset)
+    meta_hash, _ = _get_bytes(raw, offset)
+    return AliveDigest(sender, node, incarnation, meta_hash)
+
+
+def _decode_meta_req(raw) -> MetaReq:
+    sender, offset = _get_node(raw, 1)
+    meta_hash, _ = _get_bytes(raw, offset)
+    return MetaReq(sender, meta_hash)
+
+
+def _decode_meta_resp(raw) -> MetaResp:
+    sender, offset = _get_node(raw, 1)
+    meta_hash, offset = _get_bytes(raw, offset)
+    meta, _ = _get_bytes(raw, offset)
+    return MetaResp(sender, meta_hash, meta)
+
+
+def _decode_user(raw) -> UserMsg:
+    sender, offset = _get_node(raw, 1)
+    msg_id, offset = _get_uvarint(raw, offset)
+    payload, _ = _get_bytes(raw, offset)
+    return UserMsg(sender, msg_id, payload)
+
+
+def _decode_dead(raw) -> Dead:
+    sender, offset = _get_node(raw, 1)
+    incarnation, offset = _get_uvarint(raw, offset)
+    node, offset = _get_node(raw, offset)
+    from_node, _ = _get_node(raw, offset)
+    return Dead(sender, incarnation, node, from_node)
+
+
+def _decode_push_pull(raw) -> PushPull:
+    sender, offset = _get_node(raw, 1)
+    join = bool(raw[offset])
+    nodes, _ = _get_node_metas(raw, offset + 1)
+    return PushPull(sender, nodes, join)
+
+
+def _decode_push_pull_digest(raw) -> PushPullDigest:
+    sender, offset = _get_node(raw, 1)
+    num_buckets, offset = _get_uvarint(raw, offset)
+    buckets = struct.unpack_from('>{}I'.format(num_buckets), raw, offset)
+    return PushPullDigest(sender, list(buckets))
+
+
+def _decode_push_pull_chunk(raw) -> PushPullChunk:
+    sender, offset = _get_node(raw, 1)
+    flags = raw[offset]
+    nodes, _ = _get_node_metas(raw, offset + 1)
+    return PushPullChunk(sender, nodes, bool(flags & 1), bool(flags & 2))
+
+
+def _decode_push_pull_delta(raw) -> PushPullDelta:
+    sender, offset = _get_node(raw, 1)
+    nodes, offset = _get_node_metas(raw, offset)
+    num_buckets, offset = _get_uvarint(raw, offset)
+    buckets = []
+    for _ in range(num_buckets):
+        i, offset = _get_uvarint(raw, offset)
+        buckets.append(i)
+    return PushPullDelta(sender, nodes, buckets)
+
+
+_BINARY_ENCODERS = {
+    Ping: _encode_ping,
+    IndirectPingReq: _encode_indirect_ping,
+    AckResp: _encode_ack,
+    NackResp: _encode_nack,
+    Suspect: _encode_suspect,
+    Alive: _encode_alive,
+    Dead: _encode_dead,
+    PushPull: _encode_push_pull,
+    PushPullDigest: _encode_push_pull_digest,
+    PushPullDelta: _encode_push_pull_delta,
+    PushPullChunk: _encode_push_pull_chunk,
+    AliveDigest: _encode_alive_digest,
+    MetaReq: _encode_meta_req,
+    MetaResp: _encode_meta_resp,
+    UserMsg: _encode_user,
+}
+
+
+_BINARY_DECODERS = {
+    PING_MSG: _decode_ping,
+    INDIRECT_PING_MSG: _decode_indirect_ping,
+    ACK_RESP_MSG: _decode_ack,
+    NACK_RESP_MSG: _decode_nack,
+    SUSPECT_MSG: _decode_suspect,
+    ALIVE_MSG: _decode_alive,
+    DEAD_MSG: _decode_dead,
+    PUSH_PULL_MSG: _decode_push_pull,
+    PUSH_PULL_DIGEST_MSG: _decode_push_pull_digest,
+    PUSH_PULL_DELTA_MSG: _decode_push_pull_delta,
+    PUSH_PULL_CHUNK_MSG: _decode_push_pull_chunk,
+    ALIVE_DIGEST_MSG: _decode_alive_digest,
+    META_REQ_MSG: _decode_meta_req,
+    META_RESP_MSG: _decode_meta_resp,
+    USER_MSG: _decode_user,
+}
+
+
+def _encode_binary(message: Any) -> bytes:
+    encoder = _BINARY_ENCODERS.get(type(message))
+    if encoder is None:
+        raise RuntimeError("Message type is unknown")
+    return encoder(message)
+
+
+def _decode_binary(raw_payload: bytes) -> Msg:
+    decoder = _BINARY_DECODERS.get(raw_payload[0] & ~BINARY_FLAG)
+    if decoder is None:
+        raise RuntimeError("no such message type")
+    return decoder(raw_payload)
+
+
+def _put_uvarint(buf: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _get_uvarint(raw, offset: int):
+    result = 0
+    shift = 0
+    while True:
+        b = raw[offset]
+        offset += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _put_bytes(buf: bytearray, data: bytes) -> None:
+    _put_uvarint(buf, len(data))
+    buf += data
+
+
+def _get_bytes(raw, offset: int):
+    size, offset = _get_uvarint(raw, offset)
+    end = offset + size
+    return bytes(raw[offset:end]), end
+
+
+def _put_node(buf: bytearray, node: Node) -> None:
+    buf += _host_to_wire(node.host)
+    buf += _PORT.pack(node.port)
+
+
+def _get_node(raw, offset: int):
+    size = raw[offset]
+    start = offset + 1
+    if size:
+        end = start + size
+        host = str(raw[start:end], 'utf-8')
+    else:
+        end = start + _IPV4_SIZE
+        host = socket.inet_ntoa(raw[start:end])
+    port, = _PORT.unpack_from(raw, end)
+    return intern_node(host, port), end + _PORT.size
+
+
+def _put_node_metas(buf: bytearray, node_metas: List[NodeMeta]) -> None:
+    _put_uvarint(buf, len(node_metas))
+    for n in node_metas:
+        _put_node(buf, n.node)
+        _put_uvarint(buf, n.incarnation)
+        _put_bytes(buf, n.meta)
+        buf.append(n.status)
+        buf += _STATE_CHANGE.pack(n.state_change)
+        flags = bool(n.is_local) | (n.meta_hash is not None) << 1
+        buf.append(flags)
+        if n.meta_hash is not None:
+            _put_bytes(buf, n.meta_hash)
+
+
+def _get_node_metas(raw, offset: int):
+    num_nodes, offset = _get_uvarint(raw, offset)
+    nodes = []
+    for _ in range(num_nodes):
+        node, offset = _get_node(raw, offset)
+        incarnation, offset = _get_uvarint(raw, offset)
+        meta, offset = _get_bytes(raw, offset)
+        status = NodeStatus(raw[offset])
+        state_change, = _STATE_CHANGE.unpack_from(raw, offset + 1)
+        offset += 1 + _STATE_CHANGE.size
+        flags = raw[offset]
+        offset += 1
+        meta_hash = None
+        if flags & 2:
+            meta_hash, offset = _get_bytes(raw, offset)
+        nodes.append(NodeMeta(node, incarnation, meta, status, state_change,
+                              bool(flags & 1), meta_hash))
+    return nodes, offset
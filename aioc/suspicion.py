@@ -1,9 +1,9 @@
 import asyncio  # noqa
 import math
-import time
 from typing import Callable, Set
 
 from .state import Node
+from .timer_wheel import TimerWheel
 
 
 Loop = asyncio.AbstractEventLoop
@@ -16,7 +16,8 @@ class Suspicion:
     """
 
     def __init__(self, from_node: Node, k: int, min_time: float,
-                 max_time: float, fn: Callable, *, loop: Loop) -> None:
+                 max_time: float, fn: Callable, *, loop: Loop,
+                 wheel: TimerWheel = None) -> None:
         # n is the number of independent confirmations we've seen.
         self._n: int = 0
 
@@ -33,11 +34,16 @@ class Suspicion:
         # start captures the timestamp when we began the timer. This is used
         # so we can calculate durations to feed the timer during updates in
         # a way the achieves the overall time we'd like.
-        self._start_time = time.time()
+        self._loop = loop
+        self._start_time = loop.time()
 
-        # timer is the underlying timer that implements the timeout.
-        t = self._max_time
-        self._timer = create_timer(t, fn, loop)
+        # timer is the underlying timer that implements the timeout. If
+        # there are no confirmations to be made then take the min time.
+        t = self._max_time if k >= 1 else self._min_time
+        if wheel is not None:
+            self._timer = wheel.call_later(t, fn)
+        else:
+            self._timer = create_timer(t, fn, loop)
 
         # f is the function to call when the timer expires. We hold on to this
         # because there are cases where we call it directly.
@@ -47,6 +53,14 @@ class Suspicion:
         # node is suspect. This prevents double counting.
         self._confirmations: Set[Node] = set([from_node])
 
+    @property
+    def k(self) -> int:
+        return self._k
+
+    @property
+    def confirmations(self) -> int:
+        return self._n
+
     def remaining_suspicion_time(self, elapsed) -> float:
         """Takes the state variables of the suspicion
         timer and calculates the remaining time to wait before considering a
@@ -76,7 +90,7 @@ class Suspicion:
         return True
 
     def check_timeout(self) -> float:
-        elapsed = time.time() - self._start_time
+        elapsed = self._loop.time() - self._start_time
         remaining = self.remaining_suspicion_time(elapsed)
         return remaining
 
@@ -1,14 +1,19 @@
 import asyncio
-from collections import namedtuple
+from collections import deque, namedtuple
 
+from .metrics import NULL_METRICS
 from .state import (decode_msg_size, encode_message, decode_message,
-                    add_msg_size)
+                    LENGTH_SIZE, msg_size_header, maybe_compress,
+                    message_type_name)
+from .transport import AsyncioTransport
 
 
-async def create_tcp_server(*, host='127.0.0.1', port=9999, loop=None):
-    cm = TCPConnectionManager()
-    server = await asyncio.start_server(
-        cm.handle_connection, host, port, loop=loop)
+async def create_tcp_server(*, host='127.0.0.1', port=9999, config,
+                            loop=None, metrics=None, transport=None):
+    transport = transport or AsyncioTransport(loop)
+    cm = TCPConnectionManager(
+        config, loop=loop, metrics=metrics, transport=transport)
+    server = await transport.start_server(cm._accept, host, port)
     cm._server = server
     return cm
 
@@ -16,58 +21,271 @@ async def create_tcp_server(*, host='127.0.0.1', port=9999, loop=None):
 Connection = namedtuple("Connection", ["reader", "writer"])
 
 
+class ConnectionPool:
+    """Keeps idle client connections per peer, so consecutive requests to
+    the same node skip TCP handshake and slow start. Connection is owned
+    by exactly one request between ``acquire`` and ``release``; idle
+    connections are closed after ``idle_timeout`` seconds and at most
+    ``max_idle`` of them are kept per peer.
+    """
+
+    def __init__(self, *, connect_timeout, idle_timeout, max_idle,
+                 loop=None, metrics=None, transport=None):
+        metrics = metrics or NULL_METRICS
+        self._opened = metrics.counter('tcp.connections_opened')
+        self._reused = metrics.counter('tcp.connections_reused')
+        self._connect_timeout = connect_timeout
+        self._idle_timeout = idle_timeout
+        self._max_idle = max_idle
+        self._loop = loop or asyncio.get_event_loop()
+        self._transport = transport or AsyncioTransport(loop)
+        # address -> deque of (idle_since, connection), newest on right
+        self._idle = {}
+        self._sweep_handle = None
+
+    def __len__(self):
+        return sum(len(conns) for conns in self._idle.values())
+
+    async def acquire(self, address):
+        """Returns tuple of connection and flag telling whether connection
+        was reused from pool.
+        """
+        conns = self._idle.get(address)
+        while conns:
+            _, conn = conns.pop()
+            if not conns:
+                del self._idle[address]
+            if is_open(conn):
+                self._reused.inc()
+                return conn, True
+            conn.writer.close()
+            conns = self._idle.get(address)
+
+        h, p = address
+        fut = self._transport.open_connection(h, p)
+        r, w = await asyncio.wait_for(fut, self._connect_timeout)
+        self._opened.inc()
+        return Connection(r, w), False
+
+    def release(self, address, conn):
+        conns = self._idle.setdefault(address, deque())
+        if not is_open(conn) or len(conns) >= self._max_idle:
+            self.discard(conn)
+            if not conns:
+                del self._idle[address]
+            return
+        conns.append((self._loop.time(), conn))
+        if self._sweep_handle is None:
+            self._sweep_handle = self._loop.call_later(
+                self._idle_timeout, self._sweep)
+
+    def discard(self, conn):
+        conn.writer.close()
+
+    def clear(self, address):
+        for _, conn in self._idle.pop(address, ()):
+            conn.writer.close()
+
+    def _sweep(self):
+        self._sweep_handle = None
+        deadline = self._loop.time() - self._idle_timeout
+        for address in list(self._idle):
+            conns = self._idle[address]
+            # oldest connections are on the left
+            while conns and conns[0][0] <= deadline:
+                _, conn = conns.popleft()
+                conn.writer.close()
+            if not conns:
+                del self._idle[address]
+        if self._idle:
+            self._sweep_handle = self._loop.call_later(
+                self._idle_timeout, self._sweep)
+
+    def close(self):
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+            self._sweep_handle = None
+        for address in list(self._idle):
+            self.clear(address)
+
+
 class TCPConnectionManager:
 
-    def __init__(self):
+    def __init__(self, config, loop=None, metrics=None, transport=None):
+        self._config = config
         self._server = None
+        self._hander = None
+        metrics = metrics or NULL_METRICS
+        self._pool = ConnectionPool(
+            connect_timeout=config.tcp_connect_timeout,
+            idle_timeout=config.tcp_idle_timeout,
+            max_idle=config.tcp_max_idle_connections,
+            loop=loop, metrics=metrics, transport=transport)
+        self._metrics_enabled = metrics.enabled
+        self._frames_sent = metrics.counter_family('tcp.frames_sent')
+        self._bytes_sent = metrics.counter_family('tcp.bytes_sent')
+        self._frames_received = metrics.counter_family('tcp.frames_received')
+        self._bytes_received = metrics.counter_family('tcp.bytes_received')
+        # tasks serving server side connections, cancelled on shutdown
+        self._handlers = set()
+
+    @property
+    def pool(self):
+        return self._pool
 
     async def close(self):
+        self._pool.close()
         if self._server:
             self._server.close()
+            handlers = list(self._handlers)
+            for task in handlers:
+                task.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
             await self._server.wait_closed()
             self._server = None
 
     async def _read_message(self, reader):
-        size_data = await reader.readexactly(4)
+        size_data = await reader.readexactly(LENGTH_SIZE)
         mg_size = decode_msg_size(size_data)
         raw_message = await reader.readexactly(mg_size)
+        if self._metrics_enabled:
+            kind = message_type_name(raw_message[0])
+            self._frames_received.labels(kind).inc()
+            self._bytes_received.labels(kind).inc(LENGTH_SIZE + mg_size)
         return raw_message
 
     async def _request(self, address, payload):
-        h, p = address
-        # TODO add timeout
-        r, w = await asyncio.open_connection(host=h, port=p)
+        return await self._exchange(
+            address, lambda conn: self._roundtrip(conn, payload))
+
+    async def _exchange(self, address, exchange):
+        # pooled connection may be closed by peer while idle, in that case
+        # exchange is retried once on fresh connection
+        address = tuple(address)
+        for _ in range(2):
+            conn, reused = await self._pool.acquire(address)
+            try:
+                result = await exchange(conn)
+            except ConnectionError:
+                self._pool.discard(conn)
+                if reused:
+                    self._pool.clear(address)
+                    continue
+                raise
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            self._pool.release(address, conn)
+            return result
+
+    def _write(self, writer, payload):
+        if self._metrics_enabled:
+            kind = message_type_name(payload[0])
+            self._frames_sent.labels(kind).inc()
+            self._bytes_sent.labels(kind).inc(LENGTH_SIZE + len(payload))
+        write_frame(writer, payload)
+
+    async def _roundtrip(self, conn, payload):
+        self._write(conn.writer, payload)
+        await conn.writer.drain()
+        return await self._read_response(conn)
+
+    async def _read_response(self, conn):
         try:
-            w.write(payload)
-            await w.drain()
-            raw_message = await self._read_message(r)
-        except Exception as e:
-            print("TDP failed: _request", e)
-            raise e
-        finally:
-            w.close()
-        return raw_message
+            return await asyncio.wait_for(
+                self._read_message(conn.reader),
+                self._config.tcp_read_timeout)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError('connection closed by peer') from e
+
+    async def _stream(self, conn, messages, handler):
+        await self._write_stream(conn, messages)
+        done = False
+        while not done:
+            raw_message = await self._read_response(conn)
+            done = await handler(decode_message(raw_message))
+
+    def _encode(self, message):
+        # with tcp_compression large frames, like full state push/pull,
+        # are compressed, decoder unwraps compression envelope
+        # transparently
+        config = self._config
+        payload = encode_message(message, config.codec)
+        if not config.tcp_compression:
+            return payload
+        return maybe_compress(
+            payload, config.compression, config.compression_level,
+            config.compression_threshold)
 
     async def send_message(self, address, message):
-        payload = encode_message(message)
-        raw = add_msg_size(payload)
-        raw_message = await self._request(address, raw)
+        payload = self._encode(message)
+        raw_message = await self._request(address, payload)
         return decode_message(raw_message)
 
     async def send_raw_message(self, address, raw):
         raw_message = await self._request(address, raw)
         return decode_message(raw_message)
 
+    async def send_stream(self, address, messages, handler):
+        """Sends ``messages`` as consecutive frames over one connection,
+        then passes response messages one by one to ``handler`` coroutine
+        until it returns True. Messages are encoded lazily, so only one
+        frame is held in memory at a time; ``messages`` is iterated again
+        if exchange is retried.
+        """
+        await self._exchange(
+            address, lambda conn: self._stream(conn, messages, handler))
+
+    def send_response(self, conn, message):
+        payload = self._encode(message)
+        self._write(conn.writer, payload)
+
+    async def send_stream_response(self, conn, messages):
+        await self._write_stream(conn, messages)
+
+    async def _write_stream(self, conn, messages):
+        # drain after every frame, so slow peer applies backpressure
+        # instead of whole stream piling up in transport buffer
+        for message in messages:
+            self._write(conn.writer, self._encode(message))
+            await conn.writer.drain()
+
+    def _accept(self, reader, writer):
+        task = asyncio.ensure_future(self.handle_connection(reader, writer))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
     async def handle_connection(self, reader, writer):
+        # serve requests until client closes connection or it stays idle
+        # for too long, clients evict idle connections earlier than server
+        # so they rarely hit connection closed under them
         conn = Connection(reader, writer)
+        idle_timeout = self._config.tcp_idle_timeout * 2
         try:
-            raw_message = await self._read_message(conn.reader)
-            if self._hander:
-                message = decode_message(raw_message)
-                await self._hander(message, conn)
-                await writer.drain()
+            while True:
+                try:
+                    raw_message = await asyncio.wait_for(
+                        self._read_message(reader), idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                if self._hander:
+                    message = decode_message(raw_message)
+                    await self._hander(message, conn)
+                    await writer.drain()
         finally:
-            conn.writer.close()
+            writer.close()
 
     def set_handler(self, hander):
         self._hander = hander
+
+
+def is_open(conn):
+    return not (conn.reader.at_eof() or conn.writer.transport.is_closing())
+
+
+def write_frame(writer, payload):
+    # size header and payload are written separately, so large frames are
+    # not copied into intermediate size prefixed buffer
+    writer.write(msg_size_header(payload))
+    writer.write(payload)
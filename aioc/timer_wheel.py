@@ -0,0 +1,146 @@
+import asyncio  # noqa
+import math
+from typing import Callable, Optional, Set
+
+
+Loop = asyncio.AbstractEventLoop
+
+
+class WheelTimer:
+
+    __slots__ = ('_wheel', '_callback', 'expires', 'slot')
+
+    def __init__(self, wheel: 'TimerWheel', callback: Callable) -> None:
+        self._wheel = wheel
+        self._callback = callback
+        # expires is absolute tick number when timer fires
+        self.expires = 0
+        # slot is set of timers this timer is currently stored in
+        self.slot: Optional[Set['WheelTimer']] = None
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+    def reschedule(self, timeout: float) -> None:
+        self._wheel._remove(self)
+        self._wheel._add(self, timeout)
+
+    def cancel(self) -> None:
+        self._wheel._remove(self)
+
+    def _fire(self) -> None:
+        self._callback()
+
+
+class TimerWheel:
+    """Hierarchical timer wheel with coarse ticks.
+
+    Timers are bucketed by expiration tick, so insert, reschedule and
+    cancel are O(1) and only one event loop timer per wheel is scheduled,
+    no matter how many timers are pending. Each level has ``slots``
+    buckets, one bucket of level ``l`` covers ``slots ** l`` ticks; timers
+    from upper levels are cascaded down as the wheel turns. Timers fire up
+    to one ``tick`` late.
+    """
+
+    def __init__(self, tick: float, slots: int = 64, levels: int = 4, *,
+                 loop: Loop) -> None:
+        assert slots & (slots - 1) == 0, 'slots must be power of two'
+        self._tick = tick
+        self._loop = loop
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._levels = [[set() for _ in range(slots)]
+                        for _ in range(levels)]
+        self._max_ticks = slots ** levels
+        self._ticks = self._now_ticks()
+        self._size = 0
+        self._handle = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def call_later(self, timeout: float, callback: Callable) -> WheelTimer:
+        timer = WheelTimer(self, callback)
+        self._add(timer, timeout)
+        return timer
+
+    def _now_ticks(self) -> int:
+        return int(self._loop.time() / self._tick)
+
+    def _add(self, timer: WheelTimer, timeout: float) -> None:
+        if not self._size:
+            # wheel was idle, catch up with clock without walking slots
+            self._ticks = self._now_ticks()
+        ticks = max(1, math.ceil(timeout / self._tick))
+        timer.expires = self._ticks + ticks
+        self._insert(timer)
+        self._size += 1
+        if self._handle is None:
+            self._schedule()
+
+    def _insert(self, timer: WheelTimer) -> None:
+        delta = min(timer.expires - self._ticks, self._max_ticks - 1)
+        level = 0
+        while delta >= (1 << (self._bits * (level + 1))):
+            level += 1
+        index = (timer.expires >> (self._bits * level)) & self._mask
+        slot = self._levels[level][index]
+        slot.add(timer)
+        timer.slot = slot
+
+    def _remove(self, timer: WheelTimer) -> None:
+        if timer.slot is None:
+            return
+        timer.slot.discard(timer)
+        timer.slot = None
+        self._size -= 1
+
+    def _schedule(self) -> None:
+        self._handle = self._loop.call_later(self._tick, self.advance)
+
+    def advance(self) -> None:
+        """Turns the wheel up to current loop time and fires expired
+        timers.
+        """
+        self._handle = None
+        target = self._now_ticks()
+        while self._ticks < target and self._size:
+            self._ticks += 1
+            self._cascade()
+            index = self._ticks & self._mask
+            expired = self._levels[0][index]
+            self._levels[0][index] = set()
+            for timer in expired:
+                timer.slot = None
+                self._size -= 1
+            for timer in expired:
+                timer._fire()
+        if self._size and self._handle is None:
+            self._schedule()
+
+    def _cascade(self) -> None:
+        level = 1
+        ticks = self._ticks
+        while level < len(self._levels):
+            shift = self._bits * level
+            if ticks & ((1 << shift) - 1):
+                break
+            index = (ticks >> shift) & self._mask
+            timers = self._levels[level][index]
+            self._levels[level][index] = set()
+            for timer in timers:
+                self._insert(timer)
+            level += 1
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for level in self._levels:
+            for slot in level:
+                for timer in slot:
+                    timer.slot = None
+                slot.clear()
+        self._size = 0
@@ -0,0 +1,49 @@
+import asyncio
+from typing import Callable, Optional, Tuple
+
+OptLoop = Optional[asyncio.AbstractEventLoop]
+
+
+__all__ = ('Transport', 'AsyncioTransport')
+
+
+class Transport:
+    """Creates UDP endpoints and TCP connections for a cluster node.
+    Default implementation uses asyncio networking, ``aioc.sim`` provides
+    in-memory network for simulations.
+    """
+
+    async def create_datagram_endpoint(
+            self, protocol_factory: Callable,
+            local_addr: Tuple[str, int]) -> Tuple[asyncio.BaseTransport,
+                                                  asyncio.BaseProtocol]:
+        raise NotImplementedError
+
+    async def start_server(self, client_connected_cb: Callable, host: str,
+                           port: int):
+        """Returns server object with ``close`` and ``wait_closed``
+        methods, same as ``asyncio.start_server``.
+        """
+        raise NotImplementedError
+
+    async def open_connection(
+            self, host: str, port: int) -> Tuple[asyncio.StreamReader,
+                                                 asyncio.StreamWriter]:
+        raise NotImplementedError
+
+
+class AsyncioTransport(Transport):
+
+    def __init__(self, loop: OptLoop = None) -> None:
+        self._loop = loop
+
+    async def create_datagram_endpoint(self, protocol_factory, local_addr):
+        loop = self._loop or asyncio.get_event_loop()
+        return await loop.create_datagram_endpoint(
+            protocol_factory, local_addr=local_addr)
+
+    async def start_server(self, client_connected_cb, host, port):
+        return await asyncio.start_server(client_connected_cb, host, port)
+
+    async def open_connection(self, host, port):
+        return await asyncio.open_connection(host=host, port=port)
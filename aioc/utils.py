@@ -19,6 +19,13 @@ class Ticker:
     def closed(self):
         return self._ticker_task is None
 
+    @property
+    def interval(self) -> float:
+        # interval can be callable, so it is recomputed on every tick
+        if callable(self._interval):
+            return self._interval()
+        return self._interval
+
     async def _tick(self):
         # TODO: add initial wait time to prevent all task to start
         # in same time
@@ -33,8 +40,8 @@ class Ticker:
                 raise e
 
             t_stop = self._loop.time()
-            t = self._timout_func(self._interval, t_start, t_stop)
-            await asyncio.sleep(t, loop=self._loop)
+            t = self._timout_func(self.interval, t_start, t_stop)
+            await asyncio.sleep(t)
 
     def start(self):
         self._ticker_task = asyncio.ensure_future(
@@ -0,0 +1,56 @@
+"""Compares bytes per message and encode/decode time of cbor and binary
+codecs.
+
+    $ python benchmarks/bench_codec.py
+"""
+import time
+import timeit
+
+from aioc.state import (encode_message, decode_message, BINARY_CODEC,
+                        CBOR_CODEC)
+from aioc.state import (Ping, Suspect, Node, IndirectPingReq, AckResp,
+                        NackResp, Alive, Dead, PushPull, NodeMeta, NodeStatus)
+
+
+def make_messages(num_members=100):
+    a, b = Node('10.0.1.17', 7946), Node('10.0.2.203', 7946)
+    members = [
+        NodeMeta(Node('10.0.{}.{}'.format(i // 250, i % 250), 7946),
+                 i, b'role=web;zone=us-east-1a', NodeStatus.ALIVE,
+                 time.time(), False)
+        for i in range(num_members)]
+    return [
+        Ping(a, 1234567, b),
+        IndirectPingReq(a, 1234567, b, True),
+        AckResp(b, 1234567, b''),
+        NackResp(b, 1234567),
+        Suspect(a, b, 42),
+        Alive(a, b, 42, b'role=web;zone=us-east-1a'),
+        Dead(a, 42, b, a),
+        PushPull(a, members, False),
+    ]
+
+
+def bench(msg, codec, number):
+    raw = encode_message(msg, codec)
+    enc = timeit.timeit(lambda: encode_message(msg, codec), number=number)
+    dec = timeit.timeit(lambda: decode_message(raw), number=number)
+    return len(raw), enc / number * 1e6, dec / number * 1e6
+
+
+def main():
+    header = '{:<16} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}'
+    row = '{:<16} {:>7} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'
+    print(header.format('message', 'cbor B', 'bin B', 'cbor enc',
+                        'bin enc', 'cbor dec', 'bin dec'))
+    for msg in make_messages():
+        number = 200 if isinstance(msg, PushPull) else 20000
+        c_size, c_enc, c_dec = bench(msg, CBOR_CODEC, number)
+        b_size, b_enc, b_dec = bench(msg, BINARY_CODEC, number)
+        print(row.format(type(msg).__name__, c_size, b_size,
+                         c_enc, b_enc, c_dec, b_dec))
+    print('times are in microseconds per message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compares bytes saved and CPU spent compressing full state PushPull
+frames and gossip packets with zlib and lzma at different levels.
+
+    $ python benchmarks/bench_compression.py
+"""
+import time
+import timeit
+
+from aioc.dissemination_queue import DisseminationQueue
+from aioc.mlist import MList
+from aioc.config import Config
+from aioc.state import (encode_message, decode_messages, maybe_compress,
+                        make_compaund, BINARY_CODEC, CBOR_CODEC,
+                        ZLIB_COMPRESSION, LZMA_COMPRESSION)
+from aioc.state import Alive, Node, NodeMeta, NodeStatus, PushPull
+
+
+SETTINGS = [
+    (ZLIB_COMPRESSION, 1),
+    (ZLIB_COMPRESSION, 6),
+    (ZLIB_COMPRESSION, 9),
+    (LZMA_COMPRESSION, 0),
+    (LZMA_COMPRESSION, 6),
+]
+
+
+def make_push_pull(num_members):
+    now = time.time()
+    members = [
+        NodeMeta(Node('10.0.{}.{}'.format(i // 250, i % 250), 7946),
+                 i, b'role=web;zone=us-east-1a;version=1.4.2',
+                 NodeStatus.ALIVE, now - i, False)
+        for i in range(num_members)]
+    return PushPull(Node('10.0.0.1', 7946), members, False)
+
+
+def make_gossip_packet(codec, packet_size=1400):
+    config = Config(host='10.0.0.1', port=7946, codec=codec)
+    queue = DisseminationQueue(MList(config), config.retransmit_mult)
+    for i in range(100):
+        node = Node('10.0.{}.{}'.format(i // 250, i % 250), 7946)
+        queue.put(Alive(node, node, i, b'role=web;zone=us-east-1a'))
+    packet, = queue.get_update_packets(packet_size, 1)
+    return make_compaund(*packet)
+
+
+def bench(raw, algorithm, level, number):
+    compressed = maybe_compress(raw, algorithm, level)
+    comp = timeit.timeit(
+        lambda: maybe_compress(raw, algorithm, level), number=number)
+    dec = timeit.timeit(lambda: decode_messages(compressed), number=number)
+    return len(compressed), comp / number * 1e6, dec / number * 1e6
+
+
+def report(name, raw, decode_number):
+    number = max(1, 2000000 // len(raw))
+    base = timeit.timeit(lambda: decode_messages(raw), number=decode_number)
+    print('{} {} bytes, plain decode {:.1f} us'.format(
+        name, len(raw), base / decode_number * 1e6))
+    for algorithm, level in SETTINGS:
+        size, comp, dec = bench(raw, algorithm, level, number)
+        print('    {:<4} {:>1} {:>9} {:>7.2f}x {:>11.1f} {:>11.1f}'.format(
+            algorithm, level, size, len(raw) / size, comp, dec))
+
+
+def main():
+    print('    algo lvl     bytes   ratio  compress us    decode us')
+    for codec in (CBOR_CODEC, BINARY_CODEC):
+        for num_members in (100, 1000, 5000):
+            raw = encode_message(make_push_pull(num_members), codec)
+            name = 'PushPull {} members {}'.format(num_members, codec)
+            report(name, raw, 10)
+        raw = make_gossip_packet(codec)
+        report('gossip packet {}'.format(codec), bytes(raw), 1000)
+    print('decode us includes decompression and message decoding')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Large cluster simulation on in-memory network with virtual clock.
+
+Boots ``--nodes`` nodes, joins them through one seed, waits for
+convergence, runs steady state for ``--duration`` virtual seconds, then
+crashes ``--fail`` nodes and measures how long it takes every live node to
+declare them dead. Report is printed as JSON:
+
+    $ python benchmarks/sim_cluster.py --nodes 1000 --loss 0.01
+"""
+import argparse
+import json
+import sys
+import time
+
+from aioc.config import Config, LAN
+from aioc.sim import Simulation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--duration', type=float, default=30,
+                        help='virtual seconds of steady state')
+    parser.add_argument('--fail', type=int, default=1,
+                        help='number of nodes to crash')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='virtual seconds to wait for convergence')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--preset', choices=('default', 'lan'),
+                        default='default')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='enable adaptive gossip fanout and intervals')
+    args = parser.parse_args(argv)
+
+    if args.preset == 'lan':
+        config = LAN
+    else:
+        config = Config(host='127.0.0.1', port=7946)
+    if args.adaptive:
+        config = config._replace(adaptive_gossip=True)
+
+    started = time.monotonic()
+    sim = Simulation(args.nodes, config, latency=args.latency,
+                     jitter=args.jitter, loss=args.loss, seed=args.seed)
+    sim.run(sim.boot())
+    sim.run(sim.join())
+    converged = sim.run(sim.wait_converged(args.timeout))
+
+    sim.reset_stats()
+    sim.run(sim.sleep(args.duration))
+    steady = sim.stats()
+
+    for i in range(1, args.fail + 1):
+        sim.fail(i)
+    detected = sim.run(sim.wait_converged(args.timeout))
+    report = {
+        'nodes': args.nodes,
+        'latency': args.latency,
+        'loss': args.loss,
+        'convergence_seconds': converged,
+        'detection_seconds': detected,
+        'steady_state': steady,
+        'after_failure': sim.stats(),
+        'virtual_seconds': sim.time(),
+    }
+    report['real_seconds'] = time.monotonic() - started
+    sim.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
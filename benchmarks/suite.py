@@ -0,0 +1,308 @@
+"""Micro-benchmarks of hot paths: codec, dissemination queue and member
+list operations, parameterized by cluster size and queue depth.
+
+Results are written as JSON, so runs can be compared to find
+regressions:
+
+    $ python benchmarks/suite.py --output before.json
+    $ python benchmarks/suite.py --output after.json --compare before.json
+
+Use ``--filter`` to run only benchmarks with matching names and
+``--quick`` to skip the largest sizes.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import timeit
+
+from aioc.config import Config
+from aioc.dissemination_queue import DisseminationQueue
+from aioc.gossiper import Gossiper
+from aioc.mlist import MList
+from aioc.state import (encode_message, decode_message, decode_compaund,
+                        make_compaund, BINARY_CODEC, CBOR_CODEC)
+from aioc.state import (Alive, AckResp, Node, NodeMeta, NodeStatus, Ping,
+                        PushPull)
+from aioc.utils import LClock
+
+
+SIZES = (10, 100, 1000, 10000)
+QUICK_SIZES = (10, 100, 1000)
+CODECS = (CBOR_CODEC, BINARY_CODEC)
+
+
+class Listener:
+
+    def notify(self, event_type, node):
+        pass
+
+
+def make_node(i):
+    return Node('10.{}.{}.{}'.format(i // 62500, i // 250 % 250, i % 250),
+                7946)
+
+
+def make_meta(i, incarnation=1):
+    return NodeMeta(make_node(i), incarnation, b'role=web;zone=us-east-1a',
+                    NodeStatus.ALIVE, 1506970524.0, False)
+
+
+def make_config(**kw):
+    return Config(host='10.255.255.1', port=7946, **kw)
+
+
+def make_mlist(size, **kw):
+    mlist = MList(make_config(**kw), seed=1234)
+    for i in range(size - 1):
+        mlist.update_node(make_meta(i))
+    return mlist
+
+
+def make_alive(i):
+    node = make_node(i)
+    return Alive(node, node, 1, b'role=web;zone=us-east-1a')
+
+
+# benchmark functions prepare state and return callable that is timed
+
+
+def bench_encode_ping(codec):
+    msg = Ping(make_node(1), 1234567, make_node(2))
+    return lambda: encode_message(msg, codec)
+
+
+def bench_decode_ping(codec):
+    raw = encode_message(Ping(make_node(1), 1234567, make_node(2)), codec)
+    return lambda: decode_message(raw)
+
+
+def bench_encode_alive(codec):
+    msg = make_alive(1)
+    return lambda: encode_message(msg, codec)
+
+
+def bench_decode_compaund(codec):
+    ack = AckResp(make_node(1), 1234567, b'')
+    raws = [encode_message(ack, codec)]
+    raws += [encode_message(make_alive(i), codec) for i in range(10)]
+    raw = make_compaund(*raws)[1:]
+    return lambda: decode_compaund(raw)
+
+
+def bench_encode_push_pull(codec, size):
+    msg = PushPull(make_node(1), [make_meta(i) for i in range(size)], False)
+    return lambda: encode_message(msg, codec)
+
+
+def bench_decode_push_pull(codec, size):
+    msg = PushPull(make_node(1), [make_meta(i) for i in range(size)], False)
+    raw = encode_message(msg, codec)
+    return lambda: decode_message(raw)
+
+
+def bench_queue_put(depth):
+    mlist = make_mlist(100, max_queue_size=0)
+    queue = DisseminationQueue(mlist, mlist.config.retransmit_mult)
+    messages = [make_alive(i) for i in range(depth)]
+
+    def run():
+        for m in messages:
+            queue.put(m)
+    return run
+
+
+def bench_queue_get_update_up_to(depth):
+    mlist = make_mlist(100, max_queue_size=0)
+    queue = DisseminationQueue(mlist, mlist.config.retransmit_mult)
+    messages = [make_alive(i) for i in range(depth)]
+    for m in messages:
+        queue.put(m)
+
+    def run():
+        if len(queue) < depth // 2:
+            for m in messages:
+                queue.put(m)
+        queue.get_update_up_to(1400)
+    return run
+
+
+def bench_queue_get_update_packets(depth):
+    mlist = make_mlist(100, max_queue_size=0)
+    queue = DisseminationQueue(mlist, mlist.config.retransmit_mult)
+    messages = [make_alive(i) for i in range(depth)]
+    for m in messages:
+        queue.put(m)
+
+    def run():
+        if len(queue) < depth // 2:
+            for m in messages:
+                queue.put(m)
+        queue.get_update_packets(1400, 4)
+    return run
+
+
+def bench_mlist_kselect(size):
+    mlist = make_mlist(size)
+    return lambda: mlist.kselect(3)
+
+
+def bench_mlist_select(size):
+    mlist = make_mlist(size)
+    return lambda: mlist.select(3)
+
+
+def bench_mlist_update_node(size):
+    mlist = make_mlist(size)
+    metas = [make_meta(i, incarnation=2) for i in range(min(size - 1, 100))]
+    suspect = [m._replace(status=NodeStatus.SUSPECT) for m in metas]
+
+    def run():
+        for m in suspect:
+            mlist.update_node(m)
+        for m in metas:
+            mlist.update_node(m)
+    return run
+
+
+def bench_mlist_query(size):
+    # router style lookup, every 10th node is web in zone a
+    mlist = MList(make_config(), seed=1234)
+    for i in range(size - 1):
+        meta = 'role={};zone={}'.format(
+            'web' if i % 5 == 0 else 'db', 'a' if i % 2 == 0 else 'b')
+        mlist.update_node(make_meta(i)._replace(meta=meta.encode()))
+    tags = {'role': 'web', 'zone': 'a'}
+    return lambda: mlist.index.query(NodeStatus.ALIVE, tags)
+
+
+def bench_mlist_query_after_update(size):
+    # cache miss on every call, cost of intersecting indexes
+    mlist = MList(make_config(), seed=1234)
+    for i in range(size - 1):
+        meta = 'role={};zone={}'.format(
+            'web' if i % 5 == 0 else 'db', 'a' if i % 2 == 0 else 'b')
+        mlist.update_node(make_meta(i)._replace(meta=meta.encode()))
+    tags = {'role': 'web', 'zone': 'a'}
+    meta = mlist.node_meta(make_node(0))
+
+    def run():
+        mlist.update_node(meta)
+        mlist.index.query(NodeStatus.ALIVE, tags)
+    return run
+
+
+def bench_gossiper_merge(size):
+    # merging state we already know, most common push/pull outcome
+    mlist = make_mlist(size)
+    gossiper = Gossiper(mlist, Listener(), LClock(),
+                        loop=asyncio.new_event_loop())
+    msg = PushPull(make_node(0), list(mlist._members.values()), False)
+    return lambda: gossiper.merge(msg)
+
+
+def benchmarks(sizes):
+    for codec in CODECS:
+        yield 'encode_ping[{}]'.format(codec), bench_encode_ping, (codec,)
+        yield 'decode_ping[{}]'.format(codec), bench_decode_ping, (codec,)
+        yield 'encode_alive[{}]'.format(codec), bench_encode_alive, (codec,)
+        yield ('decode_compaund[{}]'.format(codec), bench_decode_compaund,
+               (codec,))
+        for size in sizes:
+            yield ('encode_push_pull[{},{}]'.format(codec, size),
+                   bench_encode_push_pull, (codec, size))
+            yield ('decode_push_pull[{},{}]'.format(codec, size),
+                   bench_decode_push_pull, (codec, size))
+    for depth in sizes:
+        yield 'queue_put[{}]'.format(depth), bench_queue_put, (depth,)
+        yield ('queue_get_update_up_to[{}]'.format(depth),
+               bench_queue_get_update_up_to, (depth,))
+        yield ('queue_get_update_packets[{}]'.format(depth),
+               bench_queue_get_update_packets, (depth,))
+    for size in sizes:
+        yield 'mlist_kselect[{}]'.format(size), bench_mlist_kselect, (size,)
+        yield 'mlist_select[{}]'.format(size), bench_mlist_select, (size,)
+        yield ('mlist_update_node[{}]'.format(size),
+               bench_mlist_update_node, (size,))
+        yield 'mlist_query[{}]'.format(size), bench_mlist_query, (size,)
+        yield ('mlist_query_after_update[{}]'.format(size),
+               bench_mlist_query_after_update, (size,))
+        yield ('gossiper_merge[{}]'.format(size), bench_gossiper_merge,
+               (size,))
+
+
+def measure(func, min_time, repeat):
+    """Returns best time per call in seconds out of ``repeat`` runs, each
+    run takes at least ``min_time`` seconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number, number
+
+
+def compare(results, baseline, threshold):
+    base = {r['name']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get(r['name'])
+        if b is None:
+            continue
+        ratio = r['seconds'] / b['seconds']
+        r['baseline_seconds'] = b['seconds']
+        r['ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='write JSON results to file')
+    parser.add_argument('--compare', help='baseline JSON results')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown ratio reported as regression')
+    parser.add_argument('--filter', default='',
+                        help='run benchmarks with name containing this')
+    parser.add_argument('--quick', action='store_true',
+                        help='skip largest cluster size')
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    results = []
+    for name, bench, params in benchmarks(sizes):
+        if args.filter not in name:
+            continue
+        func = bench(*params)
+        seconds, number = measure(func, args.min_time, args.repeat)
+        results.append({'name': name, 'seconds': seconds, 'number': number})
+        print('{:<44} {:>14.3f} us'.format(name, seconds * 1e6))
+
+    report = {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print('REGRESSION {:<33} {:>7.2f}x'.format(r['name'], r['ratio']))
+        status = 1 if regressions else 0
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
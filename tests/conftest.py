@@ -1,5 +1,10 @@
+import asyncio
 import pytest
+
 from aioc.config import Config
+from aioc.state import (Node, NodeMeta, NodeStatus, MetaReq, MetaResp,
+                        PushPull, PushPullDigest, PushPullDelta,
+                        encode_message, decode_message)
 
 
 @pytest.fixture
@@ -22,9 +27,121 @@ def config():
         gossip_to_dead=3600,
         probe_timeout=1,
         suspicion_mult=1,
-        suspicion_max_timeout_mult=1
+        suspicion_max_timeout_mult=1,
+        suspicion_tick=0.1
     )
     return conf
 
 
+def make_node_meta(port, status=NodeStatus.ALIVE, incarnation=1, meta=b'',
+                   state_change=1506970524):
+    return NodeMeta(
+        node=Node('127.0.0.1', port),
+        incarnation=incarnation,
+        meta=meta,
+        status=status,
+        state_change=state_change,
+        is_local=False)
+
+
+class Listener:
+    """Records membership events."""
+
+    def __init__(self):
+        self.events = []
+
+    def notify(self, event_type, node):
+        self.events.append((event_type, node))
+
+
+class FakeProtocol:
+    """Datagram transport recording raw packets."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, raw, address):
+        self.sent.append((raw, address))
+
+
+class FakeUDPServer:
+    """UDP connection manager recording ``(address, message)`` pairs,
+    raw packets are recorded as is.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, address, *messages):
+        for m in messages:
+            self.sent.append((address, m))
+
+    def send_raw_message(self, address, raw):
+        self.sent.append((address, raw))
+
+
+class FakeTCP:
+    """TCP connection manager serving requests in process. Push/pull
+    messages are routed straight to ``remote`` pusher handlers, round
+    tripped through codec, metadata requests are answered from ``blobs``
+    after short delay. Addresses in ``fail`` refuse connection, ones in
+    ``corrupt`` answer with wrong blob and ones in ``garbled`` send
+    response that can not be decoded.
+    """
+
+    def __init__(self, remote=None, blobs=None, fail=(), corrupt=(),
+                 garbled=()):
+        self.remote = remote
+        self.blobs = blobs or {}
+        self.fail = set(fail)
+        self.corrupt = set(corrupt)
+        self.garbled = set(garbled)
+        self.requests = []
+        self.received = []
+
+    @property
+    def sent(self):
+        return [m for _, m in self.requests]
+
+    async def send_message(self, address, message):
+        self.requests.append((address, message))
+        if isinstance(message, MetaReq):
+            return await self._meta_response(address, message)
+        message = decode_message(encode_message(message))
+        if isinstance(message, PushPullDelta):
+            resp = self.remote.handle_delta(message)
+        else:
+            resp = PushPull(self.remote._mlist.local_node,
+                            list(self.remote._mlist._members.values()),
+                            False)
+            self.remote._gossiper.merge(message)
+        return decode_message(encode_message(resp))
+
+    async def _meta_response(self, address, message):
+        await asyncio.sleep(0.01)
+        if address in self.fail:
+            raise ConnectionRefusedError()
+        if address in self.garbled:
+            raise RuntimeError('no such message type')
+        meta = self.blobs.get(message.meta_hash, b'')
+        if address in self.corrupt:
+            meta = meta[::-1] + b'!'
+        return MetaResp(address, message.meta_hash, meta)
+
+    async def send_stream(self, address, messages, handler):
+        resp = None
+        for message in messages:
+            self.requests.append((address, message))
+            message = decode_message(encode_message(message))
+            if isinstance(message, PushPullDigest):
+                resp = self.remote.handle_digest(message)
+            else:
+                resp = await self.remote.handle_chunk(message)
+        done = False
+        for message in resp:
+            self.received.append(message)
+            done = await handler(decode_message(encode_message(message)))
+        assert done
+
+
 pytest_plugins = []
@@ -0,0 +1,136 @@
+import pytest
+
+from aioc.broadcast import UserBroadcasts
+from aioc.gossiper import Gossiper
+from aioc.metrics import Metrics
+from aioc.mlist import MList
+from aioc.state import (Node, Suspect, UserMsg, encode_message,
+                        decode_message)
+from aioc.utils import LClock
+
+from conftest import Listener, make_node_meta
+
+
+@pytest.fixture
+def mlist(config):
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    return mlist
+
+
+def peer_msg(i, payload=b'invalidate'):
+    return UserMsg(Node('127.0.0.1', 8080), i, payload)
+
+
+@pytest.mark.asyncio
+async def test_receive_deduplicated(mlist, loop):
+    metrics = Metrics()
+    broadcasts = UserBroadcasts(mlist, loop, metrics)
+    first, second = broadcasts.subscribe(), broadcasts.subscribe()
+    msg = peer_msg(1)
+    assert broadcasts.receive(msg)
+    assert not broadcasts.receive(msg)
+
+    for inbox in (first, second):
+        assert await inbox.get() == msg
+        assert len(inbox) == 0
+    # received message is retransmitted once
+    assert len(broadcasts.queue) == 1
+    snapshot = metrics.snapshot()
+    assert snapshot['user.received'] == 1
+    assert snapshot['user.duplicates'] == 1
+
+    first.close()
+    assert await first.get() is None
+    broadcasts.receive(peer_msg(2))
+    assert len(first) == 0 and len(second) == 1
+
+
+@pytest.mark.asyncio
+async def test_own_broadcast(mlist, loop):
+    broadcasts = UserBroadcasts(mlist, loop)
+    inbox = broadcasts.subscribe()
+    waiter = broadcasts.broadcast(b'config/v2')
+    raw, = broadcasts.queue.get_update_up_to(1000)
+    msg = decode_message(raw)
+    assert msg.sender == mlist.local_node and msg.payload == b'config/v2'
+    # echo from peers is not delivered to own inbox
+    assert not broadcasts.receive(msg)
+    assert len(inbox) == 0
+
+    while broadcasts.queue:
+        broadcasts.queue.get_update_up_to(1000)
+    assert await waiter
+
+    with pytest.raises(ValueError):
+        broadcasts.broadcast(b'x' * mlist.config.udp_packet_size)
+
+
+@pytest.mark.asyncio
+async def test_inbox_drops_oldest(mlist, loop):
+    broadcasts = UserBroadcasts(mlist, loop)
+    inbox = broadcasts.subscribe(buffer_size=2)
+    msgs = [peer_msg(i) for i in range(4)]
+    for m in msgs:
+        broadcasts.receive(m)
+    assert inbox.dropped == 2
+
+    received = []
+    async for m in inbox:
+        received.append(m)
+        if len(received) == 2:
+            inbox.close()
+    assert received == msgs[2:]
+
+
+def test_queue_byte_budget(mlist, loop):
+    config = mlist.config._replace(user_queue_bytes=100)
+    mlist = MList(config, seed=1234)
+    broadcasts = UserBroadcasts(mlist, loop)
+    msgs = [peer_msg(i, b'x' * 30) for i in range(3)]
+    for m in msgs:
+        broadcasts.receive(m)
+    queue = broadcasts.queue
+    size = len(encode_message(msgs[0]))
+    assert queue.size_bytes == 2 * size <= 100
+    assert queue.dropped == 1
+    buffers = queue.get_update_up_to(1000)
+    assert buffers == [encode_message(m) for m in msgs[1:]]
+
+
+def test_packets_shared_with_membership(mlist, loop):
+    config = mlist.config
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    broadcasts = UserBroadcasts(mlist, loop)
+    gossiper.set_user_queue(broadcasts.queue)
+    for i in range(40):
+        broadcasts.receive(peer_msg(i, b'x' * 20))
+    user_raw = encode_message(peer_msg(0, b'x' * 20))
+    user_size = len(user_raw) + 4
+
+    # only user broadcasts pending, they take whole packet
+    packets = gossiper._update_packets(config.udp_packet_size, 1)
+    assert len(packets) == 1
+    assert len(packets[0]) == (config.udp_packet_size - 5) // user_size
+
+    for n in mlist.nodes[1:]:
+        gossiper.queue.put(Suspect(mlist.local_node, n, 1))
+    suspect_size = len(encode_message(
+        Suspect(mlist.local_node, mlist.nodes[1], 1))) + 4
+    packet, = gossiper._update_packets(config.udp_packet_size, 1)
+    used = sum(len(raw) + 4 for raw in packet)
+    assert used <= config.udp_packet_size - 5
+    user = [raw for raw in packet if raw[0] == user_raw[0]]
+    share = int((config.udp_packet_size - 5) * config.user_packet_ratio)
+    assert len(user) == share // user_size
+    assert len(packet) - len(user) == min(
+        9, (config.udp_packet_size - 5 - share) // suspect_size)
+
+    # probe and ack packets are shared the same way
+    buffers = gossiper.piggyback(200)
+    assert sum(len(raw) + 4 for raw in buffers) <= 200
+    user = [raw for raw in buffers if raw[0] == user_raw[0]]
+    assert len(user) == 100 // user_size
+    assert len(buffers) > len(user)
+    gossiper.close()
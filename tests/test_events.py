@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+
+from aioc.events import Event, EventListener, EventOverflow
+from aioc.metrics import Metrics
+from aioc.state import EventType, NodeStatus
+
+from conftest import make_node_meta
+
+
+@pytest.mark.asyncio
+async def test_multiple_subscribers(loop):
+    listener = EventListener(loop)
+    first, second = listener.subscribe(), listener.subscribe()
+    meta = make_node_meta(8080)
+    listener.notify(EventType.LEAVE, meta.node)
+
+    for s in (first, second):
+        batch = await s.get()
+        assert not batch.resync
+        assert batch.events == [Event(EventType.LEAVE, meta.node, None)]
+    assert len(first) == 0
+    await listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_async_iterator_batches(loop):
+    listener = EventListener(loop, max_batch=3)
+    subscription = listener.subscribe()
+    metas = [make_node_meta(8080 + i) for i in range(5)]
+    for m in metas:
+        listener.notify(EventType.UPDATE, m)
+
+    batches = []
+    async for batch in subscription:
+        batches.append([e.meta for e in batch.events])
+        if sum(len(b) for b in batches) == 5:
+            subscription.close()
+    assert batches == [metas[:3], metas[3:]]
+    assert await subscription.get() is None
+
+
+@pytest.mark.asyncio
+async def test_coalesce_updates(loop):
+    listener = EventListener(loop)
+    subscription = listener.subscribe()
+    a, b = make_node_meta(8080), make_node_meta(8081)
+    listener.notify(EventType.JOIN, a.node)
+    listener.notify(EventType.UPDATE, a)
+    listener.notify(EventType.UPDATE, b)
+    b2 = b._replace(incarnation=2, status=NodeStatus.SUSPECT)
+    listener.notify(EventType.UPDATE, b2)
+    a2 = a._replace(incarnation=2)
+    listener.notify(EventType.UPDATE, a2)
+
+    batch = await subscription.get()
+    # one event per node, ordered by last change, join keeps its type
+    assert batch.events == [Event(EventType.UPDATE, b.node, b2),
+                            Event(EventType.JOIN, a.node, a2)]
+
+    listener.notify(EventType.UPDATE, a)
+    listener.notify(EventType.LEAVE, a.node)
+    batch = await subscription.get()
+    assert batch.events == [Event(EventType.LEAVE, a.node, None)]
+
+
+@pytest.mark.asyncio
+async def test_overflow_drop_oldest(loop):
+    metrics = Metrics()
+    listener = EventListener(loop, metrics)
+    subscription = listener.subscribe(
+        buffer_size=3, overflow=EventOverflow.DROP_OLDEST)
+    metas = [make_node_meta(8080 + i) for i in range(5)]
+    for m in metas:
+        listener.notify(EventType.UPDATE, m)
+    batch = await subscription.get()
+    assert [e.meta for e in batch.events] == metas[2:]
+    assert subscription.dropped == 2
+    assert metrics.snapshot()['events.dropped'] == 2
+
+
+@pytest.mark.asyncio
+async def test_overflow_resync(loop):
+    members = [make_node_meta(8080 + i) for i in range(5)]
+    listener = EventListener(loop, snapshot=lambda: members,
+                             buffer_size=3)
+    subscription = listener.subscribe()
+    for m in members:
+        listener.notify(EventType.UPDATE, m)
+
+    batch = await subscription.get()
+    assert batch.resync
+    assert [e.meta for e in batch.events] == members
+    assert all(e.type == EventType.UPDATE for e in batch.events)
+    assert len(subscription) == 0
+
+    listener.notify(EventType.LEAVE, members[0].node)
+    batch = await subscription.get()
+    assert not batch.resync
+    assert batch.events == [Event(EventType.LEAVE, members[0].node, None)]
+
+
+@pytest.mark.asyncio
+async def test_batch_delay(loop):
+    listener = EventListener(loop)
+    subscription = listener.subscribe(batch_delay=0.05)
+    metas = [make_node_meta(8080 + i) for i in range(3)]
+
+    async def burst():
+        for m in metas:
+            listener.notify(EventType.UPDATE, m)
+            await asyncio.sleep(0.01)
+
+    task = loop.create_task(burst())
+    batch = await subscription.get()
+    await task
+    assert [e.meta for e in batch.events] == metas
+
+
+@pytest.mark.asyncio
+async def test_add_handler(loop):
+    listener = EventListener(loop)
+    received = []
+
+    async def handler(event_type, node):
+        received.append((event_type, node))
+        if len(received) == 1:
+            raise RuntimeError('handler failures are logged')
+
+    listener.add_handler(handler)
+    meta = make_node_meta(8080)
+    listener.notify(EventType.LEAVE, meta.node)
+    listener.notify(EventType.UPDATE, make_node_meta(8081))
+    await asyncio.sleep(0.01)
+    assert received == [(EventType.LEAVE, meta.node),
+                        (EventType.UPDATE, make_node_meta(8081))]
+    await listener.stop()
+    assert listener._handler_tasks == set()
@@ -0,0 +1,193 @@
+import asyncio
+import pytest
+
+from aioc.failure_detector import FailureDetector
+from aioc.mlist import MList
+from aioc.state import (NodeStatus, Node, IndirectPingReq, AckResp,
+                        NackResp, Ping)
+from aioc.utils import LClock
+
+from conftest import FakeUDPServer, make_node_meta
+
+
+@pytest.fixture
+def mlist(config):
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    return mlist
+
+
+@pytest.fixture
+def fd(mlist, loop):
+    fd = FailureDetector(mlist, None, None, LClock(), loop)
+    fd.probed = []
+
+    async def ping_node(node_meta):
+        fd.probed.append(node_meta.node)
+
+    fd.ping_node = ping_node
+    return fd
+
+
+@pytest.mark.asyncio
+async def test_probe_round_robin(mlist, fd):
+    for _ in range(30):
+        await fd.probe()
+    rounds = [fd.probed[i:i + 10] for i in range(0, 30, 10)]
+    expected = set(mlist.nodes) - {mlist.local_node}
+    for r in rounds:
+        assert set(r) == expected
+    # every round is reshuffled
+    assert rounds[0] != rounds[1] or rounds[1] != rounds[2]
+
+
+@pytest.mark.asyncio
+async def test_probe_skips_dead_nodes(mlist, fd):
+    dead = make_node_meta(8080, NodeStatus.DEAD)
+    suspect = make_node_meta(8081, NodeStatus.SUSPECT)
+    mlist.update_node(dead)
+    mlist.update_node(suspect)
+    for _ in range(18):
+        await fd.probe()
+    assert dead.node not in fd.probed
+    assert fd.probed.count(suspect.node) == 2
+
+
+@pytest.mark.asyncio
+async def test_probe_new_member(mlist, fd):
+    await fd.probe()
+    new = make_node_meta(9000)
+    mlist.update_node(new)
+    for _ in range(10):
+        await fd.probe()
+    assert new.node in fd.probed
+    assert len(set(fd.probed)) == 11
+
+
+class FakeGossiper:
+
+    def __init__(self):
+        self.suspected = []
+
+    def suspect(self, message):
+        self.suspected.append(message)
+
+
+@pytest.fixture
+def fast_config(config):
+    return config._replace(probe_timeout=0.05, probe_interval=0.2,
+                           indirect_checks=3)
+
+
+@pytest.fixture
+def probing(fast_config, loop):
+    mlist = MList(fast_config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    udp_server, gossiper = FakeUDPServer(), FakeGossiper()
+    fd = FailureDetector(mlist, udp_server, gossiper, LClock(), loop)
+    return mlist, fd, udp_server, gossiper
+
+
+@pytest.mark.asyncio
+async def test_indirect_probe_acked_by_helper(probing, loop):
+    mlist, fd, udp_server, gossiper = probing
+    target = mlist.node_meta(Node('127.0.0.1', 8080))
+
+    async def relay_ack():
+        while not any(isinstance(m, IndirectPingReq)
+                      for _, m in udp_server.sent):
+            await asyncio.sleep(0.01)
+        helper, req = udp_server.sent[-1]
+        fd.on_ack(AckResp(helper, req.sequence_num, b''))
+
+    relay = loop.create_task(relay_ack())
+    await fd.ping_node(target)
+    await relay
+
+    reqs = [(a, m) for a, m in udp_server.sent
+            if isinstance(m, IndirectPingReq)]
+    assert len(reqs) == 3
+    helpers = [a for a, _ in reqs]
+    assert target.node not in helpers
+    assert mlist.local_node not in helpers
+    assert all(m.target == target.node and m.nack for _, m in reqs)
+    assert gossiper.suspected == []
+
+
+@pytest.mark.asyncio
+async def test_indirect_probe_timeout_suspects(probing):
+    mlist, fd, udp_server, gossiper = probing
+    target = mlist.node_meta(Node('127.0.0.1', 8080))
+    await fd.ping_node(target)
+    assert [s.node for s in gossiper.suspected] == [target.node]
+    assert fd._probes == {}
+
+
+@pytest.mark.asyncio
+async def test_relay_indirect_ping(probing):
+    mlist, fd, udp_server, gossiper = probing
+    requester, target = Node('127.0.0.1', 8081), Node('127.0.0.1', 8082)
+
+    fd.on_indirect_ping(IndirectPingReq(requester, 77, target, True))
+    await asyncio.sleep(0.01)
+    address, ping = udp_server.sent[-1]
+    assert address == target and isinstance(ping, Ping)
+    fd.on_ack(AckResp(target, ping.sequence_num, b''))
+    await asyncio.sleep(0.01)
+    address, ack = udp_server.sent[-1]
+    assert address == requester
+    assert ack == AckResp(mlist.local_node, 77, b'')
+
+    # target does not answer, requester gets nack
+    fd.on_indirect_ping(IndirectPingReq(requester, 78, target, True))
+    await asyncio.sleep(0.1)
+    address, nack = udp_server.sent[-1]
+    assert address == requester
+    assert nack == NackResp(mlist.local_node, 78)
+    await fd.close()
+
+
+@pytest.mark.asyncio
+async def test_awareness_missed_nacks(probing, fast_config):
+    mlist, fd, udp_server, gossiper = probing
+    target = mlist.node_meta(Node('127.0.0.1', 8080))
+    await fd.ping_node(target)
+    # none of 3 helpers answered with nack
+    assert fd.awareness.health_score == 3
+    assert fd.probe_interval() == pytest.approx(
+        4 * fast_config.probe_interval)
+
+
+@pytest.mark.asyncio
+async def test_awareness_nacks_and_acks(probing, loop):
+    mlist, fd, udp_server, gossiper = probing
+    target = mlist.node_meta(Node('127.0.0.1', 8080))
+
+    async def nack():
+        while not any(isinstance(m, IndirectPingReq)
+                      for _, m in udp_server.sent):
+            await asyncio.sleep(0.01)
+        for helper, req in udp_server.sent[1:]:
+            fd.on_nack(NackResp(helper, req.sequence_num))
+
+    task = loop.create_task(nack())
+    await fd.ping_node(target)
+    await task
+    assert fd.awareness.health_score == 0
+    assert len(gossiper.suspected) == 1
+
+    fd.awareness.apply_delta(2)
+
+    async def ack():
+        while not udp_server.sent:
+            await asyncio.sleep(0.001)
+        _, ping = udp_server.sent[-1]
+        fd.on_ack(AckResp(target.node, ping.sequence_num, b''))
+
+    udp_server.sent.clear()
+    task = loop.create_task(ack())
+    await fd.ping_node(target)
+    await task
+    assert fd.awareness.health_score == 1
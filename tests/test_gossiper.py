@@ -0,0 +1,220 @@
+import asyncio
+import pytest
+
+from aioc.gossiper import Gossiper
+from aioc.mlist import MList
+from aioc.net import UDPConnectionManager
+from aioc.state import (NodeStatus, Node, Suspect, Alive, Dead,
+                        Ping, EventType, COMPRESS_MSG, LENGTH_SIZE,
+                        add_msg_size, decode_messages, decode_msg_size,
+                        encode_message)
+from aioc.utils import LClock
+
+from conftest import FakeProtocol, FakeUDPServer, Listener, make_node_meta
+
+
+@pytest.fixture
+def suspicion_config(config):
+    return config._replace(suspicion_mult=3, suspicion_max_timeout_mult=2,
+                           probe_interval=0.05, suspicion_tick=0.01)
+
+
+@pytest.fixture
+def gossiper(suspicion_config, loop):
+    mlist = MList(suspicion_config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    yield g
+    g.close()
+
+
+def node_status(gossiper, node):
+    return gossiper._mlist.node_meta(node).status
+
+
+@pytest.mark.asyncio
+async def test_suspect_then_dead(gossiper):
+    node = Node('127.0.0.1', 8080)
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    assert node_status(gossiper, node) == NodeStatus.SUSPECT
+    assert node in gossiper._suspicions
+
+    # no confirmations, so timeout is 2 * 3 * log10(11) * 0.05 ~ 0.31s
+    await asyncio.sleep(0.2)
+    assert node_status(gossiper, node) == NodeStatus.SUSPECT
+    await asyncio.sleep(0.25)
+    assert node_status(gossiper, node) == NodeStatus.DEAD
+    assert node not in gossiper._suspicions
+    assert (EventType.LEAVE, node) in gossiper._listener.events
+
+
+@pytest.mark.asyncio
+async def test_k_confirmations_declare_dead(gossiper):
+    node = Node('127.0.0.1', 8080)
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    # same accuser does not count as confirmation
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    assert node_status(gossiper, node) == NodeStatus.SUSPECT
+    # k is suspicion_mult - 2 = 1
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8082), node, 1))
+    assert node_status(gossiper, node) == NodeStatus.DEAD
+    assert len(gossiper._timer_wheel) == 0
+
+
+@pytest.mark.asyncio
+async def test_overdue_confirmation_broadcasts_dead(suspicion_config, loop):
+    config = suspicion_config._replace(suspicion_mult=5)
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    node = Node('127.0.0.1', 8080)
+    g.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    # timer is behind, confirmation finds remaining time already elapsed
+    g._suspicions[node]._start_time -= 100
+    g.suspect(Suspect(Node('127.0.0.1', 8082), node, 1))
+
+    assert node_status(g, node) == NodeStatus.DEAD
+    assert isinstance(g.queue._index[node].message, Dead)
+    g.close()
+
+
+def test_suspicion_k_not_negative(config, loop):
+    mlist = MList(config._replace(suspicion_mult=1), seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    node = Node('127.0.0.1', 8080)
+    g.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    assert g._suspicions[node].k == 0
+    g.close()
+
+
+@pytest.mark.asyncio
+async def test_alive_cancels_suspicion(gossiper):
+    node = Node('127.0.0.1', 8080)
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8081), node, 1))
+    gossiper.alive(Alive(node, node, 2, b''))
+    assert node_status(gossiper, node) == NodeStatus.ALIVE
+    assert gossiper._suspicions == {}
+    assert len(gossiper._timer_wheel) == 0
+    await asyncio.sleep(0.3)
+    assert node_status(gossiper, node) == NodeStatus.ALIVE
+
+
+@pytest.mark.asyncio
+async def test_suspect_local_node_refutes(gossiper):
+    local = gossiper._mlist.local_node
+    gossiper.suspect(Suspect(Node('127.0.0.1', 8081), local, 1))
+    assert gossiper._suspicions == {}
+    assert len(gossiper.queue) == 1
+    assert gossiper._awareness.health_score == 1
+
+
+@pytest.mark.asyncio
+async def test_dead_local_node_from_peer_refutes(gossiper):
+    local = gossiper._mlist.local_node
+    peer = Node('127.0.0.1', 8081)
+    gossiper.dead(Dead(peer, 1, local, peer))
+    assert node_status(gossiper, local) == NodeStatus.ALIVE
+    assert (EventType.LEAVE, local) not in gossiper._listener.events
+    message = gossiper.queue._index[local].message
+    assert isinstance(message, Alive)
+    assert message.incarnation > 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('compression', [False, True])
+async def test_gossip_packets(suspicion_config, loop, compression):
+    config = suspicion_config._replace(gossip_nodes=1,
+                                       gossip_compression=compression)
+    mlist = MList(config, seed=1234)
+    mlist.update_node(make_node_meta(8080))
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    messages = [Alive(Node('127.0.0.1', 9000 + i), Node('127.0.0.1', 9000 + i),
+                      1, b'role=web;zone=us-east-1a') for i in range(5)]
+    for m in messages:
+        g.queue.put(m)
+
+    udp = FakeUDPServer()
+    await g.gossip(udp)
+    (addr, raw), = udp.sent
+    assert addr == ('127.0.0.1', 8080)
+    assert decode_msg_size(raw) == len(raw) - LENGTH_SIZE
+    payload = memoryview(raw)[LENGTH_SIZE:]
+    assert (payload[0] == COMPRESS_MSG) == compression
+    assert sorted(decode_messages(payload)) == sorted(messages)
+    g.close()
+
+
+@pytest.mark.asyncio
+async def test_piggyback_on_ping(suspicion_config, loop):
+    mlist = MList(suspicion_config, seed=1234)
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    messages = [Alive(Node('127.0.0.1', 9000 + i), Node('127.0.0.1', 9000 + i),
+                      1, b'role=web;zone=us-east-1a') for i in range(50)]
+    for m in messages:
+        g.queue.put(m)
+
+    protocol = FakeProtocol()
+    cm = UDPConnectionManager(protocol, suspicion_config.codec,
+                              packet_size=508)
+    cm.set_piggyback(g.piggyback)
+    ping = Ping(mlist.local_node, 1, Node('127.0.0.1', 8080))
+    cm.send_message(('127.0.0.1', 8080), ping)
+
+    (raw, _), = protocol.sent
+    assert 400 < len(raw) <= 508
+    decoded = decode_messages(memoryview(raw)[LENGTH_SIZE:])
+    assert decoded[0] == ping
+    assert len(decoded) > 1
+    assert all(m in messages for m in decoded[1:])
+
+    # once queue is drained ping is sent without compound header
+    while g.queue:
+        g.queue.get_update_up_to(10000)
+    protocol.sent.clear()
+    cm.send_message(('127.0.0.1', 8080), ping)
+    (raw, _), = protocol.sent
+    assert raw == add_msg_size(encode_message(ping))
+    assert decode_messages(memoryview(raw)[LENGTH_SIZE:]) == [ping]
+    g.close()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_fanout_and_interval(config, loop):
+    config = config._replace(adaptive_gossip=True, gossip_nodes=1,
+                             gossip_nodes_max=4, gossip_interval=1,
+                             gossip_interval_min=0.2, gossip_backlog_high=8)
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+    g = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    assert g.gossip_fanout() == 1
+    assert g.gossip_interval() == 1
+
+    for i in range(4):
+        g.queue.put(Alive(Node('127.0.0.1', 9000 + i),
+                          Node('127.0.0.1', 9000 + i), 1, b''))
+    assert g.gossip_fanout() == 3
+    assert g.gossip_interval() == pytest.approx(0.6)
+
+    for i in range(4, 20):
+        g.queue.put(Alive(Node('127.0.0.1', 9000 + i),
+                          Node('127.0.0.1', 9000 + i), 1, b''))
+    assert g.gossip_fanout() == 4
+    assert g.gossip_interval() == pytest.approx(0.2)
+
+    udp = FakeUDPServer()
+    await g.gossip(udp)
+    assert len({addr for addr, _ in udp.sent}) == 4
+    g.close()
+
+    static = Gossiper(MList(config._replace(adaptive_gossip=False)),
+                      Listener(), LClock(), loop=loop)
+    static.queue.put(Alive(Node('127.0.0.1', 9000),
+                           Node('127.0.0.1', 9000), 1, b''))
+    assert static.gossip_fanout() == config.gossip_nodes
+    assert static.gossip_interval() == config.gossip_interval
+    static.close()
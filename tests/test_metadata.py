@@ -0,0 +1,206 @@
+import asyncio
+import pytest
+
+from aioc.gossiper import Gossiper
+from aioc.metadata import MetaCache, MetaFetcher, meta_hash
+from aioc.metrics import Metrics
+from aioc.mlist import MList
+from aioc.state import (Alive, AliveDigest, EventType, MetaReq, MetaResp,
+                        Node, NodeMeta, NodeStatus, PushPull)
+from aioc.utils import LClock
+
+from conftest import FakeTCP, Listener
+
+
+def test_meta_cache_lru():
+    cache = MetaCache(max_bytes=10)
+    a = cache.put(b'aaaa')
+    b = cache.put(b'bbbb')
+    assert cache.get(a) == b'aaaa'
+    c = cache.put(b'cccc')
+    # b is least recently used
+    assert cache.get(b) is None
+    assert cache.get(a) == b'aaaa' and cache.get(c) == b'cccc'
+    assert len(cache) == 2 and cache.size == 8
+
+    big = cache.put(b'x' * 100)
+    assert len(cache) == 1 and cache.get(big) == b'x' * 100
+    assert a == meta_hash(b'aaaa') and len(a) == 16
+
+
+@pytest.mark.asyncio
+async def test_fetch_deduplicated(config, loop):
+    mlist = MList(config)
+    local = mlist.local_node
+    meta = b'role=web;' * 100
+    key = meta_hash(meta)
+    source = Node('127.0.0.1', 9001)
+    tcp = FakeTCP(blobs={key: meta})
+    fetched = []
+    metrics = Metrics()
+    fetcher = MetaFetcher(
+        tcp, MetaCache(1024 * 1024), mlist,
+        lambda *args: fetched.append(args), loop=loop, metrics=metrics)
+
+    nodes = [Node('127.0.0.1', 8080 + i) for i in range(5)]
+    for node in nodes:
+        fetcher.fetch(key, node, 1, [source, local])
+    assert len(fetcher) == 1
+    await asyncio.gather(*fetcher._tasks)
+
+    assert len(tcp.requests) == 1
+    assert tcp.requests[0] == (source, MetaReq(local, key))
+    assert fetched == [(n, 1, meta) for n in nodes]
+    assert len(fetcher) == 0
+    assert metrics.snapshot()['meta.fetched'] == 1
+
+    # fetched blob is served to others
+    resp = fetcher.handle_request(MetaReq(source, key))
+    assert resp == MetaResp(local, key, meta)
+    await fetcher.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_tries_next_source(config, loop):
+    mlist = MList(config)
+    meta = b'x' * 1000
+    key = meta_hash(meta)
+    down, bad, old, good = (Node('127.0.0.1', 9001 + i) for i in range(4))
+    # bad source returns blob that does not match the hash, old one
+    # sends response that can not be decoded
+    tcp = FakeTCP(blobs={key: meta}, fail=[down], corrupt=[bad], garbled=[old])
+    fetched = []
+    metrics = Metrics()
+    fetcher = MetaFetcher(
+        tcp, MetaCache(1024 * 1024), mlist,
+        lambda *args: fetched.append(args), loop=loop, metrics=metrics)
+    fetcher.fetch(key, good, 2, [down, bad, old, good])
+    await asyncio.gather(*fetcher._tasks)
+    assert fetched == [(good, 2, meta)]
+    assert [a for a, _ in tcp.requests] == [down, bad, old, good]
+
+    fetcher.fetch(meta_hash(b'missing'), good, 3, [down])
+    await asyncio.gather(*fetcher._tasks)
+    assert len(fetched) == 1
+    assert metrics.snapshot()['meta.fetch_failures'] == 1
+
+
+@pytest.mark.asyncio
+async def test_gossiper_digest_flow(config, loop):
+    config = config._replace(meta_digest=True, meta_digest_threshold=16)
+    mlist = MList(config, seed=1234)
+    listener = Listener()
+    gossiper = Gossiper(mlist, listener, LClock(), loop=loop)
+    meta = b'role=web;' * 1000
+    key = meta_hash(meta)
+    node = Node('127.0.0.1', 8080)
+    sender = Node('127.0.0.1', 8081)
+    tcp = FakeTCP(blobs={key: meta})
+    fetcher = MetaFetcher(tcp, gossiper.meta_cache, mlist,
+                          gossiper.apply_meta, loop=loop)
+    gossiper.set_meta_fetcher(fetcher)
+
+    digest = AliveDigest(sender, node, 1, key)
+    gossiper.alive_digest(digest)
+    # status is applied right away, metadata follows
+    node_meta = mlist.node_meta(node)
+    assert node_meta.status == NodeStatus.ALIVE
+    assert node_meta.meta == b''
+    assert gossiper.queue._index[node].message == digest
+
+    await asyncio.gather(*fetcher._tasks)
+    assert mlist.node_meta(node).meta == meta
+    assert tcp.requests[0][0] == node
+    assert listener.events[-1] == (EventType.UPDATE, mlist.node_meta(node))
+
+    # known hash is resolved from cache without fetch
+    gossiper.alive_digest(digest._replace(incarnation=2))
+    assert mlist.node_meta(node).incarnation == 2
+    assert len(tcp.requests) == 1
+    assert not fetcher._tasks
+
+    # large metadata received in full is gossiped as hash
+    other = Node('127.0.0.1', 8082)
+    gossiper.alive(Alive(other, other, 1, b'z' * 100))
+    broadcast = gossiper.queue._index[other].message
+    assert broadcast == AliveDigest(other, other, 1, meta_hash(b'z' * 100))
+    gossiper.close()
+
+
+def test_stale_fetch_ignored(config, loop):
+    mlist = MList(config, seed=1234)
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    node = Node('127.0.0.1', 8080)
+    mlist.update_node(NodeMeta(node, 2, b'new', NodeStatus.ALIVE, 0, False))
+    gossiper.apply_meta(node, 1, b'old')
+    assert mlist.node_meta(node).meta == b'new'
+    gossiper.close()
+
+
+@pytest.mark.asyncio
+async def test_pushed_pending_meta(config, loop):
+    mlist = MList(config._replace(meta_digest=True), seed=1234)
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    meta = b'x' * 1000
+    key = meta_hash(meta)
+    node = Node('127.0.0.1', 8080)
+    sender = Node('127.0.0.1', 8081)
+    tcp = FakeTCP(blobs={key: meta})
+    fetcher = MetaFetcher(tcp, gossiper.meta_cache, mlist,
+                          gossiper.apply_meta, loop=loop)
+    gossiper.set_meta_fetcher(fetcher)
+    mlist.update_node(NodeMeta(node, 1, b'old', NodeStatus.ALIVE, 0, False))
+
+    # push/pull from peer still fetching metadata of this incarnation
+    pending = NodeMeta(node, 2, b'old', NodeStatus.ALIVE, 0, False, key)
+    gossiper.merge(PushPull(sender, [pending], False))
+    assert mlist.node_meta(node).meta_hash == key
+    # gossiped hash is passed on, not hash of old metadata
+    assert gossiper.queue._index[node].message == AliveDigest(
+        sender, node, 2, key)
+
+    await asyncio.gather(*fetcher._tasks)
+    assert mlist.node_meta(node).meta == meta
+    assert mlist.node_meta(node).meta_hash is None
+
+    gossiper.alive_digest(AliveDigest(node, node, 2, key))
+    assert len(tcp.requests) == 1
+    gossiper.close()
+
+
+def test_fetched_meta_must_match_gossiped_hash(config, loop):
+    mlist = MList(config._replace(meta_digest=True), seed=1234)
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    node = Node('127.0.0.1', 8080)
+    new, old = b'n' * 1000, b'o' * 1000
+    mlist.update_node(
+        NodeMeta(node, 5, b'', NodeStatus.ALIVE, 0, False, meta_hash(new)))
+    gossiper.apply_meta(node, 5, old)
+    assert mlist.node_meta(node).meta == b''
+
+    gossiper.apply_meta(node, 5, new)
+    assert mlist.node_meta(node).meta == new
+    # entry holding fetched blob is not replaced by stale one
+    gossiper.apply_meta(node, 5, old)
+    assert mlist.node_meta(node).meta == new
+    gossiper.close()
+
+
+def test_serve_own_meta_after_eviction(config, loop):
+    mlist = MList(config)
+    meta = b'x' * 1000
+    mlist.update_node(mlist.local_node_meta._replace(meta=meta))
+    cache = MetaCache(max_bytes=4096)
+    key = cache.put(meta)
+    fetcher = MetaFetcher(FakeTCP(blobs={}), cache, mlist, lambda *args: None,
+                          loop=loop)
+    # blobs of other members push own one out of cache
+    for i in range(10):
+        cache.put(bytes([i]) * 1000)
+    assert cache.get(key) is None
+
+    resp = fetcher.handle_request(MetaReq(Node('127.0.0.1', 9001), key))
+    assert resp.meta == meta
+    resp = fetcher.handle_request(
+        MetaReq(Node('127.0.0.1', 9001), meta_hash(b'other')))
+    assert resp.meta == b''
@@ -0,0 +1,138 @@
+import pytest
+
+from aioc.failure_detector import FailureDetector
+from aioc.gossiper import Gossiper
+from aioc.metrics import Metrics, MetricsSink, NULL_METRICS
+from aioc.mlist import MList
+from aioc.net import UDPConnectionManager, UDPServerProtocol
+from aioc.state import (AckResp, Alive, Node, Ping,
+                        Suspect, add_msg_size, encode_message, encode_packet,
+                        maybe_compress)
+from aioc.utils import LClock
+
+from conftest import FakeProtocol, FakeUDPServer, Listener, make_node_meta
+
+
+class Sink(MetricsSink):
+
+    def __init__(self):
+        self.snapshots = []
+
+    def emit(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+@pytest.mark.asyncio
+async def test_registry():
+    metrics = Metrics()
+    metrics.counter('c').inc()
+    metrics.counter('c').inc(2)
+    depth = [5]
+    metrics.gauge('g', lambda: depth[0])
+    h = metrics.histogram('h', buckets=(0.1, 1))
+    for v in (0.05, 0.5, 0.7, 3):
+        h.observe(v)
+    family = metrics.counter_family('f')
+    family.labels('ping').inc()
+
+    depth[0] = 7
+    snapshot = metrics.snapshot()
+    assert snapshot['c'] == 3
+    assert snapshot['g'] == 7
+    assert snapshot['h']['count'] == 4
+    assert snapshot['h']['buckets'] == {'0.1': 1, '1': 2, 'inf': 1}
+    assert snapshot['f'] == {'ping': 1}
+
+    sink = Sink()
+    metrics.add_sink(sink)
+    await metrics.flush()
+    assert sink.snapshots == [snapshot]
+
+
+def test_null_metrics():
+    assert not NULL_METRICS.enabled
+    NULL_METRICS.counter('c').inc()
+    NULL_METRICS.histogram('h').observe(1)
+    NULL_METRICS.counter_family('f').labels('ping').inc(3)
+    NULL_METRICS.gauge('g', lambda: 1)
+    assert NULL_METRICS.snapshot() == {}
+
+
+def test_udp_metrics(loop):
+    metrics = Metrics()
+    ping = Ping(Node('127.0.0.1', 1), 1, Node('127.0.0.1', 2))
+    alive = Alive(Node('127.0.0.1', 1), Node('127.0.0.1', 1), 1, b'')
+    cm = UDPConnectionManager(FakeProtocol(), metrics=metrics)
+    cm.send_message(('127.0.0.1', 2), ping)
+    cm.send_message(('127.0.0.1', 2), ping, alive)
+
+    protocol = UDPServerProtocol(loop, metrics)
+    protocol.set_handler(lambda *args: None)
+    raw = encode_packet(ping)
+    protocol.datagram_received(raw, ('127.0.0.1', 2))
+
+    snapshot = metrics.snapshot()
+    # packets are counted by contained message types
+    assert snapshot['udp.packets_sent'] == {'ping': 2, 'alive': 1}
+    ping_size = len(encode_message(ping)) + 4
+    alive_size = len(encode_message(alive)) + 4
+    assert snapshot['udp.bytes_sent'] == {'ping': 2 * ping_size,
+                                          'alive': alive_size}
+    assert snapshot['udp.packets_received'] == {'ping': 1}
+    assert snapshot['udp.bytes_received'] == {'ping': ping_size}
+
+
+def test_compressed_packet_metrics(loop):
+    metrics = Metrics()
+    cm = UDPConnectionManager(FakeProtocol(), metrics=metrics)
+    raw = add_msg_size(maybe_compress(encode_message(
+        Alive(Node('127.0.0.1', 1), Node('127.0.0.1', 1), 1, b'x' * 500))))
+    cm.send_raw_message(('127.0.0.1', 2), raw)
+    snapshot = metrics.snapshot()
+    assert snapshot['udp.packets_sent'] == {'compressed': 1}
+    assert snapshot['udp.bytes_sent'] == {'compressed': len(raw)}
+
+
+@pytest.mark.asyncio
+async def test_failure_detector_metrics(config, loop):
+    config = config._replace(probe_timeout=0.05, probe_interval=0.1)
+    metrics = Metrics()
+    mlist = MList(config, seed=1234)
+    mlist.update_node(make_node_meta(8080))
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop,
+                        metrics=metrics)
+    udp_server = FakeUDPServer()
+    fd = FailureDetector(mlist, udp_server, gossiper, LClock(), loop,
+                         metrics=metrics)
+    target = mlist.node_meta(Node('127.0.0.1', 8080))
+
+    loop.call_later(0.01, lambda: fd.on_ack(
+        AckResp(target.node, udp_server.sent[-1][1].sequence_num, b'')))
+    await fd.ping_node(target)
+    # no helpers, so probe fails after direct timeout
+    await fd.ping_node(target)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['fd.probes'] == 2
+    assert snapshot['fd.probe_rtt']['count'] == 1
+    assert snapshot['fd.probe_timeouts'] == 1
+    assert snapshot['fd.probe_failures'] == 1
+    assert snapshot['suspicion.started'] == 1
+    assert snapshot['suspicion.active'] == 1
+    assert snapshot['gossip.queue_depth'] == 1
+
+    gossiper.alive(Alive(target.node, target.node, 2, b''))
+    snapshot = metrics.snapshot()
+    assert snapshot['suspicion.refuted'] == 1
+    assert snapshot['suspicion.active'] == 0
+    gossiper.close()
+
+
+def test_gossiper_metrics_disabled(config, loop):
+    mlist = MList(config, seed=1234)
+    mlist.update_node(make_node_meta(8080))
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    gossiper.suspect(Suspect(Node('127.0.0.1', 1), Node('127.0.0.1', 8080),
+                             1))
+    assert len(gossiper._suspicions) == 1
+    gossiper.close()
@@ -1,6 +1,10 @@
+import time
+
 from aioc.mlist import MList
 from aioc.state import NodeStatus, Node, NodeMeta
 
+from conftest import make_node_meta
+
 
 def test_basic_mlist_ctor(config):
     mlist = MList(config, seed=1234)
@@ -54,3 +58,80 @@ def test_mutiple_nodes_kselect(config):
 
     node_metas = mlist.select_gossip_nodes()
     assert len(node_metas) == config.gossip_nodes
+
+
+def test_nodes_are_unique(config):
+    mlist = MList(config, seed=1234)
+    node_meta = make_node_meta(8080)
+    for i in range(3):
+        mlist.update_node(node_meta._replace(incarnation=i))
+    assert mlist.nodes == [mlist.local_node, node_meta.node]
+
+
+def test_select_status_partitions(config):
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        mlist.update_node(make_node_meta(8080 + i))
+
+    suspect = make_node_meta(8081, NodeStatus.SUSPECT)
+    dead = make_node_meta(8082, NodeStatus.DEAD, state_change=100)
+    mlist.update_node(suspect)
+    mlist.update_node(dead)
+
+    selected = mlist.select(100)
+    assert len(selected) == 9
+    assert mlist.local_node not in [n.node for n in selected]
+    assert suspect in selected
+
+    selected = mlist.select(100, suspect=False)
+    assert len(selected) == 8
+    assert all(n.status == NodeStatus.ALIVE for n in selected)
+
+    assert dead in mlist.select(100, dead_since=100)
+    assert dead not in mlist.select(100, dead_since=101)
+
+    # node comes back to life and leaves dead index
+    mlist.update_node(dead._replace(status=NodeStatus.ALIVE))
+    mlist.update_node(suspect._replace(status=NodeStatus.ALIVE))
+    selected = mlist.select(100, suspect=False, dead_since=0)
+    assert len(selected) == 10
+    assert len(set(n.node for n in selected)) == 10
+
+    assert len(mlist.select(3)) == 3
+
+
+def test_select_gossip_nodes_skips_long_dead(config):
+    config = config._replace(gossip_nodes=10, gossip_to_dead=60)
+    mlist = MList(config, seed=1234)
+    recently_dead = make_node_meta(8080, NodeStatus.DEAD,
+                                   state_change=time.time())
+    long_dead = make_node_meta(8081, NodeStatus.DEAD,
+                               state_change=time.time() - 120)
+    mlist.update_node(recently_dead)
+    mlist.update_node(long_dead)
+    assert mlist.select_gossip_nodes() == [recently_dead]
+
+
+def test_digest_tracks_updates(config):
+    mlist = MList(config, seed=1234)
+    other = MList(config, seed=1234)
+    empty = mlist.digest.buckets
+    node_meta = make_node_meta(8080)
+    for m in (mlist, other):
+        m.update_node(node_meta)
+    assert mlist.digest.buckets != empty
+    assert mlist.digest.buckets == other.digest.buckets
+
+    mlist.update_node(node_meta._replace(status=NodeStatus.SUSPECT))
+    diff = mlist.digest.diff(other.digest.buckets)
+    assert diff == [mlist.digest.bucket_of(node_meta.node)]
+    assert node_meta.node in [n.node for n in mlist.bucket_members(diff)]
+
+    mlist.update_node(node_meta)
+    assert mlist.digest.diff(other.digest.buckets) == []
+
+
+def test_digest_disabled(config):
+    mlist = MList(config._replace(push_pull_buckets=0), seed=1234)
+    mlist.update_node(make_node_meta(8080))
+    assert mlist.digest is None
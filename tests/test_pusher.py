@@ -0,0 +1,278 @@
+import asyncio
+import pytest
+
+from aioc.gossiper import Gossiper
+from aioc.mlist import MList
+from aioc.pusher import Pusher, push_pull_scale
+from aioc.state import (Node, PushPull, PushPullDigest, PushPullChunk,
+                        encode_message)
+from aioc.utils import LClock
+
+from conftest import FakeTCP, Listener, make_node_meta
+
+
+def make_pusher(config, port, loop, remote=None):
+    mlist = MList(config._replace(port=port), seed=port)
+    gossiper = Gossiper(mlist, Listener(), LClock(), loop=loop)
+    tcp = FakeTCP(remote) if remote is not None else None
+    return Pusher(mlist, gossiper, tcp, loop)
+
+
+def members(pusher):
+    return {n: (m.incarnation, m.status)
+            for n, m in pusher._mlist._members.items()}
+
+
+@pytest.fixture
+def pushers(config, loop):
+    remote = make_pusher(config, 7000, loop)
+    local = make_pusher(config, 7001, loop, remote)
+    for i in range(500):
+        meta = make_node_meta(8000 + i)
+        local._mlist.update_node(meta)
+        remote._mlist.update_node(meta)
+    local._mlist.update_node(remote._mlist.local_node_meta)
+    remote._mlist.update_node(local._mlist.local_node_meta)
+    yield local, remote
+    local._gossiper.close()
+    remote._gossiper.close()
+
+
+@pytest.mark.asyncio
+async def test_delta_in_sync(pushers):
+    local, remote = pushers
+    assert local._mlist.digest.buckets == remote._mlist.digest.buckets
+
+    await local.push_pull_address(remote._mlist.local_node)
+    sent = local._tcp.sent
+    assert len(sent) == 1
+    assert isinstance(sent[0], PushPullDigest)
+
+
+@pytest.mark.asyncio
+async def test_delta_ships_only_divergent(pushers):
+    local, remote = pushers
+    newer_remote = make_node_meta(8001, incarnation=5)
+    remote._mlist.update_node(newer_remote)
+    newer_local = make_node_meta(8002, incarnation=7)
+    local._mlist.update_node(newer_local)
+    only_local = make_node_meta(9000)
+    local._mlist.update_node(only_local)
+
+    await local.push_pull_address(remote._mlist.local_node)
+    assert members(local) == members(remote)
+    assert local._mlist.digest.buckets == remote._mlist.digest.buckets
+
+    digest, push = local._tcp.sent
+    assert isinstance(digest, PushPullDigest)
+    assert {n.node for n in push.nodes} == {newer_local.node,
+                                            only_local.node}
+    full = encode_message(PushPull(
+        local._mlist.local_node, list(local._mlist._members.values()), False))
+    assert len(encode_message(push)) < len(full) // 10
+
+
+@pytest.mark.asyncio
+async def test_join_uses_full_state(pushers):
+    local, remote = pushers
+    remote._mlist.update_node(make_node_meta(9001))
+    await local.join(remote._mlist.local_node)
+    sent = local._tcp.sent
+    assert all(isinstance(m, PushPullChunk) and m.join for m in sent)
+    assert members(local) == members(remote)
+
+
+@pytest.mark.asyncio
+async def test_full_state_streamed_in_chunks(pushers):
+    local, remote = pushers
+    for i in range(10):
+        remote._mlist.update_node(make_node_meta(9000 + i))
+    await local.join(remote._mlist.local_node)
+
+    # 502 local members, 512 remote members, chunks of 256
+    sent, received = local._tcp.sent, local._tcp.received
+    assert [len(c.nodes) for c in sent] == [256, 246]
+    assert [c.last for c in sent] == [False, True]
+    assert [len(c.nodes) for c in received] == [256, 256]
+    assert not any(c.join for c in received)
+    assert members(local) == members(remote)
+
+
+def test_digest_layout_mismatch(pushers):
+    local, remote = pushers
+    msg = PushPullDigest(local._mlist.local_node, [0] * 16)
+    resp = remote.handle_digest(msg)
+    # full state is streamed in chunks, not as one frame
+    assert [len(c.nodes) for c in resp] == [256, 246]
+    assert all(isinstance(c, PushPullChunk) for c in resp)
+
+
+@pytest.mark.asyncio
+async def test_digest_layout_mismatch_sync(config, loop):
+    remote = make_pusher(config._replace(push_pull_buckets=32), 7000, loop)
+    local = make_pusher(config, 7001, loop, remote)
+    for i in range(10):
+        remote._mlist.update_node(make_node_meta(8000 + i))
+    local._mlist.update_node(remote._mlist.local_node_meta)
+
+    await local.push_pull_address(remote._mlist.local_node)
+    received = local._tcp.received
+    assert all(isinstance(c, PushPullChunk) for c in received)
+    assert received[-1].last
+    assert members(local).keys() >= members(remote).keys()
+
+
+class SeedTCP:
+    """Seeds answer after given delay, None delay means seed never
+    answers, exception delay means seed fails and event delay means seed
+    answers once event is set.
+    """
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.synced = []
+
+    async def send_stream(self, address, messages, handler):
+        delay = self.delays[address]
+        if isinstance(delay, Exception):
+            raise delay
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if isinstance(delay, asyncio.Event):
+                await delay.wait()
+            else:
+                await asyncio.sleep(3600 if delay is None else delay)
+        finally:
+            self.in_flight -= 1
+        self.synced.append(address)
+        await handler(PushPullChunk(Node(*address), [], False, True))
+
+
+def seeds(n):
+    return [('127.0.0.1', 6000 + i) for i in range(n)]
+
+
+def make_join_pusher(config, loop, delays, **kw):
+    pusher = make_pusher(config._replace(**kw), 7001, loop)
+    pusher._tcp = SeedTCP(delays)
+    return pusher
+
+
+@pytest.mark.asyncio
+async def test_join_concurrent(config, loop):
+    hosts = seeds(8)
+    pusher = make_join_pusher(config, loop, {h: 0.05 for h in hosts},
+                              join_concurrency=4)
+    start = loop.time()
+    assert await pusher.join(*hosts) == 8
+    assert pusher._tcp.max_in_flight == 4
+    assert loop.time() - start < 0.2
+
+
+@pytest.mark.asyncio
+async def test_join_tolerates_failures(config, loop):
+    hosts = seeds(4)
+    # last seed sends response that can not be decoded
+    delays = {hosts[0]: ConnectionRefusedError(), hosts[1]: 0.01,
+              hosts[2]: asyncio.TimeoutError(),
+              hosts[3]: RuntimeError('no such message type')}
+    pusher = make_join_pusher(config, loop, delays)
+    assert await pusher.join(*hosts) == 1
+
+
+@pytest.mark.asyncio
+async def test_join_cancelled(config, loop):
+    hosts = seeds(2)
+    pusher = make_join_pusher(config, loop, {h: None for h in hosts})
+    join = loop.create_task(pusher.join(*hosts))
+    await asyncio.sleep(0.01)
+    assert pusher._tcp.in_flight == 2
+    join.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await join
+    await asyncio.sleep(0)
+    assert pusher._tcp.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_join_timeout(config, loop):
+    hosts = seeds(2)
+    pusher = make_join_pusher(config, loop, {hosts[0]: 0.01, hosts[1]: None},
+                              join_timeout=0.1)
+    start = loop.time()
+    assert await pusher.join(*hosts) == 1
+    assert loop.time() - start < 0.2
+    await asyncio.sleep(0)
+    assert pusher._tcp.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_join_first_success(config, loop):
+    hosts = seeds(3)
+    delays = {hosts[0]: 0.01, hosts[1]: 0.1, hosts[2]: None}
+    pusher = make_join_pusher(config, loop, delays, join_timeout=0.3)
+    assert await pusher.join(*hosts, first_success=True) == 1
+    assert pusher._tcp.synced == [hosts[0]]
+    assert len(pusher._background) == 2
+
+    await asyncio.sleep(0.15)
+    assert pusher._tcp.synced == [hosts[0], hosts[1]]
+    # blackholed seed is cancelled at join deadline
+    await asyncio.sleep(0.2)
+    assert pusher._background == set()
+    assert pusher._tcp.in_flight == 0
+    assert pusher._deadlines == set()
+
+
+@pytest.mark.asyncio
+async def test_join_background_deadline_cancelled(config, loop):
+    hosts = seeds(2)
+    answer = asyncio.Event()
+    delays = {hosts[0]: 0, hosts[1]: answer}
+    pusher = make_join_pusher(config, loop, delays, join_timeout=10)
+    assert await pusher.join(*hosts, first_success=True) == 1
+    handle, = pusher._deadlines
+    background = list(pusher._background)
+    answer.set()
+    await asyncio.gather(*background)
+    # background sync finished, deadline timer is not left behind
+    assert pusher._background == set()
+    assert pusher._deadlines == set() and handle.cancelled()
+
+    hosts = seeds(3)
+    pusher._tcp.delays[hosts[2]] = None
+    assert await pusher.join(hosts[0], hosts[2], first_success=True) == 1
+    handle, = pusher._deadlines
+    pusher.close()
+    assert handle.cancelled()
+
+
+def test_push_pull_scale():
+    assert push_pull_scale(30, 10) == 30
+    assert push_pull_scale(30, 32) == 30
+    assert push_pull_scale(30, 33) == 60
+    assert push_pull_scale(30, 64) == 60
+    assert push_pull_scale(30, 1000) == 30 * 6
+
+
+def test_adaptive_push_pull_interval(config, loop):
+    config = config._replace(adaptive_gossip=True, push_pull_interval=10,
+                             push_pull_scale_threshold=4,
+                             push_pull_interval_max=25)
+    pusher = make_pusher(config, 7000, loop)
+    assert pusher.push_pull_interval() == 10
+    for i in range(7):
+        pusher._mlist.update_node(make_node_meta(8000 + i))
+    # 8 nodes, twice the threshold
+    assert pusher.push_pull_interval() == 20
+    for i in range(7, 100):
+        pusher._mlist.update_node(make_node_meta(8000 + i))
+    assert pusher.push_pull_interval() == 25
+
+    pusher = make_pusher(config._replace(adaptive_gossip=False), 7001, loop)
+    for i in range(100):
+        pusher._mlist.update_node(make_node_meta(8000 + i))
+    assert pusher.push_pull_interval() == 10
@@ -0,0 +1,101 @@
+import json
+
+from aioc.mlist import MList
+from aioc.query import MemberIndex, parse_tags
+from aioc.state import Node, NodeStatus
+
+from conftest import make_node_meta
+
+
+def ports(snapshot):
+    return sorted(m.node.port for m in snapshot)
+
+
+def test_parse_tags():
+    assert parse_tags(b'role=web;zone=us-east-1a') == {
+        'role': 'web', 'zone': 'us-east-1a'}
+    tags = parse_tags(b'canary; role = db ;;')
+    assert tags == {'canary': '', 'role': 'db'}
+    assert parse_tags(b'') == {}
+    assert parse_tags(b'\xff') == {}
+
+
+def test_query_by_status_and_tags():
+    index = MemberIndex()
+    index.update(None, make_node_meta(1, meta=b'role=web;zone=a'))
+    index.update(None, make_node_meta(2, meta=b'role=web;zone=b'))
+    index.update(None, make_node_meta(3, meta=b'role=db;zone=a'))
+    index.update(None, make_node_meta(4, meta=b'role=web;zone=a',
+                                      status=NodeStatus.SUSPECT))
+
+    assert ports(index.query()) == [1, 2, 3, 4]
+    assert ports(index.query(NodeStatus.ALIVE)) == [1, 2, 3]
+    assert ports(index.query(tags={'role': 'web'})) == [1, 2, 4]
+    web_a = index.query(NodeStatus.ALIVE, {'role': 'web', 'zone': 'a'})
+    assert ports(web_a) == [1]
+    assert ports(index.query(tags={'role': 'cache'})) == []
+    assert ports(index.query(has=['zone'])) == [1, 2, 3, 4]
+    assert ports(index.query(NodeStatus.DEAD)) == []
+
+
+def test_incremental_update():
+    index = MemberIndex()
+    old = make_node_meta(1, meta=b'role=web')
+    index.update(None, old)
+    new = old._replace(meta=b'role=db', status=NodeStatus.DEAD,
+                       incarnation=2)
+    index.update(old, new)
+
+    assert ports(index.query(tags={'role': 'web'})) == []
+    assert ports(index.query(NodeStatus.ALIVE)) == []
+    dead = index.query(NodeStatus.DEAD, {'role': 'db'})
+    assert dead.members == (new,)
+    assert index.tags(new.node) == {'role': 'db'}
+    assert index._by_tag.keys() == {('role', 'db')}
+
+
+def test_snapshot_shared_until_change():
+    index = MemberIndex()
+    meta = make_node_meta(1, meta=b'role=web')
+    index.update(None, meta)
+    first = index.query(NodeStatus.ALIVE, {'role': 'web'})
+    assert index.query(NodeStatus.ALIVE, {'role': 'web'}) is first
+    assert first.version == index.version
+
+    index.update(None, make_node_meta(2, meta=b'role=web'))
+    second = index.query(NodeStatus.ALIVE, {'role': 'web'})
+    assert second is not first
+    assert second.version > first.version
+    # old snapshot is not affected by later changes
+    assert ports(first) == [1]
+    assert ports(second) == [1, 2]
+    assert isinstance(second.members, tuple)
+
+
+def test_pluggable_decoder():
+    def decode(meta):
+        if meta == b'bad':
+            raise ValueError(meta)
+        return json.loads(meta)
+
+    index = MemberIndex(decode)
+    index.update(None, make_node_meta(1, meta=b'{"role": "web"}'))
+    index.update(None, make_node_meta(2, meta=b'bad'))
+    assert ports(index.query(tags={'role': 'web'})) == [1]
+    assert ports(index.query(NodeStatus.ALIVE)) == [1, 2]
+
+
+def test_mlist_maintains_index(config):
+    mlist = MList(config, seed=1234)
+    for i in range(10):
+        zone = 'a' if i % 2 else 'b'
+        mlist.update_node(make_node_meta(
+            8080 + i, meta='role=web;zone={}'.format(zone).encode()))
+    node = Node('127.0.0.1', 8081)
+    suspect = mlist.node_meta(node)._replace(status=NodeStatus.SUSPECT)
+    mlist.update_node(suspect)
+
+    result = mlist.index.query(NodeStatus.ALIVE, {'zone': 'a'})
+    assert ports(result) == [8083, 8085, 8087, 8089]
+    # local node is a member too
+    assert len(mlist.index.query(NodeStatus.ALIVE)) == 10
@@ -1,8 +1,10 @@
 import pytest
 
-from aioc.dissemination_queue import DisseminationQueue, retransmit_limit
+from aioc.dissemination_queue import (DisseminationQueue, OverflowPolicy, pack,
+                                      retransmit_limit)
 from aioc.mlist import MList
-from aioc.state import NodeStatus, Node, NodeMeta, Suspect
+from aioc.state import (Alive, NodeStatus, Node, NodeMeta, Suspect,
+                        encode_message)
 
 
 @pytest.fixture
@@ -35,6 +37,100 @@ def test_basic(mlist, config):
     assert len(buffers) == 2
 
 
+def test_invalidate_same_node(mlist, config):
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    node1 = mlist.nodes[1]
+    msg1 = Suspect(mlist.local_node, node1, 3)
+    msg2 = Suspect(mlist.local_node, node1, 4)
+    dq.put(msg1)
+    dq.put(msg2)
+    assert len(dq) == 1
+    buffers = dq.get_update_up_to(100)
+    assert buffers == [encode_message(msg2)]
+
+
+def test_fewest_transmits_first(mlist, config):
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    msg1 = Suspect(mlist.local_node, mlist.nodes[1], 3)
+    msg2 = Suspect(mlist.local_node, mlist.nodes[2], 3)
+    raw1, raw2 = encode_message(msg1), encode_message(msg2)
+    dq.put(msg1)
+    assert dq.get_update_up_to(100) == [raw1]
+    dq.put(msg2)
+    # only one message fits, never transmitted one goes first
+    assert dq.get_update_up_to(len(raw2) + 4) == [raw2]
+    assert dq.get_update_up_to(100) == [raw1, raw2]
+
+
+def test_update_up_to_stops_scanning(mlist, config):
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    msgs = [Suspect(mlist.local_node, n, 1) for n in mlist.nodes[1:]]
+    for m in msgs:
+        dq.put(m)
+    # nothing fits, scan gives up without popping whole queue
+    assert dq.get_update_up_to(len(encode_message(msgs[0]))) == []
+    assert len(dq._heap) == len(msgs)
+    assert dq.get_update_up_to(1000) == [encode_message(m) for m in msgs]
+
+
+def test_update_packets_stops_scanning(mlist, config, monkeypatch):
+    from aioc import dissemination_queue
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    oversized = [Alive(mlist.local_node, Node('10.0.0.{}'.format(i), 1), 1,
+                       b'x' * 600) for i in range(20)]
+    msgs = [Suspect(mlist.local_node, n, 1) for n in mlist.nodes[1:]]
+    for m in oversized + msgs:
+        dq.put(m)
+
+    pops = []
+    heappop = dissemination_queue.heapq.heappop
+
+    def counting_heappop(heap):
+        pops.append(1)
+        return heappop(heap)
+
+    monkeypatch.setattr(dissemination_queue.heapq, 'heappop',
+                        counting_heappop)
+    assert dq.get_update_packets(508, 1) == []
+    assert len(pops) == dissemination_queue.MAX_SKIPPED
+    assert len(dq._heap) == len(oversized) + len(msgs)
+
+    # skipped entries go behind the others, queue is not blocked
+    sent = []
+    for _ in range(3):
+        for packet in dq.get_update_packets(508, 1):
+            sent.extend(packet)
+    assert sent == [encode_message(m) for m in msgs]
+
+
+def test_retransmit_limit_drops_message(mlist, config):
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    dq.put(Suspect(mlist.local_node, mlist.nodes[1], 3))
+    limit = retransmit_limit(config.retransmit_mult, mlist.num_nodes)
+    for _ in range(limit + 1):
+        assert len(dq.get_update_up_to(100)) == 1
+    assert len(dq) == 0
+    assert dq.get_update_up_to(100) == []
+
+
+@pytest.mark.parametrize('overflow', list(OverflowPolicy))
+def test_overflow(mlist, config, overflow):
+    dq = DisseminationQueue(mlist, config.retransmit_mult, max_size=3,
+                            overflow=overflow)
+    msgs = [Suspect(mlist.local_node, n, 1) for n in mlist.nodes[1:6]]
+    for m in msgs:
+        dq.put(m)
+    assert len(dq) == 3
+    assert dq.dropped == 2
+
+    if overflow == OverflowPolicy.DROP_OLDEST:
+        expected = msgs[2:5]
+    else:
+        expected = msgs[:3]
+    buffers = dq.get_update_up_to(1000)
+    assert buffers == [encode_message(m) for m in expected]
+
+
 def test_retransmit_limit():
     v = retransmit_limit(3, 0)
     assert v == 0
@@ -44,3 +140,51 @@ def test_retransmit_limit():
 
     v = retransmit_limit(3, 99)
     assert v == 6
+
+
+def test_encode_once(mlist, config, monkeypatch):
+    from aioc import dissemination_queue
+    calls = []
+
+    def encode(msg, codec):
+        calls.append(msg)
+        return encode_message(msg, codec)
+
+    monkeypatch.setattr(dissemination_queue, 'encode_message', encode)
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    msg = Suspect(mlist.local_node, mlist.nodes[1], 3)
+    dq.put(msg)
+    for _ in range(3):
+        buffers = dq.get_update_up_to(100)
+        assert buffers == [encode_message(msg)]
+    assert calls == [msg]
+
+
+def test_update_packets(mlist, config):
+    dq = DisseminationQueue(mlist, config.retransmit_mult)
+    msgs = [Suspect(mlist.local_node, n, 1) for n in mlist.nodes[1:]]
+    for m in msgs:
+        dq.put(m)
+    size = len(encode_message(msgs[0])) + 4
+    # room for 3 messages per packet with compound headers
+    packet_size = 3 * size + 5
+    packets = dq.get_update_packets(packet_size, 2)
+    assert [len(p) for p in packets] == [3, 3]
+    sent = [raw for p in packets for raw in p]
+    assert sent == [encode_message(m) for m in msgs[:6]]
+
+    # messages that were not sent yet go first
+    packets = dq.get_update_packets(packet_size, 2)
+    sent = [raw for p in packets for raw in p]
+    assert sent[:4] == [encode_message(m) for m in msgs[6:]]
+
+
+def test_pack():
+    items = [(5,), (3,), (7,), (2,), (4,), (9,)]
+    bins, unplaced = pack(items, 10, 2)
+    assert bins == [[(9,)], [(7,), (3,)]]
+    assert unplaced == [(5,), (4,), (2,)]
+
+    bins, unplaced = pack(items, 10, 3)
+    assert bins == [[(9,)], [(7,), (3,)], [(5,), (4,)]]
+    assert unplaced == [(2,)]
@@ -1,8 +1,20 @@
+import cbor
+import pytest
+
+from aioc.cluster import Cluster
+
 from aioc.state import (encode_message, decode_message, encode_messages,
-                        decode_messages)
+                        decode_messages, BINARY_CODEC, CBOR_CODEC,
+                        make_packet, make_compaund, add_msg_size,
+                        decode_msg_size, maybe_compress,
+                        decompress_payload, COMPRESS_MSG,
+                        ZLIB_COMPRESSION, LZMA_COMPRESSION, NO_COMPRESSION)
 from aioc.state import (Ping, Suspect, Node,
                         IndirectPingReq, AckResp, NackResp, Alive,
-                        Dead, PushPull, NodeMeta
+                        Dead, PushPull, PushPullDigest, PushPullDelta,
+                        PushPullChunk, AliveDigest, MetaReq, MetaResp, UserMsg,
+                        NodeMeta, NodeStatus,
+                        NodeRegistry, intern_node
                         )
 
 
@@ -16,8 +28,9 @@ def test_basic():
         Alive(Node("host", 9001), Node("host", 9001), 1, "data"),
         Dead(Node("host", 9001), 1, Node("host", 9001), Node("host", 9001)),
         PushPull(Node("host", 9001),
-                 [NodeMeta(Node("host", 9001), 1, "data", "ALIVE", 0)],
-                 True)
+                 [NodeMeta(Node("host", 9001), 1, "data", "ALIVE", 0, False)],
+                 True),
+        UserMsg(Node("host", 9001), 2 ** 63, b"data"),
     ]
 
     for msg in messages:
@@ -32,3 +45,176 @@ def test_compaund():
     raw_msg = encode_messages(ping, ack)
     ms = decode_messages(raw_msg)
     assert [ping, ack] == ms
+
+
+def binary_messages():
+    ip, host = Node("10.0.0.1", 9001), Node("host", 9002)
+    return [
+        Ping(ip, 1, host),
+        IndirectPingReq(host, 2 ** 32 - 1, ip, False),
+        AckResp(ip, 1, b"data"),
+        NackResp(host, 1),
+        Suspect(ip, host, 1),
+        Alive(ip, Node("127.1", 9001), 2 ** 40, b"x" * 300),
+        Dead(host, 1, ip, host),
+        PushPull(ip,
+                 [NodeMeta(ip, 1, b"data", NodeStatus.ALIVE, 1.5, True),
+                  NodeMeta(host, 7, b"", NodeStatus.SUSPECT, 0, False),
+                  NodeMeta(host, 8, b"", NodeStatus.ALIVE, 0, False,
+                           b"h" * 16)],
+                 True),
+        PushPullDigest(host, [2 ** 32 - 1, 3735928559, 305419896]),
+        PushPullDelta(ip,
+                      [NodeMeta(host, 3, b"meta", NodeStatus.DEAD, 2.5,
+                                False)],
+                      [0, 200, 4095]),
+        PushPullChunk(host,
+                      [NodeMeta(ip, 1, b"data", NodeStatus.ALIVE, 1.5, True)],
+                      False, True),
+        AliveDigest(ip, host, 2 ** 40, b"h" * 16),
+        MetaReq(host, b"h" * 16),
+        MetaResp(ip, b"h" * 16, b"x" * 20000),
+        UserMsg(host, 2 ** 64 - 1, b"invalidate:users/42"),
+    ]
+
+
+@pytest.mark.parametrize('msg', binary_messages())
+def test_binary_codec(msg):
+    raw_msg = encode_message(msg, BINARY_CODEC)
+    assert decode_message(raw_msg) == msg
+    assert len(raw_msg) <= len(encode_message(msg, CBOR_CODEC))
+
+
+@pytest.mark.parametrize('codec', [CBOR_CODEC, BINARY_CODEC])
+def test_pending_meta_hash(codec):
+    ip = Node("10.0.0.1", 9001)
+    fetched = NodeMeta(ip, 1, b"data", NodeStatus.ALIVE, 1.5, False)
+    pending = fetched._replace(incarnation=2, meta_hash=b"h" * 16)
+    msg = PushPull(ip, [fetched, pending], False)
+    assert decode_message(encode_message(msg, codec)) == msg
+
+
+def test_fetched_meta_cbor_layout():
+    ip = Node("10.0.0.1", 9001)
+    fetched = NodeMeta(ip, 1, b"data", NodeStatus.ALIVE, 1.5, False)
+    raw_msg = encode_message(PushPull(ip, [fetched], False), CBOR_CODEC)
+    # members without pending hash are encoded as before
+    assert len(cbor.loads(raw_msg[1:])[1][0]) == 6
+
+
+@pytest.mark.parametrize('host', ['h', 'h' * 255, 'ä' * 127, '127.1',
+                                  '10.0.0.1'])
+def test_binary_host_edge_cases(host):
+    msg = Suspect(Node(host, 1), Node(host, 65535), 1)
+    raw_msg = encode_message(msg, BINARY_CODEC)
+    assert decode_message(raw_msg) == msg
+
+
+@pytest.mark.parametrize('host', ['', 'h' * 256, 'ä' * 128])
+def test_invalid_host(config, loop, host):
+    msg = Suspect(Node(host, 1), Node('10.0.0.1', 1), 1)
+    with pytest.raises(ValueError, match='Host must be'):
+        encode_message(msg, BINARY_CODEC)
+    with pytest.raises(ValueError, match='Host must be'):
+        Cluster(config._replace(host=host), loop=loop)
+
+
+def test_binary_compaund():
+    ping = Ping(Node("host", 9001), 1, Node("host", 9001))
+    ack = AckResp(Node("host", 9001), 1, b"data")
+    raw_msg = encode_messages(ping, ack, codec=BINARY_CODEC)
+    assert decode_messages(raw_msg) == [ping, ack]
+
+
+def test_packet_framing():
+    ping = Ping(Node("host", 9001), 1, Node("host", 9001))
+    ack = AckResp(Node("host", 9001), 1, b"data")
+    raw = [encode_message(ping), encode_message(ack)]
+    packet = make_packet(*raw)
+    assert packet == add_msg_size(make_compaund(*raw))
+    assert decode_msg_size(packet) == len(packet) - 4
+
+    view = memoryview(packet)[4:]
+    assert decode_messages(view) == [ping, ack]
+
+
+@pytest.mark.parametrize('codec', [CBOR_CODEC, BINARY_CODEC])
+def test_decoded_nodes_interned(codec):
+    msg = Alive(Node("10.0.0.1", 9001), Node("host", 9002), 1, b"")
+    a = decode_message(encode_message(msg, codec))
+    b = decode_message(encode_message(msg, codec))
+    assert a.sender is b.sender
+    assert a.node is b.node
+    assert a.sender is intern_node("10.0.0.1", 9001)
+
+
+def test_node_registry():
+    registry = NodeRegistry(max_size=2)
+    n1 = registry.intern("host", 1)
+    assert registry.intern("host", 1) is n1
+    assert n1 == Node("host", 1)
+    registry.intern("host", 2)
+    assert len(registry) == 2
+    # overflow drops table, nodes stay equal but are not same objects
+    registry.intern("host", 3)
+    assert len(registry) == 1
+    assert registry.intern("host", 1) == n1
+
+
+def make_push_pull(num_members):
+    members = [
+        NodeMeta(Node('10.0.{}.{}'.format(i // 250, i % 250), 7946),
+                 i, b'role=web;zone=us-east-1a', NodeStatus.ALIVE, 0, False)
+        for i in range(num_members)]
+    return PushPull(Node('10.0.0.1', 7946), members, False)
+
+
+@pytest.mark.parametrize('algorithm', [ZLIB_COMPRESSION, LZMA_COMPRESSION])
+@pytest.mark.parametrize('codec', [CBOR_CODEC, BINARY_CODEC])
+def test_compressed_message(algorithm, codec):
+    msg = make_push_pull(500)
+    raw = encode_message(msg, codec)
+    compressed = maybe_compress(raw, algorithm, threshold=1024)
+    assert compressed[0] == COMPRESS_MSG
+    assert len(compressed) * 4 < len(raw)
+    assert decode_message(compressed) == msg
+    assert decode_messages(compressed) == [msg]
+
+
+def test_compression_skipped():
+    ping = encode_message(Ping(Node("host", 9001), 1, Node("host", 9001)))
+    assert maybe_compress(ping, threshold=1024) is ping
+    assert maybe_compress(ping, NO_COMPRESSION) is ping
+    # incompressible payload stays as is
+    assert maybe_compress(ping, ZLIB_COMPRESSION, threshold=0) is ping
+
+
+def test_compressed_packet():
+    ping = Ping(Node("host", 9001), 1, Node("host", 9001))
+    alive = Alive(Node("host", 9001), Node("host", 9002), 1, b"x" * 200)
+    raw = make_compaund(encode_message(ping), encode_message(alive))
+    packet = add_msg_size(maybe_compress(raw))
+    assert len(packet) < len(raw)
+    view = memoryview(packet)[4:]
+    assert decode_messages(view) == [ping, alive]
+
+
+def test_decompression_limit(monkeypatch):
+    import aioc.state
+    raw = maybe_compress(b"\x07" + b"a" * 5000)
+    monkeypatch.setattr(aioc.state, 'MAX_DECOMPRESSED_SIZE', 1000)
+    with pytest.raises(RuntimeError):
+        decompress_payload(raw)
+
+
+def test_decompression_limit_per_call():
+    alive = Alive(Node("host", 9001), Node("host", 9002), 1, b"x" * 20000)
+    raw = maybe_compress(encode_message(alive))
+    assert len(raw) < 508
+    assert decode_messages(raw) == [alive]
+    with pytest.raises(RuntimeError):
+        decode_messages(raw, 508 * 16)
+    # limit applies to compressed messages inside compound packet too
+    packet = make_compaund(raw, encode_message(alive._replace(meta=b"")))
+    with pytest.raises(RuntimeError):
+        decode_messages(packet, 508 * 16)
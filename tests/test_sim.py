@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pytest
+
+from aioc.sim import SimLoop, SimNetwork, Simulation
+from aioc.state import NodeStatus
+
+
+@pytest.fixture
+def sim():
+    s = Simulation(10, seed=1)
+    s.run(s.boot())
+    s.run(s.join())
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def sim_loop():
+    loop = SimLoop()
+    yield loop
+    loop.close()
+
+
+class Protocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.received = []
+
+    def datagram_received(self, data, addr):
+        self.received.append((data, addr))
+
+
+def test_virtual_clock(sim_loop):
+    start = time.monotonic()
+    sim_loop.run_until_complete(asyncio.sleep(3600))
+    assert sim_loop.time() >= 3600
+    assert time.monotonic() - start < 1
+
+
+def test_idle_simulation_raises(sim_loop):
+    fut = sim_loop.create_future()
+    with pytest.raises(RuntimeError):
+        sim_loop.run_until_complete(fut)
+
+
+def test_datagram_latency_and_loss(sim_loop):
+    net = SimNetwork(sim_loop, latency=0.05)
+    a, b = ('10.0.0.1', 1), ('10.0.0.2', 1)
+
+    async def go():
+        ta, _ = await net.transport(a).create_datagram_endpoint(Protocol, a)
+        _, pb = await net.transport(b).create_datagram_endpoint(Protocol, b)
+        ta.sendto(b'ping', b)
+        await asyncio.sleep(0.04)
+        assert pb.received == []
+        await asyncio.sleep(0.02)
+        assert pb.received == [(b'ping', a)]
+
+        net.loss = 1
+        ta.sendto(b'lost', b)
+        await asyncio.sleep(1)
+        assert len(pb.received) == 1
+
+    sim_loop.run_until_complete(go())
+    assert net.bytes_sent[a] == 8
+    assert net.packets_dropped == 1
+
+
+def test_partition(sim_loop):
+    net = SimNetwork(sim_loop)
+    a, b, c = ('10.0.0.1', 1), ('10.0.0.2', 1), ('10.0.0.3', 1)
+    net.partition([a, b])
+    assert net.reachable(a, b)
+    assert not net.reachable(a, c)
+    net.heal()
+    assert net.reachable(a, c)
+    net.disconnect(c)
+    assert not net.reachable(c, a)
+
+
+def test_stream_keeps_order(sim_loop):
+    net = SimNetwork(sim_loop, latency=0.01, jitter=0.05, seed=1)
+    a, b = ('10.0.0.1', 1), ('10.0.0.2', 1)
+    received = []
+
+    async def handle(reader, writer):
+        data = await reader.read()
+        received.append(data)
+        writer.close()
+
+    async def go():
+        await net.transport(b).start_server(handle, *b)
+        reader, writer = await net.transport(a).open_connection(*b)
+        for i in range(100):
+            writer.write(bytes([i]))
+        writer.close()
+        assert await reader.read() == b''
+
+    sim_loop.run_until_complete(go())
+    assert received == [bytes(range(100))]
+
+
+def test_connection_refused(sim_loop):
+    net = SimNetwork(sim_loop)
+    with pytest.raises(ConnectionRefusedError):
+        sim_loop.run_until_complete(
+            net.transport(('10.0.0.1', 1)).open_connection('10.0.0.2', 1))
+
+
+def test_cluster_converges(sim):
+    assert sim.run(sim.wait_converged(timeout=30)) is not None
+    sim.run(sim.sleep(30))
+    assert sim.converged()
+    stats = sim.stats()
+    assert stats['false_deaths'] == 0
+    assert stats['bytes_per_node_per_second'] > 0
+
+
+def test_failure_detected(sim):
+    sim.run(sim.wait_converged(timeout=30))
+    sim.fail(3)
+    assert not sim.converged()
+    detected = sim.run(sim.wait_converged(timeout=120))
+    assert detected is not None
+    failed = sim.addresses[3]
+    for cluster in sim.live_clusters:
+        assert cluster._mlist.node_meta(failed).status == NodeStatus.DEAD
+    assert sim.stats()['false_positive_rate'] == 0
+
+
+def test_partitioned_cluster_splits(sim):
+    sim.run(sim.wait_converged(timeout=30))
+    sim.network.partition(sim.addresses[:5])
+    sim.run(sim.sleep(120))
+    view = sim.clusters[0]._mlist.node_meta(sim.addresses[7])
+    assert view.status == NodeStatus.DEAD
+    view = sim.clusters[0]._mlist.node_meta(sim.addresses[1])
+    assert view.status == NodeStatus.ALIVE
+
+
+def test_user_broadcast(sim):
+    sim.run(sim.wait_converged(timeout=30))
+    inboxes = [c.messages() for c in sim.clusters[1:]]
+    waiter = sim.clusters[0].broadcast(b'invalidate:users/42')
+    assert sim.run(waiter)
+    for inbox in inboxes:
+        msg = sim.run(inbox.get())
+        assert msg.sender == sim.clusters[0].local_node
+        assert msg.payload == b'invalidate:users/42'
+        assert len(inbox) == 0
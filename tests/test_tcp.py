@@ -0,0 +1,156 @@
+import asyncio
+import pytest
+
+from aioc.metrics import Metrics
+from aioc.state import Ping, AckResp, Node, PushPullChunk, COMPRESS_MSG
+from aioc.tcp import create_tcp_server
+
+
+@pytest.fixture
+def tcp_config(config):
+    return config._replace(tcp_connect_timeout=1, tcp_read_timeout=0.2,
+                           tcp_idle_timeout=0.2)
+
+
+class Server:
+
+    def __init__(self):
+        self.connections = set()
+        self.respond = True
+        self.close_after_response = False
+        self.chunks = []
+
+    async def handle(self, message, conn):
+        self.connections.add(conn.writer)
+        if isinstance(message, PushPullChunk):
+            self.chunks.append(message)
+            if message.last:
+                await self.cm.send_stream_response(conn, self.chunks)
+            return
+        if not self.respond:
+            return
+        ack = AckResp(Node('127.0.0.1', 0), message.sequence_num, b'')
+        self.cm.send_response(conn, ack)
+        if self.close_after_response:
+            await conn.writer.drain()
+            conn.writer.close()
+
+
+def start_server(config, loop):
+    return loop.run_until_complete(create_tcp_server(
+        host='127.0.0.1', port=0, config=config, loop=loop))
+
+
+@pytest.fixture
+def server(tcp_config, loop):
+    s = Server()
+    s.cm = start_server(tcp_config, loop)
+    s.cm.set_handler(s.handle)
+    s.address = s.cm._server.sockets[0].getsockname()[:2]
+    yield s
+    loop.run_until_complete(s.cm.close())
+
+
+@pytest.fixture
+def client(tcp_config, loop):
+    cm = start_server(tcp_config, loop)
+    yield cm
+    loop.run_until_complete(cm.close())
+
+
+def ping(seq):
+    return Ping(Node('127.0.0.1', 1), seq, Node('127.0.0.1', 2))
+
+
+@pytest.mark.asyncio
+async def test_requests_reuse_connection(server, client):
+    for i in range(5):
+        resp = await client.send_message(server.address, ping(i))
+        assert resp.sequence_num == i
+    assert len(server.connections) == 1
+    assert len(client.pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests(server, client):
+    resps = await asyncio.gather(
+        *[client.send_message(server.address, ping(i)) for i in range(4)])
+    assert [r.sequence_num for r in resps] == list(range(4))
+    # idle connections above limit are closed on release
+    assert len(client.pool) == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_closed_connection(server, client):
+    server.close_after_response = True
+    for i in range(3):
+        resp = await client.send_message(server.address, ping(i))
+        assert resp.sequence_num == i
+    assert len(server.connections) == 3
+
+
+@pytest.mark.asyncio
+async def test_read_timeout(server, client):
+    server.respond = False
+    with pytest.raises(asyncio.TimeoutError):
+        await client.send_message(server.address, ping(1))
+    assert len(client.pool) == 0
+
+    server.respond = True
+    resp = await client.send_message(server.address, ping(2))
+    assert resp.sequence_num == 2
+
+
+@pytest.mark.asyncio
+async def test_idle_eviction(server, client):
+    await client.send_message(server.address, ping(1))
+    assert len(client.pool) == 1
+    await asyncio.sleep(0.5)
+    assert len(client.pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_stream(server, client):
+    sender = Node('127.0.0.1', 1)
+    chunks = [PushPullChunk(sender, [], True, i == 2) for i in range(3)]
+    received = []
+
+    async def handler(message):
+        received.append(message)
+        return message.last
+
+    await client.send_stream(server.address, chunks, handler)
+    assert server.chunks == chunks
+    assert received == chunks
+
+    # connection is back in pool and usable for plain requests
+    resp = await client.send_message(server.address, ping(1))
+    assert resp.sequence_num == 1
+    assert len(server.connections) == 1
+
+
+@pytest.mark.parametrize('tcp_compression', [False, True])
+def test_frame_compression(tcp_config, loop, tcp_compression):
+    cm = start_server(
+        tcp_config._replace(tcp_compression=tcp_compression), loop)
+    payload = cm._encode(AckResp(Node('127.0.0.1', 1), 1, b'x' * 4096))
+    # compression is opt-in, so peers without it can decode frames
+    assert (payload[0] == COMPRESS_MSG) == tcp_compression
+    loop.run_until_complete(cm.close())
+
+
+@pytest.mark.asyncio
+async def test_metrics(server, tcp_config, loop):
+    metrics = Metrics()
+    client = await create_tcp_server(
+        host='127.0.0.1', port=0, config=tcp_config, loop=loop,
+        metrics=metrics)
+    for i in range(3):
+        await client.send_message(server.address, ping(i))
+    await client.close()
+
+    snapshot = metrics.snapshot()
+    assert snapshot['tcp.connections_opened'] == 1
+    assert snapshot['tcp.connections_reused'] == 2
+    assert snapshot['tcp.frames_sent'] == {'ping': 3}
+    assert snapshot['tcp.frames_received'] == {'ack': 3}
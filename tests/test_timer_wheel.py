@@ -0,0 +1,100 @@
+import pytest
+
+from aioc.timer_wheel import TimerWheel
+
+
+class FakeLoop:
+
+    def __init__(self):
+        self.now = 0.0
+        self.handles = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        handle = FakeHandle(callback)
+        self.handles.append(handle)
+        return handle
+
+
+class FakeHandle:
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def clock():
+    return FakeLoop()
+
+
+def run_until(wheel, clock, t):
+    clock.now = t
+    wheel.advance()
+
+
+def test_fire_in_order(clock):
+    wheel = TimerWheel(0.1, slots=8, levels=3, loop=clock)
+    fired = []
+    for t in (0.5, 0.2, 3.0, 40.0):
+        wheel.call_later(t, lambda t=t: fired.append((t, clock.now)))
+    assert len(wheel) == 4
+
+    run_until(wheel, clock, 0.25)
+    assert [t for t, _ in fired] == [0.2]
+    run_until(wheel, clock, 2.0)
+    run_until(wheel, clock, 100.0)
+    assert [t for t, _ in fired] == [0.2, 0.5, 3.0, 40.0]
+    assert len(wheel) == 0
+
+
+def test_cascade_fires_on_time(clock):
+    wheel = TimerWheel(1, slots=4, levels=3, loop=clock)
+    fired = []
+    timeouts = list(range(1, 100))
+    for t in timeouts:
+        wheel.call_later(t, lambda t=t: fired.append((t, clock.now)))
+
+    # turn wheel one tick at a time, every timer fires exactly on its tick
+    for now in range(1, 101):
+        run_until(wheel, clock, now)
+    assert fired == [(t, t) for t in timeouts]
+
+
+def test_cancel_and_reschedule(clock):
+    wheel = TimerWheel(0.1, loop=clock)
+    fired = []
+    t1 = wheel.call_later(1, lambda: fired.append(1))
+    t2 = wheel.call_later(1, lambda: fired.append(2))
+    t1.cancel()
+    assert not t1.active
+    assert len(wheel) == 1
+    t2.reschedule(5)
+    run_until(wheel, clock, 2)
+    assert fired == []
+    run_until(wheel, clock, 5.1)
+    assert fired == [2]
+
+
+def test_idle_wheel_stops_ticking(clock):
+    wheel = TimerWheel(0.1, loop=clock)
+    timer = wheel.call_later(1, lambda: None)
+    assert len(clock.handles) == 1
+    timer.cancel()
+    run_until(wheel, clock, 0.1)
+    assert len(clock.handles) == 1
+
+    # after long idle period wheel catches up with clock at once
+    clock.now = 1000
+    fired = []
+    wheel.call_later(0.3, lambda: fired.append(clock.now))
+    run_until(wheel, clock, 1000.25)
+    assert fired == []
+    run_until(wheel, clock, 1000.45)
+    assert fired == [1000.45]
+    wheel.close()